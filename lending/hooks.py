@@ -12,6 +12,7 @@ audit_trail_doctypes = [
 	"Loan Balance Adjustment",
 	"Loan Disbursement",
 	"Loan Interest Accrual",
+	"Loan Penalty Accrual",
 	"Loan Refund",
 	"Loan Repayment",
 	"Loan Write Off",
@@ -123,10 +124,17 @@ doc_events = {
 # ---------------
 
 scheduler_events = {
+	"all": [
+		"lending.loan_management.doctype.process_loan_classification.process_loan_classification.process_pending_loan_classifications",
+	],
+	"hourly": [
+		"lending.loan_management.doctype.loan_security_position.loan_security_position.refresh_loan_security_exposure",
+	],
 	"daily_long": [
 		"lending.loan_management.doctype.process_loan_security_shortfall.process_loan_security_shortfall.create_process_loan_security_shortfall",
 		"lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual.process_loan_interest_accrual_for_term_loans",
-		"lending.loan_management.doctype.process_loan_classification.process_loan_classification.create_process_loan_classification",
+		"lending.loan_management.doctype.loan_penalty_accrual.loan_penalty_accrual.process_loan_penalty_accrual",
+		"lending.loan_management.doctype.process_loan_classification.process_loan_classification.process_daily_loan_classification",
 	],
 	"monthly_long": [
 		"lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual.process_loan_interest_accrual_for_demand_loans",
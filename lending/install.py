@@ -52,10 +52,17 @@ LOAN_CUSTOM_FIELDS = {
 			"insert_after": "interest_day_count_convention",
 			"non_negative": 1,
 		},
+		{
+			"fieldname": "classify_loans_immediately_on_repayment",
+			"label": "Classify Loans Immediately on Repayment",
+			"fieldtype": "Check",
+			"insert_after": "min_days_bw_disbursement_first_repayment",
+			"description": "By default loans are reclassified in the background a few minutes after a repayment",
+		},
 		{
 			"fieldname": "loan_column_break",
 			"fieldtype": "Column Break",
-			"insert_after": "min_days_bw_disbursement_first_repayment",
+			"insert_after": "classify_loans_immediately_on_repayment",
 		},
 		{
 			"fieldname": "collection_offset_logic_based_on",
@@ -5,8 +5,8 @@
 import frappe
 from frappe.utils.dashboard import cache_source
 
-from lending.loan_management.report.applicant_wise_loan_security_exposure.applicant_wise_loan_security_exposure import (
-	get_loan_security_details,
+from lending.loan_management.doctype.loan_security_position.loan_security_position import (
+	get_loan_security_exposure,
 )
 
 
@@ -29,69 +29,17 @@ def get_data(
 		chart = frappe._dict(frappe.parse_json(chart))
 
 	filters = {}
-	current_pledges = {}
 
 	if filters:
 		filters = frappe.parse_json(filters)[0]
 
-	conditions = ""
 	labels = []
 	values = []
 
-	if filters.get("company"):
-		conditions = "AND company = %(company)s"
-
-	loan_security_details = get_loan_security_details()
-
-	unpledges = frappe._dict(
-		frappe.db.sql(
-			"""
-		SELECT u.loan_security, sum(u.qty) as qty
-		FROM `tabLoan Security Unpledge` up, `tabUnpledge` u
-		WHERE u.parent = up.name
-		AND up.status = 'Approved'
-		{conditions}
-		GROUP BY u.loan_security
-	""".format(
-				conditions=conditions
-			),
-			filters,
-			as_list=1,
-		)
-	)
-
-	pledges = frappe._dict(
-		frappe.db.sql(
-			"""
-		SELECT p.loan_security, sum(p.qty) as qty
-		FROM `tabLoan Security Pledge` lp, `tabPledge`p
-		WHERE p.parent = lp.name
-		AND lp.status = 'Pledged'
-		{conditions}
-		GROUP BY p.loan_security
-	""".format(
-				conditions=conditions
-			),
-			filters,
-			as_list=1,
-		)
-	)
-
-	for security, qty in pledges.items():
-		current_pledges.setdefault(security, qty)
-		current_pledges[security] -= unpledges.get(security, 0.0)
-
-	sorted_pledges = dict(sorted(current_pledges.items(), key=lambda item: item[1], reverse=True))
-
-	count = 0
-	for security, qty in sorted_pledges.items():
-		values.append(qty * loan_security_details.get(security, {}).get("latest_price", 0))
-		labels.append(security)
-		count += 1
-
-		## Just need top 10 securities
-		if count == 10:
-			break
+	## Just need top 10 securities
+	for security in get_loan_security_exposure(filters.get("company"))[:10]:
+		values.append(security.value)
+		labels.append(security.loan_security)
 
 	return {
 		"labels": labels,
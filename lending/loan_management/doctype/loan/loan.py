@@ -7,6 +7,7 @@ import json
 import frappe
 from frappe import _
 from frappe.query_builder import Order
+from frappe.query_builder.functions import Max, Min
 from frappe.utils import (
 	add_days,
 	cint,
@@ -22,9 +23,18 @@ import erpnext
 from erpnext.accounts.doctype.journal_entry.journal_entry import get_payment_entry
 from erpnext.controllers.accounts_controller import AccountsController
 
+from lending.loan_management.doctype.loan_repayment_schedule.loan_repayment_schedule import (
+	get_monthly_repayment_amount,
+	get_repayment_schedule,
+)
+from lending.loan_management.doctype.loan_security_position.loan_security_position import (
+	delete_loan_security_positions,
+	update_loan_security_position,
+)
 from lending.loan_management.doctype.loan_security_unpledge.loan_security_unpledge import (
 	get_pledged_security_qty,
 )
+from lending.loan_management.utils import bulk_insert_docs, get_series_names
 
 
 class Loan(AccountsController):
@@ -45,8 +55,8 @@ class Loan(AccountsController):
 
 	def after_insert(self):
 		if self.is_term_loan:
-			self.make_draft_schedule()
-			self.calculate_totals(on_insert=True)
+			schedule = self.make_draft_schedule()
+			self.calculate_totals(on_insert=True, schedule=schedule)
 
 	def validate_accounts(self):
 		for fieldname in [
@@ -78,16 +88,9 @@ class Loan(AccountsController):
 				self.loan_product,
 				["cyclic_day_of_the_month", "min_days_bw_disbursement_first_repayment"],
 			)
-			cycle_day = cint(cycle_day)
-
-			last_day_of_month = get_last_day(self.posting_date)
-			cyclic_date = add_days(last_day_of_month, cycle_day)
-
-			broken_period_days = date_diff(cyclic_date, self.posting_date)
-			if broken_period_days < min_days_bw_disbursement_first_repayment:
-				cyclic_date = add_days(get_last_day(cyclic_date), cycle_day)
-
-			self.repayment_start_date = cyclic_date
+			self.repayment_start_date = get_cyclic_date(
+				self.posting_date, cycle_day, min_days_bw_disbursement_first_repayment
+			)
 
 	def on_submit(self):
 		self.link_loan_security_pledge()
@@ -138,7 +141,7 @@ class Loan(AccountsController):
 			)
 
 	def make_draft_schedule(self):
-		frappe.get_doc(
+		return frappe.get_doc(
 			{
 				"doctype": "Loan Repayment Schedule",
 				"loan": self.name,
@@ -189,13 +192,15 @@ class Loan(AccountsController):
 			schedule = frappe.get_doc("Loan Repayment Schedule", schedule)
 			schedule.cancel()
 
-	def calculate_totals(self, on_insert=False):
+	def calculate_totals(self, on_insert=False, schedule=None):
 		self.total_payment = 0
 		self.total_interest_payable = 0
 		self.total_amount_paid = 0
 
 		if self.is_term_loan:
-			schedule = frappe.get_doc("Loan Repayment Schedule", {"loan": self.name, "docstatus": 0})
+			if not schedule:
+				schedule = frappe.get_doc("Loan Repayment Schedule", {"loan": self.name, "docstatus": 0})
+
 			for data in schedule.repayment_schedule:
 				self.total_payment += data.total_payment
 				self.total_interest_payable += data.interest_amount
@@ -205,9 +210,13 @@ class Loan(AccountsController):
 			self.total_payment = self.loan_amount
 
 		if on_insert:
-			self.db_set("total_interest_payable", self.total_interest_payable)
-			self.db_set("monthly_repayment_amount", self.monthly_repayment_amount)
-			self.db_set("total_payment", self.total_payment)
+			self.db_set(
+				{
+					"total_interest_payable": self.total_interest_payable,
+					"monthly_repayment_amount": self.monthly_repayment_amount,
+					"total_payment": self.total_payment,
+				}
+			)
 
 	def set_loan_amount(self):
 		if self.loan_application and not self.loan_amount:
@@ -230,6 +239,12 @@ class Loan(AccountsController):
 			)
 
 			if maximum_loan_value:
+				pledges = frappe.get_all(
+					"Loan Security Pledge",
+					filters={"loan_application": self.loan_application, "status": "Requested"},
+					pluck="name",
+				)
+
 				frappe.db.sql(
 					"""
 					UPDATE `tabLoan Security Pledge`
@@ -239,6 +254,18 @@ class Loan(AccountsController):
 					(self.name, now_datetime(), self.loan_application),
 				)
 
+				update_loan_security_position(
+					self.name,
+					self.applicant_type,
+					self.applicant,
+					self.company,
+					frappe.get_all(
+						"Pledge",
+						filters={"parent": ("in", pledges), "parenttype": "Loan Security Pledge"},
+						fields=["loan_security", "loan_security_type", "qty"],
+					),
+				)
+
 				self.db_set("maximum_loan_amount", maximum_loan_value)
 
 	def accrue_loan_interest(self):
@@ -263,6 +290,8 @@ class Loan(AccountsController):
 				tuple(pledge_list),
 			)  # nosec
 
+		delete_loan_security_positions(self.name)
+
 
 def update_total_amount_paid(doc):
 	total_amount_paid = 0
@@ -324,6 +353,19 @@ def get_total_loan_amount(applicant_type, applicant, company):
 	return pending_amount
 
 
+def get_cyclic_date(posting_date, cycle_day, min_days_bw_disbursement_first_repayment):
+	cycle_day = cint(cycle_day)
+
+	last_day_of_month = get_last_day(posting_date)
+	cyclic_date = add_days(last_day_of_month, cycle_day)
+
+	broken_period_days = date_diff(cyclic_date, posting_date)
+	if broken_period_days < cint(min_days_bw_disbursement_first_repayment):
+		cyclic_date = add_days(get_last_day(cyclic_date), cycle_day)
+
+	return cyclic_date
+
+
 def get_sanctioned_amount_limit(applicant_type, applicant, company):
 	return frappe.db.get_value(
 		"Sanctioned Loan Amount",
@@ -575,59 +617,257 @@ def make_refund_jv(loan, amount=0, reference_number=None, reference_date=None, s
 
 @frappe.whitelist()
 def update_days_past_due_in_loans(
-	posting_date=None, loan_product=None, loan_name=None, process_loan_classification=None
+	posting_date=None,
+	loan_product=None,
+	loan_name=None,
+	process_loan_classification=None,
+	loan_names=None,
 ):
 	"""Update days past due in loans"""
-	posting_date = posting_date or getdate()
+	posting_date = getdate(posting_date or getdate())
 
-	accruals = get_pending_loan_interest_accruals(loan_product=loan_product, loan_name=loan_name)
+	loans = get_loans_for_dpd_update(
+		loan_product=loan_product, loan_name=loan_name, loan_names=loan_names
+	)
+	classification_ranges = get_classification_ranges()
 	threshold_map = get_dpd_threshold_map()
-	checked_loans = []
 
-	for loan in accruals:
-		is_npa = 0
-		days_past_due = date_diff(getdate(posting_date), getdate(loan.due_date))
-		if days_past_due < 0:
-			days_past_due = 0
+	changed_loans = {}
+	npa_applicants = set()
+	applicants_to_review = set()
+	dpd_logs = []
+
+	for loan in loans:
+		days_past_due = 0
+		if loan.due_date:
+			days_past_due = max(date_diff(posting_date, getdate(loan.due_date)), 0)
+
+		classification_code, classification_name = get_classification_for_dpd(
+			days_past_due, classification_ranges.get(loan.company, [])
+		)
+
+		if (
+			cint(loan.days_past_due),
+			loan.classification_code or "",
+			loan.classification_name or "",
+		) != (days_past_due, classification_code, classification_name):
+			changed_loans.setdefault((days_past_due, classification_code, classification_name), []).append(
+				loan.name
+			)
 
 		threshold = threshold_map.get(loan.loan_product, 0)
+		applicant = (loan.applicant_type, loan.applicant)
 
 		if days_past_due and threshold and days_past_due > threshold:
-			is_npa = 1
-
-		update_loan_and_customer_status(
-			loan.loan,
-			loan.company,
-			loan.applicant_type,
-			loan.applicant,
-			days_past_due,
-			is_npa,
-			posting_date or getdate(),
+			npa_applicants.add(applicant)
+		elif loan.is_npa or loan.manual_npa:
+			applicants_to_review.add(applicant)
+
+		dpd_logs.append(
+			frappe.get_doc(
+				{
+					"doctype": "Days Past Due Log",
+					"loan": loan.name,
+					"posting_date": posting_date,
+					"days_past_due": days_past_due,
+					"process_loan_classification": process_loan_classification,
+				}
+			)
 		)
 
-		create_dpd_record(loan.loan, posting_date, days_past_due, process_loan_classification)
-		checked_loans.append(loan.loan)
+	for (days_past_due, classification_code, classification_name), names in changed_loans.items():
+		update_dpd_and_classification(names, days_past_due, classification_code, classification_name)
 
-	open_loans_with_no_overdue = []
-	if loan_name and not accruals:
-		open_loans_with_no_overdue = [
-			frappe.db.get_value(
-				"Loan", loan_name, ["name", "company", "applicant_type", "applicant"], as_dict=1
-			)
-		]
-	elif not loan_name:
-		open_loans_with_no_overdue = frappe.db.get_all(
+	bulk_insert_docs(dpd_logs)
+
+	already_npa = get_applicants_with_all_loans_npa(npa_applicants)
+
+	for applicant_type, applicant in npa_applicants - already_npa:
+		for loan in frappe.get_all(
 			"Loan",
-			{"status": "Disbursed", "docstatus": 1, "name": ("not in", checked_loans)},
-			["name", "company", "applicant_type", "applicant"],
+			{
+				"status": ("in", ["Disbursed", "Partially Disbursed"]),
+				"applicant_type": applicant_type,
+				"applicant": applicant,
+			},
+			pluck="name",
+		):
+			move_unpaid_interest_to_suspense_ledger(loan, posting_date)
+
+		update_all_linked_loan_customer_npa_status(1, 1, applicant_type, applicant, posting_date)
+
+	applicants_to_review -= npa_applicants
+	for applicant_type, applicant in get_applicants_with_no_dpd(applicants_to_review):
+		update_all_linked_loan_customer_npa_status(0, 0, applicant_type, applicant, posting_date)
+
+
+def get_loans_for_dpd_update(loan_product=None, loan_name=None, loan_names=None):
+	"""Loans to be classified along with the earliest due date of their unpaid demands
+
+	Loans with unpaid demands are fetched with a single grouped query, disbursed loans
+	without any overdue are returned with an empty due date.
+	"""
+	loan = frappe.qb.DocType("Loan")
+	loan_interest_accrual = frappe.qb.DocType("Loan Interest Accrual")
+	loan_fields = [
+		loan.name,
+		loan.company,
+		loan.loan_product,
+		loan.applicant_type,
+		loan.applicant,
+		loan.days_past_due,
+		loan.classification_code,
+		loan.classification_name,
+		loan.is_npa,
+		loan.manual_npa,
+	]
+
+	query = (
+		frappe.qb.from_(loan_interest_accrual)
+		.inner_join(loan)
+		.on(loan_interest_accrual.loan == loan.name)
+		.select(*loan_fields, Min(loan_interest_accrual.due_date).as_("due_date"))
+		.where(
+			(loan_interest_accrual.docstatus == 1)
+			& (
+				(loan_interest_accrual.interest_amount - loan_interest_accrual.paid_interest_amount > 0.01)
+				| (
+					loan_interest_accrual.payable_principal_amount - loan_interest_accrual.paid_principal_amount
+					> 0.01
+				)
+			)
 		)
+		.groupby(loan.name)
+	)
+
+	if loan_product:
+		query = query.where(loan_interest_accrual.loan_product == loan_product)
+
+	if loan_name:
+		query = query.where(loan_interest_accrual.loan == loan_name)
+
+	if loan_names:
+		query = query.where(loan_interest_accrual.loan.isin(loan_names))
+
+	loans = query.run(as_dict=1)
+	overdue_loans = {d.name for d in loans}
+
+	query = frappe.qb.from_(loan).select(*loan_fields)
+	if loan_name:
+		query = query.where(loan.name == loan_name)
+	elif loan_names:
+		query = query.where(loan.name.isin(loan_names))
+	else:
+		query = query.where((loan.docstatus == 1) & (loan.status == "Disbursed"))
+		if loan_product:
+			query = query.where(loan.loan_product == loan_product)
+
+	for d in query.run(as_dict=1):
+		if d.name not in overdue_loans:
+			d.due_date = None
+			loans.append(d)
+
+	return loans
+
 
-	for d in open_loans_with_no_overdue:
-		update_loan_and_customer_status(
-			d.name, d.company, d.applicant_type, d.applicant, 0, 0, posting_date or getdate()
+def get_classification_ranges(company=None):
+	"""Loan Classification Ranges per company, ordered by the minimum DPD"""
+	ranges = {}
+	filters = {"parent": company} if company else {}
+
+	for d in frappe.get_all(
+		"Loan Classification Range",
+		fields=[
+			"parent",
+			"min_dpd_range",
+			"max_dpd_range",
+			"classification_code",
+			"classification_name",
+		],
+		filters=filters,
+		order_by="min_dpd_range",
+	):
+		ranges.setdefault(d.parent, []).append(d)
+
+	return ranges
+
+
+def get_classification_for_dpd(days_past_due, ranges):
+	for range in ranges:
+		if range.min_dpd_range <= days_past_due <= range.max_dpd_range:
+			return range.classification_code, range.classification_name
+
+	return "", ""
+
+
+def update_dpd_and_classification(
+	loans, days_past_due, classification_code, classification_name, chunk_size=1000
+):
+	_loan = frappe.qb.DocType("Loan")
+
+	for i in range(0, len(loans), chunk_size):
+		frappe.qb.update(_loan).set(_loan.days_past_due, days_past_due).set(
+			_loan.classification_code, classification_code
+		).set(_loan.classification_name, classification_name).where(
+			_loan.name.isin(loans[i : i + chunk_size])
+		).run()
+
+
+def get_applicants_with_all_loans_npa(applicants):
+	"""Applicants whose active loans, and customer record, are all already flagged as NPA
+
+	All active loans of the applicants are checked, not only the ones being classified, so that
+	a scoped run still flags the other loans of an applicant that turned NPA.
+	"""
+	if not applicants:
+		return set()
+
+	_loan = frappe.qb.DocType("Loan")
+	npa_flags = (
+		frappe.qb.from_(_loan)
+		.select(_loan.applicant_type, _loan.applicant, Min(_loan.is_npa), Min(_loan.manual_npa))
+		.where(
+			(_loan.docstatus == 1)
+			& (_loan.status.isin(["Disbursed", "Partially Disbursed"]))
+			& (_loan.applicant.isin([d[1] for d in applicants]))
+		)
+		.groupby(_loan.applicant_type, _loan.applicant)
+		.run()
+	)
+
+	customer_npa = dict(
+		frappe.get_all(
+			"Customer",
+			filters={"name": ("in", [d[1] for d in applicants if d[0] == "Customer"])},
+			fields=["name", "is_npa"],
+			as_list=1,
 		)
+	)
+
+	return {
+		(applicant_type, applicant)
+		for applicant_type, applicant, is_npa, manual_npa in npa_flags
+		if (applicant_type, applicant) in applicants
+		and is_npa
+		and manual_npa
+		and (applicant_type != "Customer" or customer_npa.get(applicant))
+	}
+
+
+def get_applicants_with_no_dpd(applicants):
+	if not applicants:
+		return []
+
+	_loan = frappe.qb.DocType("Loan")
+	max_dpd = (
+		frappe.qb.from_(_loan)
+		.select(_loan.applicant_type, _loan.applicant, Max(_loan.days_past_due))
+		.where(_loan.applicant.isin([d[1] for d in applicants]))
+		.groupby(_loan.applicant_type, _loan.applicant)
+		.run()
+	)
 
-		create_dpd_record(d.name, posting_date, 0, process_loan_classification)
+	return [(d[0], d[1]) for d in max_dpd if (d[0], d[1]) in applicants and not d[2]]
 
 
 def restore_pervious_dpd_state(applicant_type, applicant, repayment_reference):
@@ -749,27 +989,10 @@ def update_watch_period_date_for_all_loans(watch_period_end_date, applicant_type
 
 
 def get_classification_code_and_name(days_past_due, company):
-	classification_code = ""
-	classification_name = ""
-
-	ranges = frappe.get_all(
-		"Loan Classification Range",
-		fields=[
-			"min_dpd_range",
-			"max_dpd_range",
-			"classification_code",
-			"classification_name",
-		],
-		filters={"parent": company},
-		order_by="min_dpd_range",
+	return get_classification_for_dpd(
+		days_past_due, get_classification_ranges(company).get(company, [])
 	)
 
-	for range in ranges:
-		if range.min_dpd_range <= days_past_due <= range.max_dpd_range:
-			return range.classification_code, range.classification_name
-
-	return classification_code, classification_name
-
 
 def get_pending_loan_interest_accruals(
 	loan_product=None, loan_name=None, applicant_type=None, applicant=None, filter_entries=True
@@ -834,6 +1057,10 @@ def get_dpd_threshold_map():
 def move_unpaid_interest_to_suspense_ledger(
 	loan=None, posting_date=None, applicant_type=None, applicant=None, reverse=0
 ):
+	"""Move unpaid interest of NPA loans to the suspense accounts, or back if `reverse` is set
+
+	One Journal Entry is posted per loan for all of its pending accruals.
+	"""
 	posting_date = posting_date or getdate()
 	previous_npa = frappe.db.get_value("Loan", loan, "is_npa")
 	if previous_npa:
@@ -843,69 +1070,430 @@ def move_unpaid_interest_to_suspense_ledger(
 		loan_name=loan, applicant_type=applicant_type, applicant=applicant, filter_entries=False
 	)
 
+	accruals_by_loan = {}
 	for accrual in pending_loan_interest_accruals:
-		amount = accrual.interest_amount - accrual.paid_interest_amount
+		accruals_by_loan.setdefault(accrual.loan, []).append(accrual)
+
+	account_details_map = {}
+	cost_center_map = {}
+
+	for accruals in accruals_by_loan.values():
+		loan_product = accruals[0].loan_product
+		company = accruals[0].company
+
+		if loan_product not in account_details_map:
+			account_details_map[loan_product] = frappe.get_value(
+				"Loan Product",
+				loan_product,
+				[
+					"suspense_interest_receivable",
+					"suspense_interest_income",
+					"interest_receivable_account",
+					"interest_income_account",
+				],
+				as_dict=1,
+			)
+
+		if company not in cost_center_map:
+			cost_center_map[company] = erpnext.get_default_cost_center(company)
+
+		make_suspense_transfer_entry(
+			accruals,
+			posting_date,
+			account_details_map[loan_product],
+			cost_center_map[company],
+			reverse=reverse,
+		)
+
+
+def make_suspense_transfer_entry(accruals, posting_date, account_details, cost_center, reverse=0):
+	"""Post a single Journal Entry moving the unpaid interest of one loan's accruals
+
+	Receivable and income reversal are posted as one row each against the loan, the suspense
+	income is credited per accrual so that every accrual stays traceable.
+	"""
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	debit, credit = ("credit", "debit") if reverse else ("debit", "credit")
+	accrual = accruals[0]
+	rows = []
+
+	for d in accruals:
+		amount = flt(d.interest_amount - d.paid_interest_amount, precision)
+		if amount <= 0:
+			continue
+
+		rows.append(
+			{
+				"account": account_details.suspense_interest_income,
+				credit: amount,
+				credit + "_in_account_currency": amount,
+				"reference_type": "Loan Interest Accrual",
+				"reference_name": d.name,
+				"cost_center": cost_center,
+			}
+		)
+
+	total_amount = flt(sum(d[credit] for d in rows), precision)
+	if not total_amount:
+		return
+
+	def get_loan_row(account, dr_or_cr, party=True):
+		row = {
+			"account": account,
+			dr_or_cr: total_amount,
+			dr_or_cr + "_in_account_currency": total_amount,
+			"reference_type": "Loan",
+			"reference_name": accrual.loan,
+			"cost_center": cost_center,
+		}
+
+		if party:
+			row.update({"party_type": accrual.applicant_type, "party": accrual.applicant})
+
+		return row
+
+	rows = [
+		get_loan_row(account_details.suspense_interest_receivable, debit),
+		get_loan_row(account_details.interest_receivable_account, credit),
+		*rows,
+		get_loan_row(account_details.interest_income_account, debit, party=False),
+	]
+
+	jv = frappe.get_doc(
+		{
+			"doctype": "Journal Entry",
+			"voucher_type": "Journal Entry",
+			"posting_date": posting_date,
+			"company": accrual.company,
+			"accounts": rows,
+		}
+	)
+
+	jv.flags.ignore_mandatory = True
+	jv.submit()
+
+	return jv
+
+
+LOAN_ACCOUNT_FIELDS = (
+	"payment_account",
+	"loan_account",
+	"interest_income_account",
+	"penalty_income_account",
+	"disbursement_account",
+)
+
+
+@frappe.whitelist()
+def bulk_create_loans(loans, submit=0):
+	"""Originate a batch of loans along with their repayment schedules
+
+	`loans` is a list (or its JSON) of Loan field values. Master data for the whole batch is
+	fetched once, every record is validated and its schedule generated in memory, and the valid
+	loans, schedules and schedule rows are written with multi-row inserts. Invalid records are
+	skipped and returned with their errors, by their position (starting at 1) in the batch.
+	"""
+	frappe.has_permission("Loan", "create", throw=True)
+	if cint(submit):
+		frappe.has_permission("Loan", "submit", throw=True)
+
+	if isinstance(loans, str):
+		loans = json.loads(loans)
+
+	loans = [prepare_bulk_loan(d) for d in loans]
+	context = get_bulk_loan_context(loans)
+
+	valid_loans, errors = [], []
+	for idx, data in enumerate(loans, 1):
+		loan_errors = validate_bulk_loan(data, context)
+		if not loan_errors:
+			try:
+				data.schedule = get_bulk_loan_schedule(data, context)
+			except (OverflowError, ValueError):
+				loan_errors.append(_("Repayment Amount does not cover the interest on the loan"))
+
+		if not loan_errors:
+			loan_errors = validate_bulk_sanctioned_amount_limit(data, context, cint(submit))
+
+		if loan_errors:
+			errors.append({"idx": idx, "errors": loan_errors})
+		else:
+			valid_loans.append((idx, data))
+
+	created = []
+	if valid_loans:
+		docs = make_bulk_loan_docs([d for idx, d in valid_loans], cint(submit))
+		bulk_insert_docs(docs)
+		created = [
+			{"idx": idx, "name": data.name, "total_payment": data.total_payment}
+			for idx, data in valid_loans
+		]
+
+	return {"loans": created, "errors": errors}
+
+
+def prepare_bulk_loan(data):
+	data = frappe._dict(data)
+	for fieldname in ("doctype", "name", "docstatus", "status"):
+		data.pop(fieldname, None)
+
+	data.company = data.company or erpnext.get_default_company()
+	data.posting_date = getdate(data.posting_date or nowdate())
+	data.loan_amount = flt(data.loan_amount)
+
+	return data
 
-		if reverse:
-			amount = -1 * amount
 
-		account_details = frappe.get_value(
+def get_bulk_loan_context(loans):
+	"""Fetch the masters referenced by a batch of loan payloads with one query per doctype"""
+	context = frappe._dict()
+
+	context.loan_products = {
+		d.name: d
+		for d in frappe.get_all(
 			"Loan Product",
-			accrual.loan_product,
-			[
-				"suspense_interest_receivable",
-				"suspense_interest_income",
-				"interest_receivable_account",
-				"interest_income_account",
+			fields=[
+				"name",
+				"company",
+				"disabled",
+				"rate_of_interest",
+				"is_term_loan",
+				"repayment_schedule_type",
+				"repayment_date_on",
+				"cyclic_day_of_the_month",
+				"min_days_bw_disbursement_first_repayment",
+				"loan_category",
+				*LOAN_ACCOUNT_FIELDS,
 			],
-			as_dict=1,
+			filters={"name": ("in", list({d.loan_product for d in loans if d.loan_product}))},
+		)
+	}
+
+	accounts = {d.get(f) for d in loans for f in LOAN_ACCOUNT_FIELDS}
+	accounts.update(d.get(f) for d in context.loan_products.values() for f in LOAN_ACCOUNT_FIELDS)
+	accounts.discard(None)
+	context.account_company = dict(
+		frappe.get_all(
+			"Account", fields=["name", "company"], filters={"name": ("in", list(accounts))}, as_list=1
+		)
+	)
+
+	context.company_cost_center = dict(
+		frappe.get_all(
+			"Company",
+			fields=["name", "cost_center"],
+			filters={"name": ("in", list({d.company for d in loans}))},
+			as_list=1,
+		)
+	)
+
+	applicants = {}
+	for d in loans:
+		if d.applicant_type in ("Employee", "Member", "Customer") and d.applicant:
+			applicants.setdefault(d.applicant_type, set()).add(d.applicant)
+
+	context.applicants = {
+		(applicant_type, name)
+		for applicant_type, names in applicants.items()
+		for name in frappe.get_all(applicant_type, filters={"name": ("in", list(names))}, pluck="name")
+	}
+
+	context.sanctioned_amount_limits = {
+		(d.applicant_type, d.applicant, d.company): flt(d.sanctioned_amount_limit)
+		for d in frappe.get_all(
+			"Sanctioned Loan Amount",
+			fields=["applicant_type", "applicant", "company", "sanctioned_amount_limit"],
+			filters={"applicant": ("in", list({d.applicant for d in loans if d.applicant}))},
+		)
+	}
+	context.loan_amounts = {}
+
+	return context
+
+
+def validate_bulk_loan(data, context):
+	errors = []
+
+	for fieldname in ("applicant_type", "applicant", "loan_product"):
+		if not data.get(fieldname):
+			errors.append(_("{0} is mandatory").format(frappe.unscrub(fieldname)))
+
+	if errors:
+		return errors
+
+	if (data.applicant_type, data.applicant) not in context.applicants:
+		errors.append(_("{0} {1} does not exist").format(data.applicant_type, data.applicant))
+
+	loan_product = context.loan_products.get(data.loan_product)
+	if not loan_product:
+		errors.append(_("Loan Product {0} does not exist").format(data.loan_product))
+		return errors
+
+	if loan_product.disabled:
+		errors.append(_("Loan Product {0} is disabled").format(data.loan_product))
+
+	if loan_product.company != data.company:
+		errors.append(
+			_("Loan Product {0} does not belong to company {1}").format(data.loan_product, data.company)
 		)
-		jv = frappe.get_doc(
+
+	for fieldname in LOAN_ACCOUNT_FIELDS:
+		data[fieldname] = data.get(fieldname) or loan_product.get(fieldname)
+		if data.get(fieldname) and context.account_company.get(data.get(fieldname)) != data.company:
+			errors.append(
+				_("Account {0} does not belongs to company {1}").format(data.get(fieldname), data.company)
+			)
+
+	data.is_term_loan = loan_product.is_term_loan
+	data.repayment_schedule_type = loan_product.repayment_schedule_type
+	data.loan_category = data.loan_category or loan_product.loan_category
+	if not data.rate_of_interest:
+		data.rate_of_interest = flt(loan_product.rate_of_interest)
+
+	if not data.cost_center and data.rate_of_interest != 0.0:
+		data.cost_center = context.company_cost_center.get(data.company)
+		if not data.cost_center:
+			errors.append(_("Cost center is mandatory for loans having rate of interest greater than 0"))
+
+	if not data.loan_amount:
+		errors.append(_("Loan amount is mandatory"))
+	elif data.maximum_loan_amount and data.loan_amount > flt(data.maximum_loan_amount):
+		errors.append(_("Loan amount cannot be greater than {0}").format(data.maximum_loan_amount))
+
+	if data.is_secured_loan and data.loan_application:
+		errors.append(_("Loans against a Loan Application with pledges cannot be created in bulk"))
+
+	if data.is_term_loan:
+		errors.extend(validate_bulk_loan_repayment(data, loan_product))
+
+	return errors
+
+
+def validate_bulk_loan_repayment(data, loan_product):
+	errors = []
+
+	if data.repayment_method == "Repay Over Number of Periods":
+		if not cint(data.repayment_periods):
+			errors.append(_("Please enter Repayment Periods"))
+	elif data.repayment_method == "Repay Fixed Amount per Period":
+		if not flt(data.monthly_repayment_amount):
+			errors.append(_("Please enter repayment Amount"))
+		elif flt(data.monthly_repayment_amount) > data.loan_amount:
+			errors.append(_("Monthly Repayment Amount cannot be greater than Loan Amount"))
+	else:
+		errors.append(_("Repayment Method is mandatory for term loans"))
+
+	if loan_product.repayment_schedule_type == "Monthly as per cycle date":
+		data.repayment_start_date = get_cyclic_date(
+			data.posting_date,
+			loan_product.cyclic_day_of_the_month,
+			loan_product.min_days_bw_disbursement_first_repayment,
+		)
+	elif not data.repayment_start_date:
+		errors.append(_("Repayment Start Date is mandatory for term loans"))
+
+	return errors
+
+
+def get_bulk_loan_schedule(data, context):
+	"""Generate the repayment schedule of a payload and set the loan totals from it"""
+	if not data.is_term_loan:
+		data.total_payment = data.loan_amount
+		data.total_interest_payable = 0
+		return []
+
+	loan_product = context.loan_products[data.loan_product]
+	if data.repayment_method == "Repay Over Number of Periods":
+		data.monthly_repayment_amount = get_monthly_repayment_amount(
+			data.loan_amount, data.rate_of_interest, cint(data.repayment_periods)
+		)
+
+	schedule = get_repayment_schedule(
+		loan_amount=data.loan_amount,
+		rate_of_interest=data.rate_of_interest,
+		monthly_repayment_amount=flt(data.monthly_repayment_amount),
+		posting_date=data.posting_date,
+		repayment_start_date=data.repayment_start_date,
+		repayment_method=data.repayment_method,
+		repayment_periods=cint(data.repayment_periods),
+		repayment_schedule_type=loan_product.repayment_schedule_type,
+		repayment_date_on=loan_product.repayment_date_on,
+	)
+
+	data.total_payment = sum(row["total_payment"] for row in schedule)
+	data.total_interest_payable = sum(row["interest_amount"] for row in schedule)
+
+	return schedule
+
+
+def validate_bulk_sanctioned_amount_limit(data, context, submit):
+	"""Check the sanctioned amount limit, counting the loans submitted earlier in the batch"""
+	key = (data.applicant_type, data.applicant, data.company)
+	sanctioned_amount_limit = context.sanctioned_amount_limits.get(key)
+	if not sanctioned_amount_limit:
+		return []
+
+	if key not in context.loan_amounts:
+		context.loan_amounts[key] = get_total_loan_amount(*key)
+
+	if data.loan_amount + context.loan_amounts[key] > sanctioned_amount_limit:
+		return [
+			_("Sanctioned Amount limit crossed for {0} {1}").format(data.applicant_type, data.applicant)
+		]
+
+	if submit:
+		context.loan_amounts[key] += data.total_payment
+
+	return []
+
+
+def make_bulk_loan_docs(loans, submit=0):
+	"""Build named, in-memory Loan and Loan Repayment Schedule documents for validated payloads"""
+	loan_names = get_series_names(frappe.get_meta("Loan").autoname, len(loans))
+	term_loans = [d for d in loans if d.is_term_loan]
+	schedule_names = get_series_names(
+		frappe.get_meta("Loan Repayment Schedule").autoname, len(term_loans)
+	)
+
+	docs = []
+	for data, name in zip(loans, loan_names):
+		data.name = name
+
+		loan = frappe.new_doc("Loan")
+		loan.update({k: v for k, v in data.items() if k != "schedule"})
+		loan.name = name
+		loan.docstatus = submit
+		docs.append(loan)
+
+	for data, name in zip(term_loans, schedule_names):
+		schedule = frappe.new_doc("Loan Repayment Schedule")
+		schedule.update(
 			{
-				"doctype": "Journal Entry",
-				"voucher_type": "Journal Entry",
-				"posting_date": posting_date,
-				"company": accrual.company,
-				"accounts": [
-					{
-						"account": account_details.suspense_interest_receivable,
-						"party": accrual.applicant,
-						"party_type": accrual.applicant_type,
-						"debit_in_account_currency": amount,
-						"debit": amount,
-						"reference_type": "Loan",
-						"reference_name": accrual.loan,
-						"cost_center": erpnext.get_default_cost_center(accrual.company),
-					},
-					{
-						"account": account_details.interest_receivable_account,
-						"party": accrual.applicant,
-						"party_type": accrual.applicant_type,
-						"credit_in_account_currency": amount,
-						"credit": amount,
-						"reference_type": "Loan",
-						"reference_name": accrual.loan,
-						"cost_center": erpnext.get_default_cost_center(accrual.company),
-					},
-					{
-						"account": account_details.suspense_interest_income,
-						"credit_in_account_currency": amount,
-						"credit": amount,
-						"reference_type": "Loan Interest Accrual",
-						"reference_name": accrual.name,
-						"cost_center": erpnext.get_default_cost_center(accrual.company),
-					},
-					{
-						"account": account_details.interest_income_account,
-						"debit": amount,
-						"debit_in_account_currency": amount,
-						"reference_type": "Loan Interest Accrual",
-						"reference_name": accrual.name,
-						"cost_center": erpnext.get_default_cost_center(accrual.company),
-					},
-				],
+				"loan": data.name,
+				"loan_product": data.loan_product,
+				"company": data.company,
+				"repayment_schedule_type": data.repayment_schedule_type,
+				"repayment_method": data.repayment_method,
+				"repayment_start_date": data.repayment_start_date,
+				"repayment_periods": len(data.schedule)
+				if data.repayment_method == "Repay Fixed Amount per Period"
+				else data.repayment_periods,
+				"loan_amount": data.loan_amount,
+				"monthly_repayment_amount": data.monthly_repayment_amount,
+				"rate_of_interest": data.rate_of_interest,
+				"posting_date": data.posting_date,
 			}
 		)
+		schedule.name = name
+		schedule.docstatus = submit
+		for row in data.schedule:
+			schedule.append("repayment_schedule", row)
+
+		docs.append(schedule)
+
+	return docs
+
 
-		jv.flags.ignore_mandatory = True
-		jv.submit()
+def on_doctype_update():
+	frappe.db.add_index("Loan", ["applicant_type", "applicant"])
+	frappe.db.add_index("Loan", ["pending_classification_date"])
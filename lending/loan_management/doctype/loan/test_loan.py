@@ -19,6 +19,7 @@ from erpnext.selling.doctype.customer.test_customer import get_customer_dict
 from erpnext.setup.doctype.employee.test_employee import make_employee
 
 from lending.loan_management.doctype.loan.loan import (
+	bulk_create_loans,
 	make_loan_write_off,
 	request_loan_closure,
 	unpledge_security,
@@ -30,7 +31,12 @@ from lending.loan_management.doctype.loan_disbursement.loan_disbursement import
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 	days_in_year,
 )
-from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	calculate_amounts,
+	calculate_amounts_bulk,
+	make_bulk_repayments,
+	parse_bulk_repayments,
+)
 from lending.loan_management.doctype.loan_security_unpledge.loan_security_unpledge import (
 	get_pledged_security_qty,
 )
@@ -163,6 +169,42 @@ class TestLoan(unittest.TestCase):
 		self.assertEqual(flt(loan.total_interest_payable, 0), 22712)
 		self.assertEqual(flt(loan.total_payment, 0), 302712)
 
+	def test_bulk_create_loans(self):
+		result = bulk_create_loans(
+			[
+				{
+					"applicant_type": "Employee",
+					"applicant": self.applicant1,
+					"company": "_Test Company",
+					"loan_product": "Personal Loan",
+					"loan_amount": 280000,
+					"repayment_method": "Repay Over Number of Periods",
+					"repayment_periods": 20,
+					"repayment_start_date": nowdate(),
+				},
+				{
+					"applicant_type": "Employee",
+					"applicant": self.applicant1,
+					"company": "_Test Company",
+					"loan_product": "_Test Missing Loan Product",
+					"loan_amount": 280000,
+				},
+			]
+		)
+
+		self.assertEqual(len(result["loans"]), 1)
+		self.assertEqual(result["errors"][0]["idx"], 2)
+
+		loan = frappe.get_doc("Loan", result["loans"][0]["name"])
+		loan_repayment_schedule = frappe.get_doc(
+			"Loan Repayment Schedule", {"loan": loan.name, "docstatus": 0}
+		)
+
+		self.assertEqual(loan_repayment_schedule.monthly_repayment_amount, 15052)
+		self.assertEqual(len(loan_repayment_schedule.repayment_schedule), 20)
+		self.assertEqual(flt(loan.total_interest_payable, 0), 21034)
+		self.assertEqual(flt(loan.total_payment, 0), 301034)
+
 	def test_loan_with_security(self):
 		pledge = [
 			{
@@ -413,6 +455,58 @@ class TestLoan(unittest.TestCase):
 		self.assertEqual(amounts[0], 11250.00)
 		self.assertEqual(amounts[1], 78303.00)
 
+	def test_bulk_loan_repayment_for_term_loan(self):
+		pledges = [
+			{"loan_security": "Test Security 2", "qty": 4000.00},
+			{"loan_security": "Test Security 1", "qty": 2000.00},
+		]
+
+		loan_application = create_loan_application(
+			"_Test Company", self.applicant2, "Stock Loan", pledges, "Repay Over Number of Periods", 12
+		)
+		create_pledge(loan_application)
+
+		loan = create_loan_with_security(
+			self.applicant2,
+			"Stock Loan",
+			"Repay Over Number of Periods",
+			12,
+			loan_application,
+			posting_date=add_months(nowdate(), -1),
+		)
+
+		loan.submit()
+
+		make_loan_disbursement_entry(
+			loan.name, loan.loan_amount, disbursement_date=add_months(nowdate(), -1)
+		)
+
+		process_loan_interest_accrual_for_term_loans(posting_date=nowdate())
+
+		result = make_bulk_repayments(
+			parse_bulk_repayments(
+				[
+					{"against_loan": loan.name, "amount_paid": 89768.75, "posting_date": add_days(nowdate(), 5)},
+					{"against_loan": "_Test Missing Loan", "amount_paid": 1000},
+				]
+			)
+		)
+
+		self.assertEqual(len(result["repayments"]), 1)
+		self.assertEqual(result["errors"][0]["idx"], 2)
+
+		amounts = frappe.db.get_value(
+			"Loan Interest Accrual", {"loan": loan.name}, ["paid_interest_amount", "paid_principal_amount"]
+		)
+
+		self.assertEqual(amounts[0], 11250.00)
+		self.assertEqual(amounts[1], 78303.00)
+		self.assertTrue(
+			frappe.db.exists(
+				"GL Entry", {"voucher_type": "Loan Repayment", "voucher_no": result["repayments"][0]["name"]}
+			)
+		)
+
 	def test_security_shortfall(self):
 		pledges = [
 			{
@@ -753,6 +847,20 @@ class TestLoan(unittest.TestCase):
 		self.assertEqual(loan.loan_amount, 1000000)
 		self.assertEqual(calculated_penalty_amount, penalty_amount)
 
+	def test_bulk_calculate_amounts(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+		posting_date = "2019-11-30"
+
+		bulk_amounts = calculate_amounts_bulk([loan.name], posting_date)[loan.name]
+		amounts = calculate_amounts(loan.name, posting_date)
+
+		self.assertEqual(bulk_amounts, amounts)
+
+		bulk_amounts = calculate_amounts_bulk([loan.name], posting_date, payment_type="Loan Closure")
+		amounts = calculate_amounts(loan.name, posting_date, payment_type="Loan Closure")
+
+		self.assertEqual(bulk_amounts, amounts)
+
 	def test_loan_write_off_limit(self):
 		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
 
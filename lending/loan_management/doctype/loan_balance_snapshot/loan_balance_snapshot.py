@@ -0,0 +1,240 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder.functions import Sum
+from frappe.utils import cint, flt, getdate, nowdate
+
+from lending.loan_management.utils import bulk_insert_docs
+
+SNAPSHOT_FIELDS = (
+	"status",
+	"pending_principal_amount",
+	"unpaid_interest_amount",
+	"unpaid_penalty_amount",
+	"days_past_due",
+	"classification_code",
+	"classification_name",
+	"is_npa",
+)
+
+
+class LoanBalanceSnapshot(Document):
+	pass
+
+
+def make_loan_balance_snapshots(posting_date=None, loan_product=None, loans=None, batch_size=1000):
+	"""Snapshot the balances, days past due and classification of loans as on `posting_date`
+
+	Runs nightly at the end of the loan classification, see `process_daily_loan_classification`.
+	A snapshot is only written for loans whose values differ from their latest one, so the balance
+	as on any date is the latest snapshot till that date, see `get_loan_balances_as_of`. Running
+	again on the same date updates that date's snapshots in place.
+	"""
+	posting_date = getdate(posting_date or nowdate())
+	loan_names = get_loans_for_snapshot(loan_product, loans)
+
+	for i in range(0, len(loan_names), batch_size):
+		make_snapshots_for_loans(loan_names[i : i + batch_size], posting_date)
+
+
+def get_loans_for_snapshot(loan_product=None, loans=None):
+	"""Open loans and the loans closed since their latest snapshot"""
+	filters = {
+		"docstatus": 1,
+		"status": ("in", ["Disbursed", "Partially Disbursed", "Loan Closure Requested"]),
+	}
+	conditions = ""
+
+	if loan_product:
+		filters["loan_product"] = loan_product
+		conditions += " AND loan.loan_product = %(loan_product)s"
+
+	if loans:
+		filters["name"] = ("in", loans)
+		conditions += " AND loan.name IN %(loans)s"
+
+	closed_loans = frappe.db.sql(
+		f"""
+		SELECT snapshot.loan
+		FROM `tabLoan Balance Snapshot` snapshot
+		INNER JOIN (
+			SELECT loan, MAX(posting_date) AS posting_date FROM `tabLoan Balance Snapshot` GROUP BY loan
+		) latest ON latest.loan = snapshot.loan AND latest.posting_date = snapshot.posting_date
+		INNER JOIN `tabLoan` loan ON loan.name = snapshot.loan
+		WHERE loan.status = 'Closed' AND snapshot.status != 'Closed' {conditions}
+	""",  # nosec
+		{"loan_product": loan_product, "loans": tuple(loans or [])},
+		pluck=True,
+	)
+
+	return frappe.get_all("Loan", filters=filters, pluck="name", order_by="name") + closed_loans
+
+
+def make_snapshots_for_loans(loans, posting_date):
+	from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+		get_penalty_details_for_loans,
+		get_pending_principal_amount,
+	)
+
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+
+	loan_details = frappe.get_all(
+		"Loan",
+		filters={"name": ("in", loans)},
+		fields=[
+			"name",
+			"company",
+			"loan_product",
+			"applicant_type",
+			"applicant",
+			"status",
+			"loan_amount",
+			"disbursed_amount",
+			"total_payment",
+			"debit_adjustment_amount",
+			"credit_adjustment_amount",
+			"total_principal_paid",
+			"total_interest_payable",
+			"written_off_amount",
+			"refund_amount",
+			"days_past_due",
+			"classification_code",
+			"classification_name",
+			"is_npa",
+		],
+	)
+
+	unpaid_interest = get_unpaid_interest_for_loans(loans)
+	penalty_details = get_penalty_details_for_loans(loans)
+	latest_snapshots = {d.loan: d for d in get_latest_snapshots(posting_date, loans)}
+
+	snapshots, updates = [], {}
+	for loan in loan_details:
+		values = {
+			"status": loan.status,
+			"pending_principal_amount": flt(get_pending_principal_amount(loan), precision),
+			"unpaid_interest_amount": flt(unpaid_interest.get(loan.name), precision),
+			"unpaid_penalty_amount": flt(penalty_details.get(loan.name, (None, 0))[1], precision),
+			"days_past_due": cint(loan.days_past_due),
+			"classification_code": loan.classification_code,
+			"classification_name": loan.classification_name,
+			"is_npa": cint(loan.is_npa),
+		}
+
+		latest = latest_snapshots.get(loan.name)
+		if latest and not has_snapshot_changed(latest, values, precision):
+			continue
+
+		if latest and getdate(latest.posting_date) == posting_date:
+			updates[latest.name] = values
+			continue
+
+		snapshot = frappe.new_doc("Loan Balance Snapshot")
+		snapshot.update(
+			{
+				"loan": loan.name,
+				"posting_date": posting_date,
+				"company": loan.company,
+				"loan_product": loan.loan_product,
+				"applicant_type": loan.applicant_type,
+				"applicant": loan.applicant,
+				**values,
+			}
+		)
+		snapshots.append(snapshot)
+
+	bulk_insert_docs(snapshots)
+
+	if updates:
+		frappe.db.bulk_update("Loan Balance Snapshot", updates)
+
+
+def has_snapshot_changed(snapshot, values, precision):
+	for field in SNAPSHOT_FIELDS:
+		if isinstance(values[field], float):
+			if flt(snapshot.get(field), precision) != values[field]:
+				return True
+		elif (snapshot.get(field) or None) != (values[field] or None):
+			return True
+
+	return False
+
+
+def get_unpaid_interest_for_loans(loans):
+	loan_interest_accrual = frappe.qb.DocType("Loan Interest Accrual")
+
+	return dict(
+		frappe.qb.from_(loan_interest_accrual)
+		.select(
+			loan_interest_accrual.loan,
+			Sum(loan_interest_accrual.interest_amount - loan_interest_accrual.paid_interest_amount),
+		)
+		.where((loan_interest_accrual.loan.isin(loans)) & (loan_interest_accrual.docstatus == 1))
+		.groupby(loan_interest_accrual.loan)
+		.run()
+	)
+
+
+def get_latest_snapshots(as_of_date, loans=None, company=None, loan_product=None):
+	"""Latest snapshot of each loan on or before `as_of_date`"""
+	conditions = ""
+	values = {"as_of_date": getdate(as_of_date)}
+
+	if loans:
+		conditions += " AND loan IN %(loans)s"
+		values["loans"] = tuple(loans)
+
+	if company:
+		conditions += " AND company = %(company)s"
+		values["company"] = company
+
+	if loan_product:
+		conditions += " AND loan_product = %(loan_product)s"
+		values["loan_product"] = loan_product
+
+	return frappe.db.sql(
+		f"""
+		SELECT snapshot.*
+		FROM `tabLoan Balance Snapshot` snapshot
+		INNER JOIN (
+			SELECT loan, MAX(posting_date) AS posting_date FROM `tabLoan Balance Snapshot`
+			WHERE posting_date <= %(as_of_date)s {conditions}
+			GROUP BY loan
+		) latest ON latest.loan = snapshot.loan AND latest.posting_date = snapshot.posting_date
+		ORDER BY snapshot.loan
+	""",  # nosec
+		values,
+		as_dict=1,
+	)
+
+
+@frappe.whitelist()
+def get_loan_balances_as_of(as_of_date, loans=None, company=None, loan_product=None):
+	"""Balances, days past due and classification of loans as on `as_of_date`
+
+	Loans disbursed after that date, or without any snapshot till then, are not returned.
+	"""
+	frappe.has_permission("Loan Balance Snapshot", "read", throw=True)
+
+	return [
+		frappe._dict(
+			{
+				"loan": d.loan,
+				"posting_date": d.posting_date,
+				"company": d.company,
+				"loan_product": d.loan_product,
+				"applicant_type": d.applicant_type,
+				"applicant": d.applicant,
+				**{field: d.get(field) for field in SNAPSHOT_FIELDS},
+			}
+		)
+		for d in get_latest_snapshots(as_of_date, frappe.parse_json(loans), company, loan_product)
+	]
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Balance Snapshot", ["loan", "posting_date"])
+	frappe.db.add_index("Loan Balance Snapshot", ["posting_date"])
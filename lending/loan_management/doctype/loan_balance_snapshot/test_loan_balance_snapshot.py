@@ -0,0 +1,124 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, flt, get_datetime, nowdate
+
+from erpnext.selling.doctype.customer.test_customer import get_customer_dict
+
+from lending.loan_management.doctype.loan.test_loan import (
+	create_loan_accounts,
+	create_loan_product,
+	create_loan_scenario_for_penalty,
+	create_loan_security,
+	create_loan_security_price,
+	create_loan_security_type,
+	create_repayment_entry,
+	set_loan_settings_in_company,
+)
+from lending.loan_management.doctype.loan_balance_snapshot.loan_balance_snapshot import (
+	get_loan_balances_as_of,
+	has_snapshot_changed,
+	make_loan_balance_snapshots,
+)
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	get_pending_principal_amount,
+)
+
+
+class TestLoanBalanceSnapshot(FrappeTestCase):
+	def setUp(self):
+		set_loan_settings_in_company()
+		create_loan_accounts()
+
+		create_loan_product(
+			"Demand Loan",
+			"Demand Loan",
+			2000000,
+			13.5,
+			25,
+			0,
+			5,
+			"Cash",
+			"Disbursement Account - _TC",
+			"Payment Account - _TC",
+			"Loan Account - _TC",
+			"Interest Income Account - _TC",
+			"Penalty Income Account - _TC",
+		)
+
+		create_loan_security_type()
+		create_loan_security()
+
+		create_loan_security_price(
+			"Test Security 1", 500, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+
+		if not frappe.db.exists("Customer", "_Test Loan Customer"):
+			frappe.get_doc(get_customer_dict("_Test Loan Customer")).insert(ignore_permissions=True)
+
+		self.applicant2 = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+	def test_loan_balance_snapshots(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		make_loan_balance_snapshots(posting_date="2019-11-05", loans=[loan.name])
+		make_loan_balance_snapshots(posting_date="2019-11-06", loans=[loan.name])
+
+		self.assertEqual(frappe.db.count("Loan Balance Snapshot", {"loan": loan.name}), 1)
+		self.assertFalse(get_loan_balances_as_of("2019-11-04", loans=[loan.name]))
+
+		loan.load_from_db()
+		balances = get_loan_balances_as_of("2019-11-30", loans=[loan.name])[0]
+		self.assertEqual(str(balances.posting_date), "2019-11-05")
+		self.assertEqual(balances.pending_principal_amount, flt(get_pending_principal_amount(loan), 2))
+
+	def test_snapshot_on_change(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		make_loan_balance_snapshots(posting_date="2019-11-05", loans=[loan.name])
+		unpaid_interest_amount = get_loan_balances_as_of("2019-11-05", loans=[loan.name])[
+			0
+		].unpaid_interest_amount
+
+		create_repayment_entry(loan.name, self.applicant2, "2019-11-10", 1000).submit()
+		make_loan_balance_snapshots(posting_date="2019-11-10", loans=[loan.name])
+
+		self.assertEqual(frappe.db.count("Loan Balance Snapshot", {"loan": loan.name}), 2)
+		self.assertEqual(
+			get_loan_balances_as_of("2019-11-09", loans=[loan.name])[0].unpaid_interest_amount,
+			unpaid_interest_amount,
+		)
+
+		balances = get_loan_balances_as_of("2019-11-10", loans=[loan.name])[0]
+		self.assertEqual(str(balances.posting_date), "2019-11-10")
+		self.assertTrue(balances.unpaid_interest_amount < unpaid_interest_amount)
+
+		# running again on the same date updates that date's snapshot in place
+		create_repayment_entry(loan.name, self.applicant2, "2019-11-10", 500).submit()
+		make_loan_balance_snapshots(posting_date="2019-11-10", loans=[loan.name])
+
+		self.assertEqual(frappe.db.count("Loan Balance Snapshot", {"loan": loan.name}), 2)
+		self.assertTrue(
+			get_loan_balances_as_of("2019-11-10", loans=[loan.name])[0].unpaid_interest_amount
+			< balances.unpaid_interest_amount
+		)
+
+	def test_has_snapshot_changed(self):
+		values = {
+			"status": "Disbursed",
+			"pending_principal_amount": 1000.0,
+			"unpaid_interest_amount": 10.0,
+			"unpaid_penalty_amount": 0.0,
+			"days_past_due": 0,
+			"classification_code": None,
+			"classification_name": None,
+			"is_npa": 0,
+		}
+		snapshot = frappe._dict(values, pending_principal_amount=1000.001, classification_code="")
+
+		self.assertFalse(has_snapshot_changed(snapshot, values, 2))
+
+		snapshot.days_past_due = 1
+		self.assertTrue(has_snapshot_changed(snapshot, values, 2))
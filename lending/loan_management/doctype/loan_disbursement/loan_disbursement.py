@@ -4,12 +4,15 @@
 
 import frappe
 from frappe import _
-from frappe.utils import add_days, flt, get_datetime, nowdate
+from frappe.utils import add_days, flt, get_datetime, getdate, nowdate
 
 import erpnext
 from erpnext.accounts.general_ledger import make_gl_entries
 from erpnext.controllers.accounts_controller import AccountsController
 
+from lending.loan_management.doctype.loan_security_price.loan_security_price import (
+	get_loan_security_prices,
+)
 from lending.loan_management.doctype.loan_security_unpledge.loan_security_unpledge import (
 	get_pledged_security_qty,
 )
@@ -105,14 +108,23 @@ class LoanDisbursement(AccountsController):
 				"status",
 				"is_term_loan",
 				"is_secured_loan",
+				"last_disbursement_date",
 			],
 			filters={"name": self.against_loan},
 		)[0]
 
 		if cancel:
 			disbursed_amount, status, total_payment = self.get_values_on_cancel(loan_details)
+			last_disbursement_date = frappe.db.get_value(
+				"Loan Disbursement",
+				{"against_loan": self.against_loan, "docstatus": 1, "name": ("!=", self.name)},
+				"MAX(posting_date)",
+			)
 		else:
 			disbursed_amount, status, total_payment = self.get_values_on_submit(loan_details)
+			last_disbursement_date = max(
+				getdate(self.posting_date), getdate(loan_details.last_disbursement_date or self.posting_date)
+			)
 
 		frappe.db.set_value(
 			"Loan",
@@ -122,6 +134,7 @@ class LoanDisbursement(AccountsController):
 				"disbursed_amount": disbursed_amount,
 				"status": status,
 				"total_payment": total_payment,
+				"last_disbursement_date": last_disbursement_date,
 			},
 		)
 
@@ -292,14 +305,7 @@ class LoanDisbursement(AccountsController):
 def get_total_pledged_security_value(loan):
 	update_time = get_datetime()
 
-	loan_security_price_map = frappe._dict(
-		frappe.get_all(
-			"Loan Security Price",
-			fields=["loan_security", "loan_security_price"],
-			filters={"valid_from": ("<=", update_time), "valid_upto": (">=", update_time)},
-			as_list=1,
-		)
-	)
+	loan_security_price_map = get_loan_security_prices(valid_time=update_time)
 
 	hair_cut_map = frappe._dict(
 		frappe.get_all("Loan Security", fields=["name", "haircut"], as_list=1)
@@ -374,3 +380,8 @@ def get_disbursal_amount(loan, on_current_security_price=0):
 
 def get_maximum_amount_as_per_pledged_security(loan):
 	return flt(frappe.db.get_value("Loan Security Pledge", {"loan": loan}, "sum(maximum_loan_value)"))
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Disbursement", ["against_loan", "posting_date"])
+	frappe.db.add_index("Loan Disbursement", ["disbursement_account", "disbursement_date"])
@@ -25,12 +25,14 @@ class LoanInterestAccrual(AccountsController):
 			self.last_accrual_date = get_last_accrual_date(self.loan, self.posting_date)
 
 	def on_submit(self):
+		update_last_accrual_date([self.loan], self.posting_date)
 		self.make_gl_entries()
 
 	def on_cancel(self):
 		if self.repayment_schedule_name:
 			self.update_is_accrued()
 
+		reset_last_accrual_date(self.loan)
 		self.make_gl_entries(cancel=1)
 		self.ignore_linked_doctypes = ["GL Entry", "Payment Ledger Entry"]
 
@@ -38,18 +40,20 @@ class LoanInterestAccrual(AccountsController):
 		frappe.db.set_value("Repayment Schedule", self.repayment_schedule_name, "is_accrued", 0)
 
 	def make_gl_entries(self, cancel=0, adv_adj=0):
+		gle_map = self.get_gl_map()
+
+		if gle_map:
+			make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj)
+
+	def get_gl_map(self, cost_center=None, account_details=None):
 		gle_map = []
 
-		cost_center, loan_product = frappe.db.get_value(
-			"Loan", self.loan, ["cost_center", "loan_product"]
-		)
+		if not cost_center or not account_details:
+			cost_center, loan_product = frappe.db.get_value(
+				"Loan", self.loan, ["cost_center", "loan_product"]
+			)
 
-		account_details = frappe.db.get_value(
-			"Loan Product",
-			loan_product,
-			["interest_receivable_account", "suspense_interest_receivable", "suspense_interest_income"],
-			as_dict=1,
-		)
+			account_details = get_interest_account_details(loan_product)
 
 		if self.is_npa:
 			receivable_account = account_details.suspense_interest_receivable
@@ -97,19 +101,29 @@ class LoanInterestAccrual(AccountsController):
 				)
 			)
 
-		if gle_map:
-			make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj)
+		return gle_map
+
+
+def get_interest_account_details(loan_product):
+	return frappe.db.get_value(
+		"Loan Product",
+		loan_product,
+		["interest_receivable_account", "suspense_interest_receivable", "suspense_interest_income"],
+		as_dict=1,
+	)
 
 
 # For Eg: If Loan disbursement date is '01-09-2019' and disbursed amount is 1000000 and
 # rate of interest is 13.5 then first loan interest accrual will be on '01-10-2019'
 # which means interest will be accrued for 30 days which should be equal to 11095.89
 def calculate_accrual_amount_for_demand_loans(
-	loan, posting_date, process_loan_interest, accrual_type
+	loan, posting_date, process_loan_interest, accrual_type, pending_amounts=None
 ):
+	"""`pending_amounts` can be passed from `calculate_amounts_bulk`, computed without a payment type"""
 	from lending.loan_management.doctype.loan_repayment.loan_repayment import (
 		calculate_amounts,
 		get_pending_principal_amount,
+		set_closure_amounts,
 	)
 
 	no_of_days = get_no_of_days_for_interest_accural(loan, posting_date)
@@ -121,10 +135,14 @@ def calculate_accrual_amount_for_demand_loans(
 	pending_principal_amount = get_pending_principal_amount(loan)
 
 	if loan.is_term_loan:
-		pending_amounts = calculate_amounts(loan.name, posting_date)
+		if not pending_amounts:
+			pending_amounts = calculate_amounts(loan.name, posting_date)
+
 		pending_principal_amount = pending_principal_amount - flt(
 			pending_amounts["payable_principal_amount"]
 		)
+	elif pending_amounts:
+		set_closure_amounts(pending_amounts)
 	else:
 		pending_amounts = calculate_amounts(loan.name, posting_date, payment_type="Loan Closure")
 
@@ -161,7 +179,31 @@ def make_accrual_interest_entry_for_demand_loans(
 	loan_product=None,
 	accrual_type="Regular",
 	via_restructure=False,
+	batch_size=1000,
 ):
+	if not open_loans:
+		open_loans = get_demand_loans(loan_product=loan_product, via_restructure=via_restructure)
+
+	for i in range(0, len(open_loans), batch_size):
+		batch = open_loans[i : i + batch_size]
+		pending_amounts = get_pending_amounts_for_loans(batch, posting_date)
+
+		for loan in batch:
+			calculate_accrual_amount_for_demand_loans(
+				loan, posting_date, process_loan_interest, accrual_type, pending_amounts.get(loan.name)
+			)
+
+
+def get_pending_amounts_for_loans(loans, posting_date):
+	from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts_bulk
+
+	if not loans:
+		return {}
+
+	return calculate_amounts_bulk([loan.name for loan in loans], posting_date)
+
+
+def get_demand_loans(loan_product=None, via_restructure=False, loans=None):
 	query_filters = {
 		"status": ("in", ["Disbursed", "Partially Disbursed"]),
 		"docstatus": 1,
@@ -173,71 +215,167 @@ def make_accrual_interest_entry_for_demand_loans(
 	if loan_product:
 		query_filters.update({"loan_product": loan_product})
 
-	if not open_loans:
-		open_loans = frappe.get_all(
-			"Loan",
-			fields=[
-				"name",
-				"total_payment",
-				"total_amount_paid",
-				"debit_adjustment_amount",
-				"credit_adjustment_amount",
-				"refund_amount",
-				"loan_account",
-				"interest_income_account",
-				"loan_amount",
-				"is_term_loan",
-				"status",
-				"disbursement_date",
-				"disbursed_amount",
-				"applicant_type",
-				"applicant",
-				"rate_of_interest",
-				"total_interest_payable",
-				"written_off_amount",
-				"total_principal_paid",
-				"repayment_start_date",
-				"company",
-			],
-			filters=query_filters,
-		)
-
-	for loan in open_loans:
-		calculate_accrual_amount_for_demand_loans(
-			loan, posting_date, process_loan_interest, accrual_type
-		)
+	if loans:
+		query_filters.update({"name": ("in", loans)})
+
+	return frappe.get_all(
+		"Loan",
+		fields=[
+			"name",
+			"total_payment",
+			"total_amount_paid",
+			"debit_adjustment_amount",
+			"credit_adjustment_amount",
+			"refund_amount",
+			"loan_account",
+			"interest_income_account",
+			"loan_amount",
+			"is_term_loan",
+			"status",
+			"disbursement_date",
+			"disbursed_amount",
+			"applicant_type",
+			"applicant",
+			"rate_of_interest",
+			"total_interest_payable",
+			"written_off_amount",
+			"total_principal_paid",
+			"repayment_start_date",
+			"company",
+			"loan_product",
+		],
+		filters=query_filters,
+	)
 
 
 def make_accrual_interest_entry_for_term_loans(
-	posting_date, process_loan_interest, term_loan=None, loan_product=None, accrual_type="Regular"
+	posting_date,
+	process_loan_interest,
+	term_loan=None,
+	loan_product=None,
+	accrual_type="Regular",
+	bulk=False,
+	term_loans=None,
 ):
 	curr_date = posting_date or add_days(nowdate(), 1)
 
-	term_loans = get_term_loans(curr_date, term_loan, loan_product)
+	if term_loans is None:
+		term_loans = get_term_loans(curr_date, term_loan, loan_product)
+
+	if bulk:
+		make_bulk_accrual_entries_for_term_loans(
+			term_loans, posting_date, process_loan_interest, accrual_type
+		)
+		return
 
 	accrued_entries = []
 
 	for loan in term_loans:
 		accrued_entries.append(loan.payment_entry)
-		args = frappe._dict(
-			{
-				"loan": loan.name,
-				"applicant_type": loan.applicant_type,
-				"applicant": loan.applicant,
-				"interest_income_account": loan.interest_income_account,
-				"loan_account": loan.loan_account,
-				"interest_amount": loan.interest_amount,
-				"payable_principal": loan.principal_amount,
-				"process_loan_interest": process_loan_interest,
-				"repayment_schedule_name": loan.payment_entry,
-				"posting_date": posting_date,
-				"accrual_type": accrual_type,
-				"due_date": loan.payment_date,
-			}
-		)
+		args = get_term_loan_accrual_args(loan, posting_date, process_loan_interest, accrual_type)
 
 		make_loan_interest_accrual_entry(args)
 
+	mark_schedule_entries_as_accrued(accrued_entries)
+
+
+def make_bulk_accrual_entries_for_term_loans(
+	term_loans, posting_date, process_loan_interest, accrual_type="Regular", batch_size=1000
+):
+	"""Book term loan accruals with multi-row inserts instead of a save and submit per accrual.
+
+	Accruals are built in memory from the same arguments as the per document path and their
+	GL entries are posted through the standard `make_gl_entries`, once per company in a batch.
+	"""
+	loan_wise_entries = {}
+	for loan in term_loans:
+		loan_wise_entries.setdefault(loan.name, []).append(loan)
+
+	loans = list(loan_wise_entries)
+
+	for i in range(0, len(loans), batch_size):
+		batch = loans[i : i + batch_size]
+		last_accrual_dates = get_last_accrual_dates(batch, posting_date)
+		account_details_map = {}
+		accruals = []
+		accrued_entries = []
+
+		for loan_name in batch:
+			for loan in loan_wise_entries[loan_name]:
+				args = get_term_loan_accrual_args(loan, posting_date, process_loan_interest, accrual_type)
+				accrual = get_loan_interest_accrual_doc(args)
+
+				accrual.update(
+					{
+						"company": loan.company,
+						"is_term_loan": loan.is_term_loan,
+						"loan_product": loan.loan_product,
+						"is_npa": loan.manual_npa,
+						"last_accrual_date": get_last_accrual_date_from_details(last_accrual_dates[loan_name]),
+					}
+				)
+				accrual.validate()
+
+				# interest for this posting date is now booked for the loan
+				last_accrual_dates[loan_name].last_posting_date = accrual.posting_date
+
+				if loan.loan_product not in account_details_map:
+					account_details_map[loan.loan_product] = get_interest_account_details(loan.loan_product)
+
+				accrual.flags.cost_center = loan.cost_center
+				accruals.append(accrual)
+				accrued_entries.append(loan.payment_entry)
+
+		submit_accruals_in_bulk(accruals, account_details_map)
+		mark_schedule_entries_as_accrued(accrued_entries)
+		update_last_accrual_date(batch, posting_date or nowdate())
+
+
+def submit_accruals_in_bulk(accruals, account_details_map):
+	from lending.loan_management.utils import bulk_insert_docs, get_series_names
+
+	if not accruals:
+		return
+
+	autoname = frappe.get_meta("Loan Interest Accrual").autoname
+	for accrual, name in zip(accruals, get_series_names(autoname, len(accruals))):
+		accrual.name = name
+		accrual.docstatus = 1
+
+	bulk_insert_docs(accruals)
+
+	company_wise_gl_map = {}
+	for accrual in accruals:
+		company_wise_gl_map.setdefault(accrual.company, []).extend(
+			accrual.get_gl_map(accrual.flags.cost_center, account_details_map[accrual.loan_product])
+		)
+
+	for gl_map in company_wise_gl_map.values():
+		if gl_map:
+			# accrual entries of different vouchers are never merged in the per document path either
+			make_gl_entries(gl_map, merge_entries=False)
+
+
+def get_term_loan_accrual_args(loan, posting_date, process_loan_interest, accrual_type):
+	return frappe._dict(
+		{
+			"loan": loan.name,
+			"applicant_type": loan.applicant_type,
+			"applicant": loan.applicant,
+			"interest_income_account": loan.interest_income_account,
+			"loan_account": loan.loan_account,
+			"interest_amount": loan.interest_amount,
+			"payable_principal": loan.principal_amount,
+			"process_loan_interest": process_loan_interest,
+			"repayment_schedule_name": loan.payment_entry,
+			"posting_date": posting_date,
+			"accrual_type": accrual_type,
+			"due_date": loan.payment_date,
+		}
+	)
+
+
+def mark_schedule_entries_as_accrued(accrued_entries):
 	if accrued_entries:
 		frappe.db.sql(
 			"""UPDATE `tabRepayment Schedule`
@@ -247,7 +385,7 @@ def make_accrual_interest_entry_for_term_loans(
 		)
 
 
-def get_term_loans(date, term_loan=None, loan_product=None):
+def get_term_loans(date, term_loan=None, loan_product=None, loans=None):
 	loan = frappe.qb.DocType("Loan")
 	loan_schedule = frappe.qb.DocType("Loan Repayment Schedule")
 	loan_repayment_schedule = frappe.qb.DocType("Repayment Schedule")
@@ -271,6 +409,10 @@ def get_term_loans(date, term_loan=None, loan_product=None):
 			loan.rate_of_interest,
 			loan.total_interest_payable,
 			loan.repayment_start_date,
+			loan.company,
+			loan.loan_product,
+			loan.manual_npa,
+			loan.cost_center,
 			loan_repayment_schedule.name.as_("payment_entry"),
 			loan_repayment_schedule.payment_date,
 			loan_repayment_schedule.principal_amount,
@@ -296,12 +438,22 @@ def get_term_loans(date, term_loan=None, loan_product=None):
 	if loan_product:
 		query = query.where(loan.loan_product == loan_product)
 
+	if loans:
+		query = query.where(loan.name.isin(loans))
+
 	term_loans = query.run(as_dict=1)
 
 	return term_loans
 
 
 def make_loan_interest_accrual_entry(args):
+	loan_interest_accrual = get_loan_interest_accrual_doc(args)
+
+	loan_interest_accrual.save()
+	loan_interest_accrual.submit()
+
+
+def get_loan_interest_accrual_doc(args):
 	precision = cint(frappe.db.get_default("currency_precision")) or 2
 
 	loan_interest_accrual = frappe.new_doc("Loan Interest Accrual")
@@ -323,8 +475,7 @@ def make_loan_interest_accrual_entry(args):
 	loan_interest_accrual.accrual_type = args.accrual_type
 	loan_interest_accrual.due_date = args.due_date
 
-	loan_interest_accrual.save()
-	loan_interest_accrual.submit()
+	return loan_interest_accrual
 
 
 def get_no_of_days_for_interest_accural(loan, posting_date):
@@ -336,25 +487,81 @@ def get_no_of_days_for_interest_accural(loan, posting_date):
 
 
 def get_last_accrual_date(loan, posting_date):
-	last_posting_date = frappe.db.sql(
-		""" SELECT MAX(posting_date) from `tabLoan Interest Accrual`
-		WHERE loan = %s and docstatus = 1""",
-		(loan),
+	last_accrual_date, last_disbursement_date, disbursement_date = frappe.db.get_value(
+		"Loan", loan, ["last_accrual_date", "last_disbursement_date", "disbursement_date"]
 	)
 
-	if last_posting_date[0][0]:
-		last_interest_accrual_date = last_posting_date[0][0]
-		# interest for last interest accrual date is already booked, so add 1 day
-		last_disbursement_date = get_last_disbursement_date(loan, posting_date)
+	if last_accrual_date:
+		# only disbursements before the posting date count, look them up for backdated accruals
+		if last_disbursement_date and getdate(last_disbursement_date) >= getdate(posting_date):
+			last_disbursement_date = get_last_disbursement_date(loan, posting_date)
 
-		if last_disbursement_date and getdate(last_disbursement_date) > add_days(
-			getdate(last_interest_accrual_date), 1
-		):
-			last_interest_accrual_date = last_disbursement_date
-
-		return add_days(last_interest_accrual_date, 1)
+		return compute_last_accrual_date(last_accrual_date, last_disbursement_date)
 	else:
-		return frappe.db.get_value("Loan", loan, "disbursement_date")
+		return disbursement_date
+
+
+def compute_last_accrual_date(last_posting_date, last_disbursement_date):
+	last_interest_accrual_date = last_posting_date
+
+	if last_disbursement_date and getdate(last_disbursement_date) > add_days(
+		getdate(last_interest_accrual_date), 1
+	):
+		last_interest_accrual_date = last_disbursement_date
+
+	# interest for last interest accrual date is already booked, so add 1 day
+	return add_days(last_interest_accrual_date, 1)
+
+
+def get_last_accrual_date_from_details(details):
+	if details.last_posting_date:
+		return compute_last_accrual_date(details.last_posting_date, details.last_disbursement_date)
+
+	return details.disbursement_date
+
+
+def get_last_accrual_dates(loans, posting_date):
+	"""Bulk counterpart of `get_last_accrual_date`"""
+	loan_details = frappe.get_all(
+		"Loan",
+		filters={"name": ("in", loans)},
+		fields=["name", "last_accrual_date", "last_disbursement_date", "disbursement_date"],
+	)
+
+	last_accrual_dates = {}
+	for loan in loan_details:
+		last_disbursement_date = loan.last_disbursement_date
+		if last_disbursement_date and getdate(last_disbursement_date) >= getdate(posting_date):
+			last_disbursement_date = get_last_disbursement_date(loan.name, posting_date)
+
+		last_accrual_dates[loan.name] = frappe._dict(
+			{
+				"last_posting_date": loan.last_accrual_date,
+				"last_disbursement_date": last_disbursement_date,
+				"disbursement_date": loan.disbursement_date,
+			}
+		)
+
+	return last_accrual_dates
+
+
+def update_last_accrual_date(loans, posting_date):
+	"""Move `Loan.last_accrual_date` forward when accruals are booked"""
+	frappe.db.sql(
+		"""
+		UPDATE `tabLoan`
+		SET last_accrual_date = GREATEST(IFNULL(last_accrual_date, %(posting_date)s), %(posting_date)s)
+		WHERE name IN %(loans)s
+	""",
+		{"loans": tuple(loans), "posting_date": getdate(posting_date)},
+	)
+
+
+def reset_last_accrual_date(loan):
+	last_accrual_date = frappe.db.get_value(
+		"Loan Interest Accrual", {"loan": loan, "docstatus": 1}, "MAX(posting_date)"
+	)
+	frappe.db.set_value("Loan", loan, "last_accrual_date", last_accrual_date, update_modified=False)
 
 
 def get_last_disbursement_date(loan, posting_date):
@@ -419,3 +626,9 @@ def get_interest_amount(
 		no_of_days = 30
 
 	return interest_per_day * no_of_days
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Interest Accrual", ["loan", "docstatus", "due_date"])
+	frappe.db.add_index("Loan Interest Accrual", ["loan", "docstatus", "posting_date"])
+	frappe.db.add_index("Loan Interest Accrual", ["process_loan_interest_accrual"])
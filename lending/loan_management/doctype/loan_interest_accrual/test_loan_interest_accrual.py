@@ -5,6 +5,7 @@ from frappe.utils import add_to_date, date_diff, flt, get_datetime, get_first_da
 
 from erpnext.selling.doctype.customer.test_customer import get_customer_dict
 
+from lending.loan_management.doctype.loan.loan import move_unpaid_interest_to_suspense_ledger
 from lending.loan_management.doctype.loan.test_loan import (
 	create_demand_loan,
 	create_loan,
@@ -180,6 +181,181 @@ class TestLoanInterestAccrual(unittest.TestCase):
 		self.assertEqual(loan_details.manual_npa, 1)
 		self.assertEqual(applicant_status, 1)
 
+	def test_classification_name_change(self):
+		loan = create_loan(
+			applicant=self.applicant,
+			loan_product="Term Loan With DPD",
+			loan_amount=1200000,
+			repayment_method="Repay Over Number of Periods",
+			repayment_periods=12,
+			applicant_type="Customer",
+			repayment_start_date="2023-01-31",
+			posting_date="2023-01-01",
+		)
+		loan.submit()
+
+		make_loan_disbursement_entry(loan.name, loan.loan_amount, disbursement_date="2023-02-01")
+		process_loan_interest_accrual_for_term_loans(posting_date="2023-02-01", loan=loan.name)
+		create_process_loan_classification(posting_date="2023-03-10", loan=loan.name)
+
+		self.assertEqual(frappe.db.get_value("Loan", loan.name, "classification_code"), "SMA-1")
+
+		# same DPD bucket, but a stale name is rewritten
+		frappe.db.set_value("Loan", loan.name, "classification_name", "Old Name")
+		create_process_loan_classification(posting_date="2023-03-11", loan=loan.name)
+
+		self.assertEqual(
+			frappe.db.get_value("Loan", loan.name, "classification_name"), "Special Mention Account - 1"
+		)
+
+	def test_npa_across_applicant_loans(self):
+		applicant = make_npa_test_customer()
+		loans = []
+		for i in range(2):
+			loan = create_loan(
+				applicant=applicant,
+				loan_product="Term Loan With DPD",
+				loan_amount=1200000,
+				repayment_method="Repay Over Number of Periods",
+				repayment_periods=12,
+				applicant_type="Customer",
+				repayment_start_date="2023-01-31",
+				posting_date="2023-01-01",
+			)
+			loan.submit()
+			make_loan_disbursement_entry(loan.name, loan.loan_amount, disbursement_date="2023-02-01")
+			loans.append(loan.name)
+
+		process_loan_interest_accrual_for_term_loans(posting_date="2023-02-01", loan=loans[0])
+
+		# a run scoped to the first loan flags every active loan of the applicant
+		create_process_loan_classification(posting_date="2023-07-05", loan=loans[0])
+
+		for loan in loans:
+			self.assertEqual(
+				frappe.db.get_value("Loan", loan, ["is_npa", "manual_npa"], as_dict=1),
+				{"is_npa": 1, "manual_npa": 1},
+			)
+		self.assertEqual(frappe.db.get_value("Customer", applicant, "is_npa"), 1)
+
+		# a loan missing one of the flags is brought back in line
+		frappe.db.set_value("Loan", loans[1], "manual_npa", 0)
+		create_process_loan_classification(posting_date="2023-07-06", loan=loans[0])
+		self.assertEqual(frappe.db.get_value("Loan", loans[1], "manual_npa"), 1)
+
+		# before the first due date there is no DPD left, so the NPA flags are cleared
+		create_process_loan_classification(posting_date="2023-01-15", loan=loans[0])
+
+		for loan in loans:
+			self.assertEqual(
+				frappe.db.get_value("Loan", loan, ["is_npa", "manual_npa"], as_dict=1),
+				{"is_npa": 0, "manual_npa": 0},
+			)
+		self.assertEqual(frappe.db.get_value("Customer", applicant, "is_npa"), 0)
+
+	def test_suspense_transfer_entry(self):
+		applicant = make_npa_test_customer()
+		loan = create_loan(
+			applicant=applicant,
+			loan_product="Term Loan With DPD",
+			loan_amount=1200000,
+			repayment_method="Repay Over Number of Periods",
+			repayment_periods=12,
+			applicant_type="Customer",
+			repayment_start_date="2023-01-31",
+			posting_date="2023-01-01",
+		)
+		loan.submit()
+
+		make_loan_disbursement_entry(loan.name, loan.loan_amount, disbursement_date="2023-02-01")
+		process_loan_interest_accrual_for_term_loans(posting_date="2023-03-01", loan=loan.name)
+
+		unpaid_interest = flt(
+			sum(
+				d.interest_amount - d.paid_interest_amount
+				for d in frappe.get_all(
+					"Loan Interest Accrual",
+					filters={"loan": loan.name, "docstatus": 1},
+					fields=["interest_amount", "paid_interest_amount"],
+				)
+			),
+			2,
+		)
+		self.assertTrue(unpaid_interest > 0)
+
+		move_unpaid_interest_to_suspense_ledger(loan=loan.name, posting_date="2023-03-10")
+		move_unpaid_interest_to_suspense_ledger(loan=loan.name, posting_date="2023-03-20", reverse=1)
+
+		journal_entries = frappe.get_all(
+			"Journal Entry",
+			filters={"name": ("in", get_loan_journal_entries(loan.name)), "docstatus": 1},
+			fields=["name", "posting_date", "total_debit", "total_credit"],
+			order_by="posting_date asc",
+		)
+
+		# one balanced entry per loan in each direction
+		self.assertEqual([str(d.posting_date) for d in journal_entries], ["2023-03-10", "2023-03-20"])
+
+		for jv, (debit, credit) in zip(journal_entries, [("debit", "credit"), ("credit", "debit")]):
+			self.assertEqual(flt(jv.total_debit, 2), flt(jv.total_credit, 2))
+
+			suspense_receivable = frappe.db.get_value(
+				"Journal Entry Account",
+				{"parent": jv.name, "account": "Suspense Interest Receivable - _TC"},
+				[debit, credit],
+				as_dict=1,
+			)
+			self.assertEqual(flt(suspense_receivable[debit], 2), unpaid_interest)
+			self.assertEqual(flt(suspense_receivable[credit], 2), 0)
+
+	def test_bulk_term_loan_accrual(self):
+		loan = create_loan(
+			applicant=self.applicant,
+			loan_product="Term Loan With DPD",
+			loan_amount=1200000,
+			repayment_method="Repay Over Number of Periods",
+			repayment_periods=12,
+			applicant_type="Customer",
+			repayment_start_date="2023-01-31",
+			posting_date="2023-01-01",
+		)
+		loan.submit()
+
+		make_loan_disbursement_entry(loan.name, loan.loan_amount, disbursement_date="2023-01-01")
+		process = process_loan_interest_accrual_for_term_loans(
+			posting_date="2023-03-01", loan=loan.name, bulk_accrual=1
+		)
+
+		schedule = frappe.get_all(
+			"Repayment Schedule",
+			filters={
+				"parent": frappe.db.get_value("Loan Repayment Schedule", {"loan": loan.name, "docstatus": 1}),
+				"payment_date": ("<=", "2023-03-01"),
+			},
+			fields=["name", "interest_amount", "principal_amount", "is_accrued"],
+		)
+		accruals = frappe.get_all(
+			"Loan Interest Accrual",
+			filters={"loan": loan.name, "process_loan_interest_accrual": process, "docstatus": 1},
+			fields=["name", "interest_amount", "payable_principal_amount", "repayment_schedule_name"],
+		)
+
+		self.assertEqual(len(accruals), len(schedule))
+
+		schedule_map = {d.name: d for d in schedule}
+		for accrual in accruals:
+			row = schedule_map[accrual.repayment_schedule_name]
+			self.assertEqual(row.is_accrued, 1)
+			self.assertEqual(flt(accrual.interest_amount, 2), flt(row.interest_amount, 2))
+			self.assertEqual(accrual.payable_principal_amount, row.principal_amount)
+
+			gl_debit = frappe.db.get_value(
+				"GL Entry",
+				{"voucher_type": "Loan Interest Accrual", "voucher_no": accrual.name, "is_cancelled": 0},
+				"sum(debit)",
+			)
+			self.assertEqual(flt(gl_debit, 2), flt(accrual.interest_amount, 2))
+
 	def test_accumulated_amounts(self):
 		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
 
@@ -224,6 +400,24 @@ class TestLoanInterestAccrual(unittest.TestCase):
 		)
 
 
+def get_loan_journal_entries(loan):
+	return frappe.get_all(
+		"Journal Entry Account",
+		filters={"reference_type": "Loan", "reference_name": loan},
+		pluck="parent",
+		distinct=True,
+	)
+
+
+def make_npa_test_customer():
+	# a new applicant each time, so that loans of earlier runs do not affect the NPA status
+	return (
+		frappe.get_doc(get_customer_dict("_Test NPA Loan Customer " + frappe.generate_hash(length=6)))
+		.insert(ignore_permissions=True)
+		.name
+	)
+
+
 def setup_loan_classification_ranges(company):
 	classification_ranges = [
 		["SMA-0", "Special Mention Account - 0", 0, 30],
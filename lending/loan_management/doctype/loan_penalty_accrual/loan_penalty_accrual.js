@@ -0,0 +1,10 @@
+// Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+// For license information, please see license.txt
+
+lending.common.setup_filters("Loan Penalty Accrual");
+
+frappe.ui.form.on("Loan Penalty Accrual", {
+	// refresh: function(frm) {
+
+	// }
+});
@@ -0,0 +1,286 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+from pypika.terms import Case
+
+import frappe
+from frappe import _
+from frappe.query_builder import Order
+from frappe.utils import cint, flt, getdate, nowdate
+
+from erpnext.accounts.general_ledger import make_gl_entries
+from erpnext.controllers.accounts_controller import AccountsController
+
+from lending.loan_management.utils import bulk_insert_docs, get_series_names
+
+
+class LoanPenaltyAccrual(AccountsController):
+	def validate(self):
+		if not self.posting_date:
+			self.posting_date = nowdate()
+
+		if flt(self.penalty_amount) <= 0:
+			frappe.throw(_("Penalty Amount should be greater than zero"))
+
+	def on_submit(self):
+		self.make_gl_entries()
+
+	def on_cancel(self):
+		if flt(self.paid_penalty_amount):
+			frappe.throw(
+				_("Penalty of {0} is already paid against {1}, cancel the repayments first").format(
+					self.paid_penalty_amount, self.name
+				)
+			)
+
+		self.make_gl_entries(cancel=1)
+		self.ignore_linked_doctypes = ["GL Entry", "Payment Ledger Entry"]
+
+	def make_gl_entries(self, cancel=0, adv_adj=0):
+		gle_map = self.get_gl_map()
+
+		if gle_map:
+			make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj)
+
+	def get_gl_map(self):
+		remarks = _("Penalty accrued till {0} against loan: {1}").format(self.posting_date, self.loan)
+
+		return [
+			self.get_gl_dict(
+				{
+					"account": self.penalty_receivable_account,
+					"party_type": self.applicant_type,
+					"party": self.applicant,
+					"against": self.penalty_income_account,
+					"debit": self.penalty_amount,
+					"debit_in_account_currency": self.penalty_amount,
+					"against_voucher_type": "Loan",
+					"against_voucher": self.loan,
+					"remarks": remarks,
+					"cost_center": self.cost_center,
+					"posting_date": self.posting_date,
+				}
+			),
+			self.get_gl_dict(
+				{
+					"account": self.penalty_income_account,
+					"against": self.penalty_receivable_account,
+					"credit": self.penalty_amount,
+					"credit_in_account_currency": self.penalty_amount,
+					"against_voucher_type": "Loan",
+					"against_voucher": self.loan,
+					"remarks": remarks,
+					"cost_center": self.cost_center,
+					"posting_date": self.posting_date,
+				}
+			),
+		]
+
+
+def process_loan_penalty_accrual(posting_date=None, loan_product=None, loan=None, batch_size=1000):
+	"""Book the penalty on overdue demands since the last penalty accrual of each loan
+
+	Runs daily, so that the payable penalty of a loan is the unpaid sum of its penalty accruals
+	plus the penalty of the days since the last one, see `get_penalty_amount`.
+	"""
+	from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+		get_accrued_interest_entries_for_loans,
+		get_penalty_amount,
+		get_penalty_details_for_loans,
+	)
+
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	posting_date = getdate(posting_date or nowdate())
+	loans = get_loans_for_penalty_accrual(posting_date, loan_product, loan)
+
+	for i in range(0, len(loans), batch_size):
+		batch = loans[i : i + batch_size]
+		loan_names = [d.name for d in batch]
+		accrued_interest_entries = get_accrued_interest_entries_for_loans(loan_names, posting_date)
+		penalty_details = get_penalty_details_for_loans(loan_names)
+
+		accruals = []
+		for d in batch:
+			penalty_amount = get_penalty_amount(
+				accrued_interest_entries.get(d.name, []),
+				d,
+				d,
+				penalty_details.get(d.name, (None, 0))[0],
+				posting_date,
+			)
+
+			if flt(penalty_amount, precision) > 0:
+				accruals.append(get_loan_penalty_accrual_doc(d, posting_date, penalty_amount))
+
+		submit_penalty_accruals_in_bulk(accruals)
+
+
+def get_loans_for_penalty_accrual(posting_date, loan_product=None, loan_name=None):
+	loan = frappe.qb.DocType("Loan")
+	product = frappe.qb.DocType("Loan Product")
+	interest_accrual = frappe.qb.DocType("Loan Interest Accrual")
+
+	query = (
+		frappe.qb.from_(loan)
+		.inner_join(product)
+		.on(loan.loan_product == product.name)
+		.inner_join(interest_accrual)
+		.on(interest_accrual.loan == loan.name)
+		.select(
+			loan.name,
+			loan.company,
+			loan.applicant_type,
+			loan.applicant,
+			loan.loan_product,
+			loan.cost_center,
+			loan.penalty_income_account,
+			product.penalty_interest_rate,
+			product.grace_period_in_days,
+		)
+		.distinct()
+		.where(
+			(loan.docstatus == 1)
+			& (loan.status.isin(["Disbursed", "Partially Disbursed", "Loan Closure Requested"]))
+			& (product.penalty_interest_rate > 0)
+			& (interest_accrual.docstatus == 1)
+			& (interest_accrual.accrual_type == "Regular")
+			& (interest_accrual.due_date < posting_date)
+			& (
+				(interest_accrual.interest_amount > interest_accrual.paid_interest_amount)
+				| (interest_accrual.payable_principal_amount > interest_accrual.paid_principal_amount)
+			)
+		)
+		.orderby(loan.name)
+	)
+
+	if frappe.db.has_column("Loan", "repay_from_salary"):
+		query = query.where(loan.repay_from_salary == 0)
+
+	if loan_product:
+		query = query.where(loan.loan_product == loan_product)
+
+	if loan_name:
+		query = query.where(loan.name == loan_name)
+
+	return query.run(as_dict=1)
+
+
+def get_loan_penalty_accrual_doc(
+	loan, posting_date, penalty_amount, accrual_type="Regular", loan_repayment=None
+):
+	"""`loan` is a dict of the loan name, company, applicant, product, cost center and income account"""
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+
+	penalty_accrual = frappe.new_doc("Loan Penalty Accrual")
+	penalty_accrual.update(
+		{
+			"loan": loan.name,
+			"posting_date": posting_date,
+			"accrual_type": accrual_type,
+			"loan_repayment": loan_repayment,
+			"applicant_type": loan.applicant_type,
+			"applicant": loan.applicant,
+			"company": loan.company,
+			"loan_product": loan.loan_product,
+			"penalty_amount": flt(penalty_amount, precision),
+			"penalty_receivable_account": frappe.get_cached_value(
+				"Loan Product", loan.loan_product, "penalty_receivable_account"
+			),
+			"penalty_income_account": loan.penalty_income_account,
+			"cost_center": loan.cost_center,
+		}
+	)
+
+	return penalty_accrual
+
+
+def submit_penalty_accruals_in_bulk(accruals):
+	if not accruals:
+		return
+
+	autoname = frappe.get_meta("Loan Penalty Accrual").autoname
+	for accrual, name in zip(accruals, get_series_names(autoname, len(accruals))):
+		accrual.name = name
+		accrual.docstatus = 1
+		accrual.validate()
+
+	bulk_insert_docs(accruals)
+
+	company_wise_gl_map = {}
+	for accrual in accruals:
+		company_wise_gl_map.setdefault(accrual.company, []).extend(accrual.get_gl_map())
+
+	for gl_map in company_wise_gl_map.values():
+		make_gl_entries(gl_map, merge_entries=False)
+
+
+def update_paid_penalty_amounts(loan_wise_paid_amounts, cancel=0):
+	"""Settle the penalty paid per loan against its oldest unpaid penalty accruals
+
+	On cancel the amounts are taken back from the latest paid accruals first.
+	"""
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	remaining_amounts = {
+		loan: flt(amount, precision)
+		for loan, amount in loan_wise_paid_amounts.items()
+		if flt(amount, precision) > 0
+	}
+
+	if not remaining_amounts:
+		return
+
+	penalty_accrual = frappe.qb.DocType("Loan Penalty Accrual")
+	order = Order.desc if cancel else Order.asc
+	query = (
+		frappe.qb.from_(penalty_accrual)
+		.select(
+			penalty_accrual.name,
+			penalty_accrual.loan,
+			penalty_accrual.penalty_amount,
+			penalty_accrual.paid_penalty_amount,
+		)
+		.where((penalty_accrual.loan.isin(list(remaining_amounts))) & (penalty_accrual.docstatus == 1))
+		.orderby(penalty_accrual.posting_date, order=order)
+		.orderby(penalty_accrual.name, order=order)
+	)
+
+	if cancel:
+		query = query.where(penalty_accrual.paid_penalty_amount > 0)
+	else:
+		query = query.where(penalty_accrual.penalty_amount > penalty_accrual.paid_penalty_amount)
+
+	paid_amounts = {}
+	for d in query.run(as_dict=1):
+		if remaining_amounts[d.loan] <= 0:
+			continue
+
+		if cancel:
+			available_amount = flt(d.paid_penalty_amount, precision)
+		else:
+			available_amount = flt(d.penalty_amount - d.paid_penalty_amount, precision)
+
+		amount = min(remaining_amounts[d.loan], available_amount)
+		remaining_amounts[d.loan] = flt(remaining_amounts[d.loan] - amount, precision)
+		paid_amounts[d.name] = -amount if cancel else amount
+
+	accruals = list(paid_amounts)
+	for i in range(0, len(accruals), 1000):
+		chunk = accruals[i : i + 1000]
+		paid_penalty_amount = Case()
+		for name in chunk:
+			paid_penalty_amount = paid_penalty_amount.when(penalty_accrual.name == name, paid_amounts[name])
+
+		(
+			frappe.qb.update(penalty_accrual)
+			.set(
+				penalty_accrual.paid_penalty_amount,
+				penalty_accrual.paid_penalty_amount + paid_penalty_amount.else_(0),
+			)
+			.where(penalty_accrual.name.isin(chunk))
+		).run()
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Penalty Accrual", ["loan", "docstatus", "posting_date"])
+	frappe.db.add_index("Loan Penalty Accrual", ["loan_repayment"])
@@ -0,0 +1,119 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, flt, get_datetime, nowdate
+
+from erpnext.selling.doctype.customer.test_customer import get_customer_dict
+
+from lending.loan_management.doctype.loan.test_loan import (
+	create_loan_accounts,
+	create_loan_product,
+	create_loan_scenario_for_penalty,
+	create_loan_security,
+	create_loan_security_price,
+	create_loan_security_type,
+	set_loan_settings_in_company,
+)
+from lending.loan_management.doctype.loan_penalty_accrual.loan_penalty_accrual import (
+	process_loan_penalty_accrual,
+	update_paid_penalty_amounts,
+)
+from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
+
+
+class TestLoanPenaltyAccrual(FrappeTestCase):
+	def setUp(self):
+		set_loan_settings_in_company()
+		create_loan_accounts()
+
+		create_loan_product(
+			"Demand Loan",
+			"Demand Loan",
+			2000000,
+			13.5,
+			25,
+			0,
+			5,
+			"Cash",
+			"Disbursement Account - _TC",
+			"Payment Account - _TC",
+			"Loan Account - _TC",
+			"Interest Income Account - _TC",
+			"Penalty Income Account - _TC",
+		)
+
+		create_loan_security_type()
+		create_loan_security()
+
+		create_loan_security_price(
+			"Test Security 1", 500, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+
+		if not frappe.db.exists("Customer", "_Test Loan Customer"):
+			frappe.get_doc(get_customer_dict("_Test Loan Customer")).insert(ignore_permissions=True)
+
+		self.applicant2 = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+	def test_penalty_accrual(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+		posting_date = "2019-11-30"
+		penalty_amount = calculate_amounts(loan.name, posting_date)["penalty_amount"]
+
+		process_loan_penalty_accrual(posting_date=posting_date, loan=loan.name)
+
+		booked_penalty_amount = frappe.db.get_value(
+			"Loan Penalty Accrual",
+			{"loan": loan.name, "accrual_type": "Regular", "docstatus": 1},
+			"sum(penalty_amount)",
+		)
+		amounts = calculate_amounts(loan.name, posting_date)
+
+		self.assertEqual(flt(booked_penalty_amount, 2), penalty_amount)
+		self.assertEqual(amounts["penalty_amount"], penalty_amount)
+		self.assertEqual(amounts["unbooked_penalty_amount"], 0)
+
+	def test_penalty_settlement_order(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		process_loan_penalty_accrual(posting_date="2019-11-15", loan=loan.name)
+		process_loan_penalty_accrual(posting_date="2019-11-30", loan=loan.name)
+
+		accruals = get_penalty_accruals(loan.name)
+		self.assertTrue(len(accruals) >= 2)
+		first, second = accruals[0], accruals[1]
+
+		# the oldest accrual is settled first and the rest goes to the next one
+		update_paid_penalty_amounts(
+			{loan.name: flt(first.penalty_amount - first.paid_penalty_amount, 2) + 1}
+		)
+		accruals = {d.name: d for d in get_penalty_accruals(loan.name)}
+
+		self.assertEqual(flt(accruals[first.name].paid_penalty_amount, 2), flt(first.penalty_amount, 2))
+		self.assertEqual(
+			flt(accruals[second.name].paid_penalty_amount, 2), flt(second.paid_penalty_amount + 1, 2)
+		)
+
+		# on cancel, the latest paid accrual is taken back first
+		update_paid_penalty_amounts({loan.name: 1}, cancel=1)
+		accruals = {d.name: d for d in get_penalty_accruals(loan.name)}
+
+		self.assertEqual(flt(accruals[first.name].paid_penalty_amount, 2), flt(first.penalty_amount, 2))
+		self.assertEqual(
+			flt(accruals[second.name].paid_penalty_amount, 2), flt(second.paid_penalty_amount, 2)
+		)
+
+		# a paid accrual can only be cancelled after the repayments settling it
+		self.assertRaises(
+			frappe.ValidationError, frappe.get_doc("Loan Penalty Accrual", first.name).cancel
+		)
+
+
+def get_penalty_accruals(loan):
+	return frappe.get_all(
+		"Loan Penalty Accrual",
+		filters={"loan": loan, "docstatus": 1},
+		fields=["name", "penalty_amount", "paid_penalty_amount"],
+		order_by="posting_date asc, name asc",
+	)
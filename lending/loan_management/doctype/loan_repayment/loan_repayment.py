@@ -2,8 +2,15 @@
 # For license information, please see license.txt
 
 
+import csv
+import io
+import json
+
+from pypika.terms import Case
+
 import frappe
 from frappe import _
+from frappe.query_builder.functions import Max, Sum
 from frappe.utils import add_days, cint, date_diff, flt, get_datetime, getdate
 
 import erpnext
@@ -15,15 +22,22 @@ from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual
 	get_last_accrual_date,
 	get_per_day_interest,
 )
+from lending.loan_management.doctype.loan_penalty_accrual.loan_penalty_accrual import (
+	get_loan_penalty_accrual_doc,
+	submit_penalty_accruals_in_bulk,
+	update_paid_penalty_amounts,
+)
 from lending.loan_management.doctype.loan_security_shortfall.loan_security_shortfall import (
 	update_shortfall_status,
 )
 from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
 	create_process_loan_classification,
+	mark_loans_for_classification,
 )
 from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
 	process_loan_interest_accrual_for_demand_loans,
 )
+from lending.loan_management.utils import bulk_insert_docs, get_series_names
 
 
 class LoanRepayment(AccountsController):
@@ -34,30 +48,37 @@ class LoanRepayment(AccountsController):
 		self.check_future_entries()
 		self.validate_amount()
 		self.allocate_amounts(amounts)
+		self.flags.unbooked_penalty_amount = amounts["unbooked_penalty_amount"]
 
 	def before_submit(self):
 		self.book_unaccrued_interest()
 
 	def on_submit(self):
 		if self.repayment_type == "Normal Repayment":
+			self.classify_loan()
+
+		self.update_paid_amount()
+		self.update_penalty_accruals()
+		if self.repayment_type == "Charges Waiver":
+			self.make_credit_note()
 
+		self.make_gl_entries()
+
+	def classify_loan(self):
+		if self.flags.classify_immediately or frappe.get_cached_value(
+			"Company", self.company, "classify_loans_immediately_on_repayment"
+		):
 			create_process_loan_classification(
 				posting_date=self.posting_date,
 				loan_product=self.loan_product,
 				loan=self.against_loan,
 				payment_reference=self.name,
 			)
-
-		# self.update_repayment_schedule()
-		self.update_paid_amount()
-		if self.repayment_type == "Charges Waiver":
-			self.make_credit_note()
-
-		self.make_gl_entries()
+		else:
+			mark_loans_for_classification([self.against_loan], self.posting_date)
 
 	def on_cancel(self):
 		self.check_future_accruals()
-		# self.update_repayment_schedule(cancel=1)
 		if self.repayment_type == "Normal Repayment":
 			self.mark_as_unpaid()
 			if self.is_npa or self.manual_npa:
@@ -68,6 +89,7 @@ class LoanRepayment(AccountsController):
 
 			frappe.db.set_value("Loan", self.against_loan, "days_past_due", self.days_past_due)
 
+		self.cancel_penalty_accruals()
 		self.ignore_linked_doctypes = [
 			"GL Entry",
 			"Payment Ledger Entry",
@@ -75,6 +97,49 @@ class LoanRepayment(AccountsController):
 		]
 		self.make_gl_entries(cancel=1)
 
+	def update_penalty_accruals(self):
+		# penalty of the days since the last penalty accrual is booked as of the repayment
+		penalty_accrual = self.get_penalty_accrual()
+		if penalty_accrual:
+			penalty_accrual.save()
+			penalty_accrual.submit()
+
+		update_paid_penalty_amounts({self.against_loan: self.total_penalty_paid})
+
+	def get_penalty_accrual(self):
+		precision = cint(frappe.db.get_default("currency_precision")) or 2
+
+		if flt(self.flags.unbooked_penalty_amount, precision) <= 0:
+			return
+
+		loan = frappe._dict(
+			{
+				"name": self.against_loan,
+				"applicant_type": self.applicant_type,
+				"applicant": self.applicant,
+				"company": self.company,
+				"loan_product": self.loan_product,
+				"penalty_income_account": self.penalty_income_account,
+				"cost_center": self.cost_center,
+			}
+		)
+
+		return get_loan_penalty_accrual_doc(
+			loan,
+			getdate(self.posting_date),
+			self.flags.unbooked_penalty_amount,
+			accrual_type="Repayment",
+			loan_repayment=self.name,
+		)
+
+	def cancel_penalty_accruals(self):
+		update_paid_penalty_amounts({self.against_loan: self.total_penalty_paid}, cancel=1)
+
+		for name in frappe.get_all(
+			"Loan Penalty Accrual", {"loan_repayment": self.name, "docstatus": 1}, pluck="name"
+		):
+			frappe.get_doc("Loan Penalty Accrual", name).cancel()
+
 	def make_credit_note(self):
 		item_details = frappe.db.get_value(
 			"Loan Product",
@@ -111,7 +176,7 @@ class LoanRepayment(AccountsController):
 				si.save()
 				si.submit()
 
-	def set_missing_values(self, amounts):
+	def set_missing_values(self, amounts, shortfall_amount=None):
 		precision = cint(frappe.db.get_default("currency_precision")) or 2
 
 		if not self.posting_date:
@@ -146,11 +211,14 @@ class LoanRepayment(AccountsController):
 
 		self.total_charges_payable = flt(amounts["total_charges_payable"], precision)
 
-		shortfall_amount = flt(
-			frappe.db.get_value(
-				"Loan Security Shortfall", {"loan": self.against_loan, "status": "Pending"}, "shortfall_amount"
+		if shortfall_amount is None:
+			shortfall_amount = flt(
+				frappe.db.get_value(
+					"Loan Security Shortfall",
+					{"loan": self.against_loan, "status": "Pending"},
+					"shortfall_amount",
+				)
 			)
-		)
 
 		if shortfall_amount:
 			self.shortfall_amount = shortfall_amount
@@ -360,10 +428,6 @@ class LoanRepayment(AccountsController):
 				)
 			)
 
-	def update_repayment_schedule(self, cancel=0):
-		if self.is_term_loan and self.principal_amount_paid > self.payable_principal_amount:
-			regenerate_repayment_schedule(self.against_loan, cancel)
-
 	def allocate_amounts(self, repayment_details):
 		precision = cint(frappe.db.get_default("currency_precision")) or 2
 		self.set("repayment_details", [])
@@ -418,7 +482,7 @@ class LoanRepayment(AccountsController):
 
 	def offset_repayment_based_on_npa(self, interest_paid, repayment_details):
 		if interest_paid > 0:
-			offset_base_on = frappe.db.get_value(
+			offset_base_on = frappe.get_cached_value(
 				"Company",
 				self.company,
 				[
@@ -616,6 +680,12 @@ class LoanRepayment(AccountsController):
 			self.principal_amount_paid += interest_paid
 
 	def make_gl_entries(self, cancel=0, adv_adj=0):
+		gle_map = self.get_gl_entries()
+
+		if gle_map:
+			make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj, merge_entries=False)
+
+	def get_gl_entries(self):
 		gle_map = []
 		remarks = self.get_remarks()
 		payment_account = self.get_payment_account()
@@ -630,7 +700,7 @@ class LoanRepayment(AccountsController):
 			payment_party_type = "Employee"
 			payment_party = self.applicant
 
-		account_details = frappe.db.get_value(
+		account_details = frappe.get_cached_value(
 			"Loan Product",
 			self.loan_product,
 			[
@@ -643,7 +713,7 @@ class LoanRepayment(AccountsController):
 		)
 
 		if self.total_penalty_paid:
-			penalty_receivable_account = frappe.db.get_value(
+			penalty_receivable_account = frappe.get_cached_value(
 				"Loan Product", self.loan_product, "penalty_receivable_account"
 			)
 			gle_map.append(
@@ -816,8 +886,7 @@ class LoanRepayment(AccountsController):
 					)
 				)
 
-		if gle_map:
-			make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj, merge_entries=False)
+		return gle_map
 
 	def get_payment_account(self):
 		payment_account_field_map = {
@@ -935,91 +1004,58 @@ def get_accrued_interest_entries(against_loan, posting_date=None):
 	return unpaid_accrued_entries
 
 
-def get_penalty_details(against_loan):
-	penalty_details = frappe.db.sql(
+def get_accrued_interest_entries_for_loans(loans, posting_date):
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+
+	unpaid_accrued_entries = frappe.db.sql(
 		"""
-		SELECT posting_date, sum(penalty_amount - total_penalty_paid) as pending_penalty_amount
-		FROM `tabLoan Repayment` where posting_date >= (SELECT MAX(posting_date) from `tabLoan Repayment`
-		where against_loan = %s) and docstatus = 1 and against_loan = %s
-	""",
-		(against_loan, against_loan),
+			SELECT name, loan, due_date, interest_amount - paid_interest_amount as interest_amount,
+				payable_principal_amount - paid_principal_amount as payable_principal_amount,
+				accrual_type
+			FROM
+				`tabLoan Interest Accrual`
+			WHERE
+				loan IN %(loans)s
+			AND due_date <= %(posting_date)s
+			AND (interest_amount - paid_interest_amount > 0 OR
+				payable_principal_amount - paid_principal_amount > 0)
+			AND
+				docstatus = 1
+			ORDER BY due_date
+		""",
+		{"loans": tuple(loans), "posting_date": posting_date},
+		as_dict=1,
 	)
 
-	if penalty_details:
-		return penalty_details[0][0], flt(penalty_details[0][1])
-	else:
-		return None, 0
+	loan_wise_entries = {}
+	for d in unpaid_accrued_entries:
+		# Skip entries with zero interest amount & payable principal amount
+		if flt(d.interest_amount, precision) > 0 or flt(d.payable_principal_amount, precision) > 0:
+			loan_wise_entries.setdefault(d.loan, []).append(d)
 
+	return loan_wise_entries
 
-def regenerate_repayment_schedule(loan, cancel=0):
-	from lending.loan_management.doctype.loan.loan import (
-		add_single_month,
-		get_monthly_repayment_amount,
-	)
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
-	loan_doc = frappe.get_doc("Loan", loan)
-	next_accrual_date = None
-	accrued_entries = 0
-	last_repayment_amount = None
-	last_balance_amount = None
-
-	original_repayment_schedule_len = len(loan_doc.get("repayment_schedule"))
-
-	for term in reversed(loan_doc.get("repayment_schedule")):
-		if not term.is_accrued:
-			next_accrual_date = term.payment_date
-			loan_doc.remove(term)
-		else:
-			accrued_entries += 1
-			if last_repayment_amount is None:
-				last_repayment_amount = term.total_payment
-			if last_balance_amount is None:
-				last_balance_amount = term.balance_loan_amount
+def get_penalty_details(against_loan):
+	return get_penalty_details_for_loans([against_loan]).get(against_loan, (None, 0))
 
-	loan_doc.save()
 
-	balance_amount = get_pending_principal_amount(loan_doc)
+def get_penalty_details_for_loans(loans):
+	"""Date of the last penalty accrual and the unpaid penalty of each loan"""
+	penalty_accrual = frappe.qb.DocType("Loan Penalty Accrual")
 
-	if loan_doc.repayment_method == "Repay Fixed Amount per Period":
-		monthly_repayment_amount = flt(
-			balance_amount / (original_repayment_schedule_len - accrued_entries)
+	penalty_details = (
+		frappe.qb.from_(penalty_accrual)
+		.select(
+			penalty_accrual.loan,
+			Max(penalty_accrual.posting_date),
+			Sum(penalty_accrual.penalty_amount - penalty_accrual.paid_penalty_amount),
 		)
-	else:
-		repayment_period = loan_doc.repayment_periods - accrued_entries
-		if not cancel and repayment_period > 0:
-			monthly_repayment_amount = get_monthly_repayment_amount(
-				balance_amount, loan_doc.rate_of_interest, repayment_period
-			)
-		else:
-			monthly_repayment_amount = last_repayment_amount
-			balance_amount = last_balance_amount
-
-	payment_date = next_accrual_date
-
-	while flt(balance_amount, precision) > 0:
-		interest_amount = flt(balance_amount * flt(loan_doc.rate_of_interest) / (12 * 100))
-		principal_amount = monthly_repayment_amount - interest_amount
-		balance_amount = flt(balance_amount + interest_amount - monthly_repayment_amount)
-		if balance_amount < 0:
-			principal_amount += balance_amount
-			balance_amount = 0.0
-
-		total_payment = principal_amount + interest_amount
-		loan_doc.append(
-			"repayment_schedule",
-			{
-				"payment_date": payment_date,
-				"principal_amount": principal_amount,
-				"interest_amount": interest_amount,
-				"total_payment": total_payment,
-				"balance_loan_amount": balance_amount,
-			},
-		)
-		next_payment_date = add_single_month(payment_date)
-		payment_date = next_payment_date
+		.where((penalty_accrual.loan.isin(loans)) & (penalty_accrual.docstatus == 1))
+		.groupby(penalty_accrual.loan)
+	).run()
 
-	loan_doc.save()
+	return {d[0]: (d[1], flt(d[2])) for d in penalty_details}
 
 
 def get_pending_principal_amount(loan):
@@ -1052,52 +1088,44 @@ def get_pending_principal_amount(loan):
 
 
 def get_amounts(amounts, against_loan, posting_date, with_loan_details=False):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
-
 	against_loan_doc = frappe.get_doc("Loan", against_loan)
 	loan_product_details = frappe.get_doc("Loan Product", against_loan_doc.loan_product)
 	accrued_interest_entries = get_accrued_interest_entries(against_loan_doc.name, posting_date)
+	penalty_details = get_penalty_details(against_loan)
+
+	amounts = compute_amounts(
+		amounts,
+		against_loan_doc,
+		loan_product_details,
+		accrued_interest_entries,
+		penalty_details,
+		posting_date,
+	)
 
-	computed_penalty_date, pending_penalty_amount = get_penalty_details(against_loan)
-	pending_accrual_entries = {}
+	if with_loan_details:
+		return amounts, against_loan_doc.as_dict()
+	else:
+		return amounts
 
-	if against_loan_doc.is_term_loan:
-		pending_penalty_amount = 0
-		computed_penalty_date = None
+
+def compute_amounts(
+	amounts, loan, loan_product_details, accrued_interest_entries, penalty_details, posting_date
+):
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+
+	computed_penalty_date, pending_penalty_amount = penalty_details
+	pending_accrual_entries = {}
 
 	total_pending_interest = 0
-	penalty_amount = 0
 	payable_principal_amount = 0
 	final_due_date = ""
 	last_entry_due_date = ""
 
-	for entry in accrued_interest_entries:
-		# Loan repayment due date is one day after the loan interest is accrued
-		# no of late days are calculated based on loan repayment posting date
-		# and if no_of_late days are positive then penalty is levied
-
-		due_date_after_grace_period = add_days(entry.due_date, loan_product_details.grace_period_in_days)
-
-		if computed_penalty_date and getdate(computed_penalty_date) >= getdate(
-			due_date_after_grace_period
-		):
-			due_date_after_grace_period = computed_penalty_date
-
-		no_of_late_days = date_diff(posting_date, due_date_after_grace_period)
-
-		if (
-			no_of_late_days > 0
-			and (
-				not (hasattr(against_loan_doc, "repay_from_salary") and against_loan_doc.repay_from_salary)
-			)
-			and entry.accrual_type == "Regular"
-		):
-			penalty_amount += (
-				(entry.interest_amount + entry.payable_principal_amount)
-				* (loan_product_details.penalty_interest_rate / 100)
-				* no_of_late_days
-			) / 365
+	penalty_amount = get_penalty_amount(
+		accrued_interest_entries, loan, loan_product_details, computed_penalty_date, posting_date
+	)
 
+	for entry in accrued_interest_entries:
 		total_pending_interest += entry.interest_amount
 		payable_principal_amount += entry.payable_principal_amount
 
@@ -1113,13 +1141,13 @@ def get_amounts(amounts, against_loan, posting_date, with_loan_details=False):
 		if entry.due_date and not final_due_date:
 			final_due_date = add_days(entry.due_date, loan_product_details.grace_period_in_days)
 
-	pending_principal_amount = get_pending_principal_amount(against_loan_doc)
+	pending_principal_amount = get_pending_principal_amount(loan)
 
 	unaccrued_interest = 0
 	pending_days = date_diff(posting_date, last_entry_due_date)
 
 	if pending_days > 0:
-		if against_loan_doc.is_term_loan:
+		if loan.is_term_loan:
 			principal_amount = flt(pending_principal_amount - payable_principal_amount, precision)
 		else:
 			principal_amount = flt(pending_principal_amount, precision)
@@ -1136,26 +1164,58 @@ def get_amounts(amounts, against_loan, posting_date, with_loan_details=False):
 	amounts["payable_principal_amount"] = flt(payable_principal_amount, precision)
 	amounts["interest_amount"] = flt(total_pending_interest, precision)
 	amounts["penalty_amount"] = flt(penalty_amount + pending_penalty_amount, precision)
+	amounts["unbooked_penalty_amount"] = flt(penalty_amount, precision)
 	amounts["payable_amount"] = flt(
 		payable_principal_amount + total_pending_interest + penalty_amount, precision
 	)
 	amounts["pending_accrual_entries"] = pending_accrual_entries
 	amounts["unaccrued_interest"] = flt(unaccrued_interest, precision)
-	amounts["written_off_amount"] = flt(against_loan_doc.written_off_amount, precision)
+	amounts["written_off_amount"] = flt(loan.written_off_amount, precision)
 
 	if final_due_date:
 		amounts["due_date"] = final_due_date
 
-	if with_loan_details:
-		return amounts, against_loan_doc.as_dict()
-	else:
-		return amounts
+	return amounts
 
 
-@frappe.whitelist()
-def calculate_amounts(against_loan, posting_date, payment_type="", with_loan_details=False):
-	amounts = {
+def get_penalty_amount(
+	accrued_interest_entries, loan, loan_product_details, computed_penalty_date, posting_date
+):
+	"""Penalty on the overdue accruals for the days after `computed_penalty_date`, the date till
+	which penalty is already booked in Loan Penalty Accrual"""
+	penalty_amount = 0
+
+	if loan.get("repay_from_salary"):
+		return penalty_amount
+
+	for entry in accrued_interest_entries:
+		# Loan repayment due date is one day after the loan interest is accrued
+		# no of late days are calculated based on loan repayment posting date
+		# and if no_of_late days are positive then penalty is levied
+
+		due_date_after_grace_period = add_days(entry.due_date, loan_product_details.grace_period_in_days)
+
+		if computed_penalty_date and getdate(computed_penalty_date) >= getdate(
+			due_date_after_grace_period
+		):
+			due_date_after_grace_period = computed_penalty_date
+
+		no_of_late_days = date_diff(posting_date, due_date_after_grace_period)
+
+		if no_of_late_days > 0 and entry.accrual_type == "Regular":
+			penalty_amount += (
+				(entry.interest_amount + entry.payable_principal_amount)
+				* (flt(loan_product_details.penalty_interest_rate) / 100)
+				* no_of_late_days
+			) / 365
+
+	return penalty_amount
+
+
+def get_default_amounts():
+	return {
 		"penalty_amount": 0.0,
+		"unbooked_penalty_amount": 0.0,
 		"interest_amount": 0.0,
 		"pending_principal_amount": 0.0,
 		"payable_principal_amount": 0.0,
@@ -1166,13 +1226,35 @@ def calculate_amounts(against_loan, posting_date, payment_type="", with_loan_det
 		"available_security_deposit": 0.0,
 	}
 
+
+@frappe.whitelist()
+def calculate_amounts(against_loan, posting_date, payment_type="", with_loan_details=False):
+	amounts = get_default_amounts()
+
 	if with_loan_details:
 		amounts, loan_details = get_amounts(amounts, against_loan, posting_date, with_loan_details)
 	else:
 		amounts = get_amounts(amounts, against_loan, posting_date)
 
+	available_security_deposit = frappe.db.get_value(
+		"Loan Security Deposit", {"loan": against_loan}, "sum(deposit_amount - allocated_amount)"
+	)
+
+	set_charges_and_deposit(
+		amounts,
+		get_outstanding_invoices(against_loan, posting_date),
+		available_security_deposit,
+		payment_type,
+	)
+
+	if with_loan_details:
+		return {"amounts": amounts, "loan_details": loan_details}
+	else:
+		return amounts
+
+
+def set_charges_and_deposit(amounts, invoices, available_security_deposit, payment_type=""):
 	charges = []
-	invoices = get_outstanding_invoices(against_loan, posting_date)
 	for d in invoices:
 		charges.append(
 			{
@@ -1184,22 +1266,105 @@ def calculate_amounts(against_loan, posting_date, payment_type="", with_loan_det
 
 	amounts["charges"] = charges
 	amounts["payable_amount"] += amounts["total_charges_payable"]
-	amounts["available_security_deposit"] = frappe.db.get_value(
-		"Loan Security Deposit", {"loan": against_loan}, "sum(deposit_amount - allocated_amount)"
-	)
+	amounts["available_security_deposit"] = available_security_deposit
 
-	# update values for closure
 	if payment_type == "Loan Closure":
-		amounts["payable_principal_amount"] = amounts["pending_principal_amount"]
-		amounts["interest_amount"] += amounts["unaccrued_interest"]
-		amounts["payable_amount"] = (
-			amounts["payable_principal_amount"] + amounts["interest_amount"] + amounts["penalty_amount"]
+		set_closure_amounts(amounts)
+
+
+def set_closure_amounts(amounts):
+	# update values for closure
+	amounts["payable_principal_amount"] = amounts["pending_principal_amount"]
+	amounts["interest_amount"] += amounts["unaccrued_interest"]
+	amounts["payable_amount"] = (
+		amounts["payable_principal_amount"] + amounts["interest_amount"] + amounts["penalty_amount"]
+	)
+
+
+def calculate_amounts_bulk(loans, posting_date, payment_type=""):
+	"""Set based `calculate_amounts` for many loans.
+
+	Loans, products, accruals, penalties, invoices and security deposits are each loaded with
+	a single query for the whole batch. Returns a map of loan name to the same amounts dict
+	that `calculate_amounts` returns for that loan.
+	"""
+	if not posting_date:
+		posting_date = getdate()
+
+	loan_fields = [
+		"name",
+		"loan_product",
+		"is_term_loan",
+		"status",
+		"loan_amount",
+		"disbursed_amount",
+		"total_payment",
+		"debit_adjustment_amount",
+		"credit_adjustment_amount",
+		"total_principal_paid",
+		"total_interest_payable",
+		"written_off_amount",
+		"refund_amount",
+	]
+
+	if frappe.db.has_column("Loan", "repay_from_salary"):
+		loan_fields.append("repay_from_salary")
+
+	loan_details = frappe.get_all("Loan", filters={"name": ("in", loans)}, fields=loan_fields)
+
+	loan_product_details = {
+		d.name: d
+		for d in frappe.get_all(
+			"Loan Product",
+			filters={"name": ("in", list({d.loan_product for d in loan_details}))},
+			fields=[
+				"name",
+				"company",
+				"rate_of_interest",
+				"penalty_interest_rate",
+				"grace_period_in_days",
+			],
 		)
+	}
 
-	if with_loan_details:
-		return {"amounts": amounts, "loan_details": loan_details}
-	else:
-		return amounts
+	accrued_interest_entries = get_accrued_interest_entries_for_loans(loans, posting_date)
+	penalty_details = get_penalty_details_for_loans(loans)
+
+	invoices = {}
+	for d in get_outstanding_invoices_for_loans(loans, posting_date):
+		invoices.setdefault(d.loan, []).append(d)
+
+	security_deposits = dict(
+		frappe.get_all(
+			"Loan Security Deposit",
+			filters={"loan": ("in", loans)},
+			fields=["loan", "sum(deposit_amount - allocated_amount)"],
+			group_by="loan",
+			as_list=1,
+		)
+	)
+
+	loan_wise_amounts = {}
+	for loan in loan_details:
+		amounts = compute_amounts(
+			get_default_amounts(),
+			loan,
+			loan_product_details[loan.loan_product],
+			accrued_interest_entries.get(loan.name, []),
+			penalty_details.get(loan.name, (None, 0)),
+			posting_date,
+		)
+
+		set_charges_and_deposit(
+			amounts,
+			invoices.get(loan.name, []),
+			security_deposits.get(loan.name),
+			payment_type,
+		)
+
+		loan_wise_amounts[loan.name] = amounts
+
+	return loan_wise_amounts
 
 
 def get_outstanding_invoices(loan, posting_date):
@@ -1213,3 +1378,391 @@ def get_outstanding_invoices(loan, posting_date):
 		},
 		fields=["name as voucher_no", "outstanding_amount"],
 	)
+
+
+def get_outstanding_invoices_for_loans(loans, posting_date):
+	return frappe.db.get_all(
+		"Sales Invoice",
+		filters={
+			"loan": ("in", loans),
+			"outstanding_amount": ("!=", 0),
+			"docstatus": 1,
+			"due_date": ("<=", posting_date),
+		},
+		fields=["loan", "name as voucher_no", "outstanding_amount"],
+	)
+
+
+@frappe.whitelist()
+def bulk_create_loan_repayments(repayments, batch_size=5000):
+	"""Post a batch of Normal Repayments, like the rows of a bank or NACH collection file
+
+	`repayments` is a list (or its JSON) of rows with against_loan, amount_paid and optionally
+	posting_date, reference_number and reference_date, or CSV text with those columns as header.
+	The rows are posted in a background job, see `make_bulk_repayments`.
+	"""
+	frappe.has_permission("Loan Repayment", "submit", throw=True)
+
+	frappe.enqueue(
+		make_bulk_repayments,
+		queue="long",
+		timeout=3600,
+		rows=parse_bulk_repayments(repayments),
+		batch_size=batch_size,
+		user=frappe.session.user,
+	)
+
+	frappe.msgprint(_("The repayments will be posted in the background"), alert=True)
+
+
+def make_bulk_repayments(rows, batch_size=5000, user=None):
+	"""Post the parsed repayment rows in batches of `batch_size` loans, see `make_repayment_batch`
+
+	Each batch is committed on its own, so that a failing batch only rolls back its own rows and
+	the naming series lock is released between batches. Invalid rows are skipped and reported
+	with their errors, by their position (starting at 1) in the file, after every batch.
+	"""
+	batch_size = cint(batch_size) or 5000
+	batches = [
+		(posting_date, batch_rows[i : i + batch_size])
+		for posting_date, batch_rows in get_repayment_batches(rows)
+		for i in range(0, len(batch_rows), batch_size)
+	]
+
+	created, errors = [], []
+	for count, (posting_date, batch) in enumerate(batches, 1):
+		try:
+			batch_created, batch_errors = make_repayment_batch(posting_date, batch)
+			frappe.db.commit()  # nosemgrep
+		except Exception as e:
+			frappe.db.rollback()
+			frappe.log_error(title=_("Bulk Loan Repayment failed"))
+			batch_created = []
+			batch_errors = [{"idx": row.idx, "errors": [str(e)]} for row in batch]
+
+		created.extend(batch_created)
+		errors.extend(batch_errors)
+
+		frappe.publish_realtime(
+			"bulk_loan_repayment_progress",
+			{
+				"progress": count,
+				"total": len(batches),
+				"repayments": batch_created,
+				"errors": sorted(batch_errors, key=lambda d: d["idx"]),
+			},
+			user=user,
+		)
+
+	frappe.publish_realtime(
+		"msgprint",
+		_("{0} repayments posted, {1} rows failed").format(len(created), len(errors)),
+		user=user,
+	)
+
+	return {"repayments": created, "errors": sorted(errors, key=lambda d: d["idx"])}
+
+
+def parse_bulk_repayments(repayments):
+	if isinstance(repayments, str):
+		if repayments.lstrip().startswith("["):
+			repayments = json.loads(repayments)
+		else:
+			repayments = list(csv.DictReader(io.StringIO(repayments.strip())))
+
+	now = get_datetime()
+	return [
+		frappe._dict(
+			idx=idx,
+			against_loan=(d.get("against_loan") or "").strip(),
+			amount_paid=flt(d.get("amount_paid")),
+			posting_date=get_datetime(d.get("posting_date")) if d.get("posting_date") else now,
+			reference_number=d.get("reference_number"),
+			reference_date=d.get("reference_date") or None,
+		)
+		for idx, d in enumerate(repayments, 1)
+	]
+
+
+def get_repayment_batches(rows):
+	"""Group rows by posting date, in date order, with each loan at most once in a group
+
+	Repeated rows of a loan for the same posting date go to the following groups, so that
+	each of them is allocated against the state left by the previous one.
+	"""
+	batches = {}
+	for row in sorted(rows, key=lambda d: d.posting_date):
+		occurrence = 0
+		while row.against_loan in batches.setdefault((row.posting_date, occurrence), {}):
+			occurrence += 1
+
+		batches[(row.posting_date, occurrence)][row.against_loan] = row
+
+	return [(posting_date, list(rows.values())) for (posting_date, _), rows in batches.items()]
+
+
+def make_repayment_batch(posting_date, rows):
+	"""Allocate and post the repayments of one posting date for a set of distinct loans
+
+	Loan state is loaded once for the batch and allocation happens on in-memory documents.
+	Repayments are written with multi-row inserts, accrual and loan paid amounts are applied with
+	one CASE update each, loans are classified in one run and the GL entries are posted together.
+	"""
+	errors = []
+	loan_details = get_loan_details_for_repayments([d.against_loan for d in rows])
+	future_repayment_dates = get_last_repayment_dates(list(loan_details))
+
+	valid_rows = []
+	for row in rows:
+		row_errors = validate_bulk_repayment(row, loan_details, future_repayment_dates)
+		if row_errors:
+			errors.append({"idx": row.idx, "errors": row_errors})
+		else:
+			valid_rows.append(row)
+
+	if not valid_rows:
+		return [], errors
+
+	loans = [d.against_loan for d in valid_rows]
+	loan_wise_amounts = calculate_amounts_bulk(loans, posting_date)
+	shortfall_amounts = dict(
+		frappe.get_all(
+			"Loan Security Shortfall",
+			filters={"loan": ("in", loans), "status": "Pending"},
+			fields=["loan", "shortfall_amount"],
+			as_list=1,
+		)
+	)
+
+	docs, row_indexes = [], []
+	for row in valid_rows:
+		doc = make_bulk_repayment_doc(
+			row,
+			loan_details[row.against_loan],
+			loan_wise_amounts[row.against_loan],
+			flt(shortfall_amounts.get(row.against_loan)),
+		)
+
+		if not doc.is_term_loan:
+			# Only demand loans paying more than the accrued interest book an accrual here
+			frappe.db.savepoint("bulk_loan_repayment")
+			try:
+				doc.book_unaccrued_interest()
+			except frappe.ValidationError as e:
+				frappe.db.rollback(save_point="bulk_loan_repayment")
+				errors.append({"idx": row.idx, "errors": [str(e)]})
+				continue
+
+		docs.append(doc)
+		row_indexes.append(row.idx)
+
+	if not docs:
+		return [], errors
+
+	for doc, name in zip(
+		docs, get_series_names(frappe.get_meta("Loan Repayment").autoname, len(docs))
+	):
+		doc.name = name
+		for d in doc.get_all_children():
+			d.parent = name
+
+	bulk_insert_docs(docs)
+	update_paid_amounts_for_repayments(docs, loan_details)
+	update_penalty_accruals_for_repayments(docs)
+
+	create_process_loan_classification(
+		posting_date=posting_date, loans=[doc.against_loan for doc in docs]
+	)
+	make_gl_entries_for_repayments(docs)
+
+	return [{"idx": idx, "name": doc.name} for idx, doc in zip(row_indexes, docs)], errors
+
+
+def get_loan_details_for_repayments(loans):
+	return {
+		d.name: d
+		for d in frappe.get_all(
+			"Loan",
+			filters={"name": ("in", list(set(loans))), "docstatus": 1},
+			fields=[
+				"name",
+				"company",
+				"applicant_type",
+				"applicant",
+				"loan_product",
+				"is_term_loan",
+				"rate_of_interest",
+				"payment_account",
+				"loan_account",
+				"penalty_income_account",
+				"is_npa",
+				"manual_npa",
+				"days_past_due",
+				"status",
+				"is_secured_loan",
+				"loan_amount",
+				"disbursed_amount",
+				"total_payment",
+				"total_amount_paid",
+				"total_principal_paid",
+				"total_interest_payable",
+				"debit_adjustment_amount",
+				"credit_adjustment_amount",
+				"refund_amount",
+				"written_off_amount",
+			],
+		)
+	}
+
+
+def get_last_repayment_dates(loans):
+	if not loans:
+		return {}
+
+	loan_repayment = frappe.qb.DocType("Loan Repayment")
+
+	return dict(
+		frappe.qb.from_(loan_repayment)
+		.select(loan_repayment.against_loan, Max(loan_repayment.posting_date))
+		.where((loan_repayment.against_loan.isin(loans)) & (loan_repayment.docstatus == 1))
+		.groupby(loan_repayment.against_loan)
+		.run()
+	)
+
+
+def validate_bulk_repayment(row, loan_details, last_repayment_dates):
+	errors = []
+
+	if row.against_loan not in loan_details:
+		errors.append(_("Loan {0} does not exist or is not submitted").format(row.against_loan))
+	elif last_repayment_dates.get(row.against_loan) and get_datetime(
+		last_repayment_dates[row.against_loan]
+	) > get_datetime(row.posting_date):
+		errors.append(
+			_("Repayment already made till date {0}").format(
+				get_datetime(last_repayment_dates[row.against_loan])
+			)
+		)
+
+	if row.amount_paid <= 0:
+		errors.append(_("Amount paid cannot be zero"))
+
+	return errors
+
+
+def make_bulk_repayment_doc(row, loan, amounts, shortfall_amount):
+	doc = frappe.new_doc("Loan Repayment")
+	doc.update(
+		{
+			"against_loan": loan.name,
+			"posting_date": row.posting_date,
+			"amount_paid": row.amount_paid,
+			"reference_number": row.reference_number,
+			"reference_date": row.reference_date,
+			"repayment_type": "Normal Repayment",
+			"company": loan.company,
+			"applicant_type": loan.applicant_type,
+			"applicant": loan.applicant,
+			"loan_product": loan.loan_product,
+			"is_term_loan": loan.is_term_loan,
+			"rate_of_interest": loan.rate_of_interest,
+			"payment_account": loan.payment_account,
+			"loan_account": loan.loan_account,
+			"penalty_income_account": loan.penalty_income_account,
+			"is_npa": loan.is_npa,
+			"manual_npa": loan.manual_npa,
+			"days_past_due": loan.days_past_due,
+			"docstatus": 1,
+		}
+	)
+	doc.set("pending_charges", amounts["charges"])
+	doc.set_missing_values(amounts, shortfall_amount=shortfall_amount)
+	doc.allocate_amounts(amounts)
+	doc.flags.unbooked_penalty_amount = amounts["unbooked_penalty_amount"]
+
+	return doc
+
+
+def update_paid_amounts_for_repayments(docs, loan_details):
+	"""Apply `LoanRepayment.update_paid_amount` for a batch with one CASE update per table"""
+	paid_amounts = {}
+	for doc in docs:
+		for d in doc.repayment_details:
+			paid_principal, paid_interest = paid_amounts.get(d.loan_interest_accrual, (0, 0))
+			paid_amounts[d.loan_interest_accrual] = (
+				paid_principal + flt(d.paid_principal_amount),
+				paid_interest + flt(d.paid_interest_amount),
+			)
+
+	loan_interest_accrual = frappe.qb.DocType("Loan Interest Accrual")
+	accruals = list(paid_amounts)
+	for i in range(0, len(accruals), 1000):
+		chunk = accruals[i : i + 1000]
+		paid_principal_amount = Case()
+		paid_interest_amount = Case()
+		for name in chunk:
+			paid_principal_amount = paid_principal_amount.when(
+				loan_interest_accrual.name == name, paid_amounts[name][0]
+			)
+			paid_interest_amount = paid_interest_amount.when(
+				loan_interest_accrual.name == name, paid_amounts[name][1]
+			)
+
+		(
+			frappe.qb.update(loan_interest_accrual)
+			.set(
+				loan_interest_accrual.paid_principal_amount,
+				loan_interest_accrual.paid_principal_amount + paid_principal_amount.else_(0),
+			)
+			.set(
+				loan_interest_accrual.paid_interest_amount,
+				loan_interest_accrual.paid_interest_amount + paid_interest_amount.else_(0),
+			)
+			.where(loan_interest_accrual.name.isin(chunk))
+		).run()
+
+	loan_updates = {}
+	for doc in docs:
+		loan = loan_details[doc.against_loan]
+		loan.update(
+			{
+				"total_amount_paid": flt(loan.total_amount_paid) + flt(doc.amount_paid),
+				"total_principal_paid": flt(loan.total_principal_paid) + flt(doc.principal_amount_paid),
+			}
+		)
+
+		if not loan.is_secured_loan and get_pending_principal_amount(loan) <= 0:
+			loan.status = "Loan Closure Requested"
+
+		loan_updates[loan.name] = {
+			"total_amount_paid": loan.total_amount_paid,
+			"total_principal_paid": loan.total_principal_paid,
+			"status": loan.status,
+		}
+
+		if doc.shortfall_amount:
+			update_shortfall_status(doc.against_loan, doc.principal_amount_paid)
+
+	frappe.db.bulk_update("Loan", loan_updates, update_modified=False)
+
+
+def update_penalty_accruals_for_repayments(docs):
+	"""Apply `LoanRepayment.update_penalty_accruals` for a batch of repayments"""
+	submit_penalty_accruals_in_bulk(list(filter(None, (doc.get_penalty_accrual() for doc in docs))))
+	update_paid_penalty_amounts({doc.against_loan: doc.total_penalty_paid for doc in docs})
+
+
+def make_gl_entries_for_repayments(docs):
+	"""Post the GL entries of a batch of repayments, with one call per company"""
+	gl_entries = {}
+	for doc in docs:
+		gl_entries.setdefault(doc.company, []).extend(doc.get_gl_entries())
+
+	for gle_map in gl_entries.values():
+		if gle_map:
+			make_gl_entries(gle_map, merge_entries=False)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Repayment", ["against_loan", "posting_date"])
+	frappe.db.add_index("Loan Repayment", ["payment_account", "posting_date"])
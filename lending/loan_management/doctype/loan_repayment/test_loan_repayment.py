@@ -1,9 +1,227 @@
 # Copyright (c) 2019, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
-import unittest
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, nowdate
 
+from erpnext.selling.doctype.customer.test_customer import get_customer_dict
 
-class TestLoanRepayment(unittest.TestCase):
-	pass
+from lending.loan_management.doctype.loan.test_loan import (
+	create_demand_loan,
+	create_loan_accounts,
+	create_loan_application,
+	create_loan_product,
+	create_loan_security,
+	create_loan_security_price,
+	create_loan_security_type,
+	create_repayment_entry,
+	make_loan_disbursement_entry,
+	set_loan_settings_in_company,
+)
+from lending.loan_management.doctype.loan_application.loan_application import create_pledge
+from lending.loan_management.utils import (
+	get_ld_matching_query,
+	get_loan_entries_for_bank_clearance,
+	get_loan_vouchers_for_matching,
+	get_lr_matching_query,
+	get_payment_entries_for_bank_clearance,
+	match_loan_vouchers,
+)
+
+
+class TestLoanRepayment(FrappeTestCase):
+	def setUp(self):
+		set_loan_settings_in_company()
+		create_loan_accounts()
+
+		create_loan_product(
+			"Demand Loan",
+			"Demand Loan",
+			2000000,
+			13.5,
+			25,
+			0,
+			5,
+			"Cash",
+			"Disbursement Account - _TC",
+			"Payment Account - _TC",
+			"Loan Account - _TC",
+			"Interest Income Account - _TC",
+			"Penalty Income Account - _TC",
+		)
+
+		create_loan_security_type()
+		create_loan_security()
+
+		create_loan_security_price(
+			"Test Security 1", 500, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+
+		if not frappe.db.exists("Customer", "_Test Loan Customer"):
+			frappe.get_doc(get_customer_dict("_Test Loan Customer")).insert(ignore_permissions=True)
+
+		self.applicant = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+	def test_batch_matching_ranks_like_matching_queries(self):
+		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
+		loan_application = create_loan_application(
+			"_Test Company", self.applicant, "Demand Loan", pledge
+		)
+		create_pledge(loan_application)
+
+		loan = create_demand_loan(
+			self.applicant, "Demand Loan", loan_application, posting_date="2019-10-01"
+		)
+		loan.submit()
+
+		disbursement = make_loan_disbursement_entry(
+			loan.name, loan.loan_amount, disbursement_date="2019-10-01"
+		)
+		disbursement_reference = "LD-" + frappe.generate_hash(length=8)
+		disbursement.db_set("reference_number", disbursement_reference)
+
+		repayment_reference = "LR-" + frappe.generate_hash(length=8)
+		repayment = create_repayment_entry(loan.name, self.applicant, "2019-11-10", 1000)
+		repayment.reference_number = repayment_reference
+		repayment.submit()
+
+		other_repayment = create_repayment_entry(loan.name, self.applicant, "2019-11-11", 1000)
+		other_repayment.submit()
+
+		# vouchers are matched whatever their posting date, like in the matching queries
+		repayment_index = get_loan_vouchers_for_matching(loan.payment_account, ["loan_repayment"])
+		disbursement_index = get_loan_vouchers_for_matching(
+			loan.disbursement_account, ["loan_disbursement"]
+		)
+
+		deposit = frappe._dict(
+			name="deposit",
+			deposit=1000,
+			withdrawal=0,
+			unallocated_amount=1000,
+			reference_number=repayment_reference,
+			party_type="Customer",
+			party=self.applicant,
+		)
+		withdrawal = frappe._dict(
+			name="withdrawal",
+			deposit=0,
+			withdrawal=loan.loan_amount,
+			unallocated_amount=loan.loan_amount,
+			reference_number=disbursement_reference,
+			party_type=None,
+			party=None,
+		)
+
+		for exact_match in (0, 1):
+			ranks = get_ranks(match_loan_vouchers(deposit, repayment_index, exact_match))
+			self.assertEqual(ranks[repayment.name], 3)
+			self.assertEqual(ranks[other_repayment.name], 2)
+			self.assert_rank_parity(
+				ranks, get_lr_matching_query(loan.payment_account, exact_match, deposit)
+			)
+
+			ranks = get_ranks(match_loan_vouchers(withdrawal, disbursement_index, exact_match))
+			self.assertEqual(ranks[disbursement.name], 2)
+			self.assert_rank_parity(
+				ranks, get_ld_matching_query(loan.disbursement_account, exact_match, withdrawal)
+			)
+
+	def test_bank_clearance_pages(self):
+		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
+		loan_application = create_loan_application(
+			"_Test Company", self.applicant, "Demand Loan", pledge
+		)
+		create_pledge(loan_application)
+
+		loan = create_demand_loan(
+			self.applicant, "Demand Loan", loan_application, posting_date="2021-03-01"
+		)
+		loan.submit()
+
+		# disbursements and repayments sharing posting dates, repayments at midnight tie with
+		# the disbursements of the same day
+		make_loan_disbursement_entry(loan.name, 10000, disbursement_date="2021-03-01")
+		make_loan_disbursement_entry(loan.name, 10000, disbursement_date="2021-03-01")
+		make_loan_disbursement_entry(loan.name, 10000, disbursement_date="2021-03-02")
+
+		for posting_date in ("2021-03-01", "2021-03-01", "2021-03-02 10:00:00", "2021-03-02 10:00:00"):
+			create_repayment_entry(loan.name, self.applicant, posting_date, 1000).submit()
+
+		args = {
+			"account": loan.payment_account,
+			"bank_account": loan.disbursement_account,
+			"from_date": "2021-03-01",
+			"to_date": "2021-03-02",
+		}
+
+		entries = get_payment_entries_for_bank_clearance(
+			args["from_date"], args["to_date"], args["account"], args["bank_account"], 0, 0
+		)
+
+		# without paging, disbursements and then repayments, each by posting date and name desc
+		self.assertEqual(
+			[(d.payment_document, d.payment_entry) for d in entries],
+			get_clearance_entries("Loan Disbursement", "disbursement_date", args)
+			+ get_clearance_entries("Loan Repayment", "posting_date", args),
+		)
+
+		pages = []
+		after = None
+		while True:
+			page = get_loan_entries_for_bank_clearance(
+				**args, page_length=2, after=frappe.as_json(after) if after else None
+			)
+			pages.append(page["entries"])
+			after = page["after"]
+			if not after:
+				break
+
+		paged_entries = [(d.payment_document, d.payment_entry) for page in pages for d in page]
+
+		self.assertTrue(all(len(page) == 2 for page in pages[:-1]))
+		self.assertEqual(len(paged_entries), len(set(paged_entries)))
+		self.assertEqual(
+			paged_entries,
+			[
+				(d.payment_document, d.payment_entry)
+				for d in sorted(
+					entries,
+					key=lambda d: (get_datetime(d.posting_date), d.payment_document, d.payment_entry),
+				)
+			],
+		)
+
+	def assert_rank_parity(self, ranks, query):
+		query_ranks = get_ranks(query.run(as_dict=1))
+
+		for name, rank in ranks.items():
+			self.assertEqual(rank, query_ranks.get(name))
+
+
+def get_clearance_entries(doctype, posting_date_field, args):
+	filters = {
+		"docstatus": 1,
+		posting_date_field: ("between", [args["from_date"], args["to_date"]]),
+		"clearance_date": ("is", "not set"),
+	}
+
+	if doctype == "Loan Disbursement":
+		filters["disbursement_account"] = ("in", [args["bank_account"], args["account"]])
+	else:
+		filters["payment_account"] = ("in", [args["bank_account"], args["account"]])
+
+		if frappe.db.has_column("Loan Repayment", "repay_from_salary"):
+			filters["repay_from_salary"] = 0
+
+	return [
+		(doctype, name)
+		for name in frappe.get_all(
+			doctype, filters=filters, order_by=f"{posting_date_field} asc, name desc", pluck="name"
+		)
+	]
+
+
+def get_ranks(matches):
+	return {d.name: d.rank for d in matches}
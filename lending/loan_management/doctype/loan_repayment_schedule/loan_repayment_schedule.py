@@ -1,11 +1,13 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
+import calendar
+import datetime
 import math
 
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import add_days, add_months, date_diff, flt, get_last_day, getdate
+from frappe.utils import add_months, flt, get_last_day, getdate
 
 
 class LoanRepaymentSchedule(Document):
@@ -36,54 +38,19 @@ class LoanRepaymentSchedule(Document):
 		)
 
 		self.repayment_schedule = []
-		payment_date = self.repayment_start_date
-		balance_amount = self.loan_amount
-		broken_period_interest_days = date_diff(add_months(payment_date, -1), self.posting_date)
-		carry_forward_interest = self.adjusted_interest
-
-		while balance_amount > 0:
-			interest_amount, principal_amount, balance_amount, total_payment, days = self.get_amounts(
-				payment_date,
-				balance_amount,
-				schedule_type_details.repayment_schedule_type,
-				schedule_type_details.repayment_date_on,
-				broken_period_interest_days,
-				carry_forward_interest,
-			)
-
-			if schedule_type_details.repayment_schedule_type == "Pro-rated calendar months":
-				next_payment_date = get_last_day(payment_date)
-				if schedule_type_details.repayment_date_on == "Start of the next month":
-					next_payment_date = add_days(next_payment_date, 1)
-
-				payment_date = next_payment_date
-
-			self.add_repayment_schedule_row(
-				payment_date, principal_amount, interest_amount, total_payment, balance_amount, days
-			)
-
-			if (
-				self.repayment_method == "Repay Over Number of Periods"
-				and len(self.get("repayment_schedule")) >= self.repayment_periods
-			):
-				self.get("repayment_schedule")[-1].principal_amount += balance_amount
-				self.get("repayment_schedule")[-1].balance_loan_amount = 0
-				self.get("repayment_schedule")[-1].total_payment = (
-					self.get("repayment_schedule")[-1].interest_amount
-					+ self.get("repayment_schedule")[-1].principal_amount
-				)
-				balance_amount = 0
-
-			if (
-				schedule_type_details.repayment_schedule_type
-				in ["Monthly as per repayment start date", "Monthly as per cycle date"]
-				or schedule_type_details.repayment_date_on == "End of the current month"
-			):
-				next_payment_date = add_single_month(payment_date)
-				payment_date = next_payment_date
-
-			bmi_days = 0
-			carry_forward_interest = 0
+		for row in get_repayment_schedule(
+			loan_amount=self.loan_amount,
+			rate_of_interest=self.rate_of_interest,
+			monthly_repayment_amount=self.monthly_repayment_amount,
+			posting_date=self.posting_date,
+			repayment_start_date=self.repayment_start_date,
+			repayment_method=self.repayment_method,
+			repayment_periods=self.repayment_periods,
+			repayment_schedule_type=schedule_type_details.repayment_schedule_type,
+			repayment_date_on=schedule_type_details.repayment_date_on,
+			carry_forward_interest=self.adjusted_interest,
+		):
+			self.append("repayment_schedule", row)
 
 	def validate_repayment_method(self):
 		if self.repayment_method == "Repay Over Number of Periods" and not self.repayment_periods:
@@ -95,76 +62,122 @@ class LoanRepaymentSchedule(Document):
 			if self.monthly_repayment_amount > self.loan_amount:
 				frappe.throw(_("Monthly Repayment Amount cannot be greater than Loan Amount"))
 
-	def get_amounts(
-		self,
-		payment_date,
-		balance_amount,
-		schedule_type,
-		repayment_date_on,
-		additional_days,
-		carry_forward_interest=0,
-	):
-		if schedule_type == "Monthly as per repayment start date":
+
+def add_single_month(date):
+	if getdate(date) == get_last_day(date):
+		return get_last_day(add_months(date, 1))
+	else:
+		return add_months(date, 1)
+
+
+def get_repayment_schedule(
+	loan_amount,
+	rate_of_interest,
+	monthly_repayment_amount,
+	posting_date,
+	repayment_start_date,
+	repayment_method,
+	repayment_periods,
+	repayment_schedule_type,
+	repayment_date_on,
+	carry_forward_interest=0,
+):
+	"""Compute the full amortization table without creating any documents
+
+	Returns a list of rows with the fields of Repayment Schedule. Dates are handled as plain
+	`datetime.date` objects, so this can be used for large or what-if schedules and the
+	rows are only turned into child documents when a schedule is saved.
+	"""
+	posting_date = getdate(posting_date)
+	repayment_start_date = getdate(repayment_start_date)
+	rate_of_interest = flt(rate_of_interest)
+	one_day = datetime.timedelta(days=1)
+
+	payment_date = repayment_start_date
+	balance_amount = loan_amount
+	broken_period_interest_days = (_add_months(payment_date, -1) - posting_date).days
+	schedule = []
+
+	while balance_amount > 0:
+		if repayment_schedule_type == "Monthly as per repayment start date":
 			days = 1
 			months = 12
 		else:
-			expected_payment_date = get_last_day(payment_date)
+			months = 365
+			expected_payment_date = _get_last_day(payment_date)
 			if repayment_date_on == "Start of the next month":
-				expected_payment_date = add_days(expected_payment_date, 1)
-
-			if schedule_type == "Monthly as per cycle date":
-				days = date_diff(payment_date, add_months(payment_date, -1))
-				if additional_days < 0:
-					days = date_diff(self.repayment_start_date, self.posting_date)
-					additional_days = 0
-
-				months = 365
-				if additional_days:
-					days += additional_days
-					additional_days = 0
+				expected_payment_date += one_day
+
+			if repayment_schedule_type == "Monthly as per cycle date":
+				days = (payment_date - _add_months(payment_date, -1)).days
+				if broken_period_interest_days < 0:
+					days = (repayment_start_date - posting_date).days
+				elif broken_period_interest_days:
+					days += broken_period_interest_days
 			elif expected_payment_date == payment_date:
 				# using 30 days for calculating interest for all full months
 				days = 30
-				months = 365
 			else:
-				days = date_diff(get_last_day(payment_date), payment_date)
-				months = 365
+				days = (_get_last_day(payment_date) - payment_date).days
 
-		interest_amount = flt(balance_amount * flt(self.rate_of_interest) * days / (months * 100))
-		principal_amount = self.monthly_repayment_amount - flt(interest_amount)
-		balance_amount = flt(balance_amount + interest_amount - self.monthly_repayment_amount)
+		interest_amount = flt(balance_amount * rate_of_interest * days / (months * 100))
+		principal_amount = monthly_repayment_amount - flt(interest_amount)
+		balance_amount = flt(balance_amount + interest_amount - monthly_repayment_amount)
 		if balance_amount < 0:
 			principal_amount += balance_amount
 			balance_amount = 0.0
 
 		if carry_forward_interest:
 			interest_amount += carry_forward_interest
+			carry_forward_interest = 0
 
-		total_payment = principal_amount + interest_amount
+		if repayment_schedule_type == "Pro-rated calendar months":
+			payment_date = _get_last_day(payment_date)
+			if repayment_date_on == "Start of the next month":
+				payment_date += one_day
 
-		return interest_amount, principal_amount, balance_amount, total_payment, days
+		if repayment_method == "Repay Over Number of Periods" and len(schedule) + 1 >= repayment_periods:
+			principal_amount += balance_amount
+			balance_amount = 0
 
-	def add_repayment_schedule_row(
-		self, payment_date, principal_amount, interest_amount, total_payment, balance_loan_amount, days
-	):
-		self.append(
-			"repayment_schedule",
+		schedule.append(
 			{
 				"number_of_days": days,
 				"payment_date": payment_date,
 				"principal_amount": principal_amount,
 				"interest_amount": interest_amount,
-				"total_payment": total_payment,
-				"balance_loan_amount": balance_loan_amount,
-			},
+				"total_payment": principal_amount + interest_amount,
+				"balance_loan_amount": balance_amount,
+			}
 		)
 
+		if (
+			repayment_schedule_type in ["Monthly as per repayment start date", "Monthly as per cycle date"]
+			or repayment_date_on == "End of the current month"
+		):
+			payment_date = _add_single_month(payment_date)
 
-def add_single_month(date):
-	if getdate(date) == get_last_day(date):
-		return get_last_day(add_months(date, 1))
+	return schedule
+
+
+def _get_last_day(date):
+	return date.replace(day=calendar.monthrange(date.year, date.month)[1])
+
+
+def _add_months(date, months):
+	month = date.month - 1 + months
+	year = date.year + month // 12
+	month = month % 12 + 1
+	return date.replace(
+		year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1])
+	)
+
+
+def _add_single_month(date):
+	if date == _get_last_day(date):
+		return _get_last_day(_add_months(date, 1))
 	else:
-		return add_months(date, 1)
+		return _add_months(date, 1)
 
 
 def get_monthly_repayment_amount(loan_amount, rate_of_interest, repayment_periods):
@@ -177,3 +190,7 @@ def get_monthly_repayment_amount(loan_amount, rate_of_interest, repayment_period
 	else:
 		monthly_repayment_amount = math.ceil(flt(loan_amount) / repayment_periods)
 	return monthly_repayment_amount
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Repayment Schedule", ["loan", "status", "docstatus"])
@@ -1,9 +1,217 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt, getdate
+
+from lending.loan_management.doctype.loan_repayment_schedule.loan_repayment_schedule import (
+	get_monthly_repayment_amount,
+	get_repayment_schedule,
+)
+
+# schedule type, repayment date on, repayment method, posting date, repayment start date,
+# rows as (payment date, days, principal, interest, balance) and total (principal, interest)
+# for a loan of 100000 at 12% over 4 periods, or repaid by 30000 per period
+SCHEDULE_CASES = [
+	# start date, number of periods
+	(
+		"Monthly as per repayment start date",
+		None,
+		"Repay Over Number of Periods",
+		"2024-01-15",
+		"2024-02-15",
+		[
+			("2024-02-15", 1, 24629.0, 1000.0, 75371.0),
+			("2024-03-15", 1, 24875.29, 753.71, 50495.71),
+			("2024-04-15", 1, 25124.04, 504.96, 25371.67),
+			("2024-05-15", 1, 25371.67, 253.72, 0.0),
+		],
+		(100000.0, 2512.38),
+	),
+	# start date, fixed amount
+	(
+		"Monthly as per repayment start date",
+		None,
+		"Repay Fixed Amount per Period",
+		"2024-01-15",
+		"2024-02-15",
+		[
+			("2024-02-15", 1, 29000.0, 1000.0, 71000.0),
+			("2024-03-15", 1, 29290.0, 710.0, 41710.0),
+			("2024-04-15", 1, 29582.9, 417.1, 12127.1),
+			("2024-05-15", 1, 12127.1, 121.27, 0.0),
+		],
+		(100000.0, 2248.37),
+	),
+	# cycle date, positive broken period
+	(
+		"Monthly as per cycle date",
+		None,
+		"Repay Over Number of Periods",
+		"2024-01-10",
+		"2024-02-15",
+		[
+			("2024-02-15", 36, 24445.44, 1183.56, 75554.56),
+			("2024-03-15", 34, 24784.44, 844.56, 50770.12),
+			("2024-04-15", 36, 25028.1, 600.9, 25742.01),
+			("2024-05-15", 35, 25742.01, 296.21, 0.0),
+		],
+		(100000.0, 2925.22),
+	),
+	# cycle date, negative broken period
+	(
+		"Monthly as per cycle date",
+		None,
+		"Repay Over Number of Periods",
+		"2024-01-20",
+		"2024-02-05",
+		[
+			("2024-02-05", 16, 25102.97, 526.03, 74897.03),
+			("2024-03-05", 16, 25235.02, 393.98, 49662.01),
+			("2024-04-05", 16, 25367.76, 261.24, 24294.24),
+			("2024-05-05", 16, 24294.24, 127.79, 0.0),
+		],
+		(100000.0, 1309.04),
+	),
+	# cycle date on a month end, fixed amount
+	(
+		"Monthly as per cycle date",
+		None,
+		"Repay Fixed Amount per Period",
+		"2024-01-05",
+		"2024-01-31",
+		[
+			("2024-01-31", 26, 29145.21, 854.79, 70854.79),
+			("2024-02-29", 26, 29394.34, 605.66, 41460.46),
+			("2024-03-31", 26, 29645.6, 354.4, 11814.86),
+			("2024-04-30", 26, 11814.86, 100.99, 0.0),
+		],
+		(100000.0, 1915.85),
+	),
+	# pro-rated on a month end, end of the current month
+	(
+		"Pro-rated calendar months",
+		"End of the current month",
+		"Repay Over Number of Periods",
+		"2024-01-05",
+		"2024-01-31",
+		[
+			("2024-01-31", 30, 24642.7, 986.3, 75357.3),
+			("2024-02-29", 30, 24885.75, 743.25, 50471.55),
+			("2024-03-31", 30, 25131.2, 497.8, 25340.35),
+			("2024-04-30", 30, 25340.35, 249.93, 0.0),
+		],
+		(100000.0, 2477.29),
+	),
+	# pro-rated mid month, end of the current month, fixed amount
+	(
+		"Pro-rated calendar months",
+		"End of the current month",
+		"Repay Fixed Amount per Period",
+		"2024-01-05",
+		"2024-01-20",
+		[
+			("2024-01-31", 11, 29638.36, 361.64, 70361.64),
+			("2024-02-29", 30, 29306.02, 693.98, 41055.62),
+			("2024-03-31", 30, 29595.07, 404.93, 11460.55),
+			("2024-04-30", 30, 11460.55, 113.04, 0.0),
+		],
+		(100000.0, 1573.59),
+	),
+	# pro-rated mid month, start of the next month
+	(
+		"Pro-rated calendar months",
+		"Start of the next month",
+		"Repay Over Number of Periods",
+		"2024-01-05",
+		"2024-01-20",
+		[
+			("2024-02-01", 11, 25267.36, 361.64, 74732.64),
+			("2024-03-01", 28, 24941.05, 687.95, 49791.59),
+			("2024-04-01", 30, 25137.9, 491.1, 24653.69),
+			("2024-05-01", 29, 24653.69, 235.05, 0.0),
+		],
+		(100000.0, 1775.74),
+	),
+]
 
 
 class TestLoanRepaymentSchedule(FrappeTestCase):
-	pass
+	def test_repayment_schedules(self):
+		for (
+			schedule_type,
+			repayment_date_on,
+			repayment_method,
+			posting_date,
+			repayment_start_date,
+			expected_rows,
+			expected_totals,
+		) in SCHEDULE_CASES:
+			with self.subTest(
+				schedule_type=schedule_type,
+				repayment_date_on=repayment_date_on,
+				repayment_method=repayment_method,
+				repayment_start_date=repayment_start_date,
+			):
+				schedule = make_schedule(
+					schedule_type, repayment_date_on, repayment_method, posting_date, repayment_start_date
+				)
+
+				self.assertEqual(
+					[
+						(
+							str(d["payment_date"]),
+							d["number_of_days"],
+							flt(d["principal_amount"], 2),
+							flt(d["interest_amount"], 2),
+							flt(d["balance_loan_amount"], 2),
+						)
+						for d in schedule
+					],
+					expected_rows,
+				)
+				self.assertEqual(
+					(
+						flt(sum(d["principal_amount"] for d in schedule), 2),
+						flt(sum(d["interest_amount"] for d in schedule), 2),
+					),
+					expected_totals,
+				)
+
+				for d in schedule:
+					self.assertEqual(
+						flt(d["total_payment"], 2), flt(d["principal_amount"] + d["interest_amount"], 2)
+					)
+
+				# dates passed as strings or dates give the same schedule
+				self.assertEqual(
+					make_schedule(
+						schedule_type,
+						repayment_date_on,
+						repayment_method,
+						getdate(posting_date),
+						getdate(repayment_start_date),
+					),
+					schedule,
+				)
+
+
+def make_schedule(
+	schedule_type, repayment_date_on, repayment_method, posting_date, repayment_start_date
+):
+	if repayment_method == "Repay Over Number of Periods":
+		monthly_repayment_amount = get_monthly_repayment_amount(100000, 12, 4)
+	else:
+		monthly_repayment_amount = 30000
+
+	return get_repayment_schedule(
+		loan_amount=100000,
+		rate_of_interest=12,
+		monthly_repayment_amount=monthly_repayment_amount,
+		posting_date=posting_date,
+		repayment_start_date=repayment_start_date,
+		repayment_method=repayment_method,
+		repayment_periods=4,
+		repayment_schedule_type=schedule_type,
+		repayment_date_on=repayment_date_on,
+	)
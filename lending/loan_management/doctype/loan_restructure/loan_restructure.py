@@ -3,6 +3,7 @@
 
 import frappe
 from frappe import _
+from frappe.query_builder.functions import IfNull
 from frappe.utils import add_days, cint, flt, getdate
 
 from erpnext.controllers.accounts_controller import AccountsController
@@ -18,6 +19,7 @@ from lending.loan_management.doctype.loan_repayment.loan_repayment import calcul
 from lending.loan_management.doctype.loan_repayment_schedule.loan_repayment_schedule import (
 	get_monthly_repayment_amount,
 )
+from lending.loan_management.utils import bulk_insert_docs
 
 
 class LoanRestructure(AccountsController):
@@ -256,71 +258,31 @@ class LoanRestructure(AccountsController):
 
 	def update_branch_limit(self, cancel=0):
 		if self.branch:
-			# Get Latest Limit Log
-			available_limit = frappe.db.get_all(
-				"Loan Restructure Limit Log",
-				{
-					"branch": self.branch,
-					"company": self.company,
-				},
-				[
-					"name",
-					"available_limit",
-					"in_process_limit",
-					"delinquent_in_process_limit",
-					"delinquent_available_limit",
-					"utilized_limit",
-					"delinquent_utilized_limit",
-				],
-				order_by="date desc",
-				limit=1,
-			)[0]
-
-			loan_amount = self.pending_principal_amount
-			if cancel:
-				loan_amount = -1 * loan_amount
+			# on cancel, target and source are swapped, which releases the amount
+			loan_amount = flt(self.pending_principal_amount)
 
-			# Update Limit Log
 			if self.status in ("Initiated", "Rejected"):
 				if cancel:
-					target_limit_field = "available_limit"
-					target_delinquent_limit_field = "delinquent_available_limit"
-					source_limit_field = "in_process_limit"
-					source_delinquent_limit_field = "delinquent_in_process_limit"
+					target_limit_field, source_limit_field = "available_limit", "in_process_limit"
 				else:
-					target_limit_field = "in_process_limit"
-					target_delinquent_limit_field = "delinquent_in_process_limit"
-					source_limit_field = "available_limit"
-					source_delinquent_limit_field = "delinquent_available_limit"
+					target_limit_field, source_limit_field = "in_process_limit", "available_limit"
 			elif self.status == "Approved":
 				if cancel:
-					target_limit_field = "available_limit"
-					target_delinquent_limit_field = "delinquent_available_limit"
-					source_limit_field = "utilized_limit"
-					source_delinquent_limit_field = "delinquent_utilized_limit"
+					target_limit_field, source_limit_field = "available_limit", "utilized_limit"
 				else:
-					target_limit_field = "utilized_limit"
-					target_delinquent_limit_field = "delinquent_utilized_limit"
-					source_limit_field = "in_process_limit"
-					source_delinquent_limit_field = "delinquent_in_process_limit"
+					target_limit_field, source_limit_field = "utilized_limit", "in_process_limit"
+
+			changes = {target_limit_field: loan_amount, source_limit_field: -1 * loan_amount}
 
 			if self.pre_restructure_dpd > 0:
-				updated_target_field = flt(available_limit.get(target_delinquent_limit_field)) + loan_amount
-				updated_source_field = flt(available_limit.get(source_delinquent_limit_field)) - loan_amount
-			else:
-				updated_target_field = flt(available_limit.get(target_delinquent_limit_field))
-				updated_source_field = flt(available_limit.get(source_delinquent_limit_field))
+				changes.update(
+					{
+						"delinquent_" + target_limit_field: loan_amount,
+						"delinquent_" + source_limit_field: -1 * loan_amount,
+					}
+				)
 
-			frappe.db.set_value(
-				"Loan Restructure Limit Log",
-				available_limit.name,
-				{
-					target_limit_field: flt(available_limit.get(target_limit_field)) + loan_amount,
-					source_limit_field: flt(available_limit.get(source_limit_field)) - loan_amount,
-					target_delinquent_limit_field: updated_target_field,
-					source_delinquent_limit_field: updated_source_field,
-				},
-			)
+			update_branch_limit_counters(self.company, self.branch, changes)
 
 	def update_restructure_count(self, cancel=0):
 		increment_count = 1
@@ -384,7 +346,9 @@ class LoanRestructure(AccountsController):
 		if self.status == "Approved":
 			self.update_totals_and_status()
 		self.cancel_loan_adjustments()
-		self.update_branch_limit(cancel=1)
+		# Limit of rejected restructures is already released on rejection
+		if self.status != "Rejected":
+			self.update_branch_limit(cancel=1)
 		self.update_restructure_count(cancel=1)
 		self.update_security_deposit_amount(cancel=1)
 
@@ -424,24 +388,18 @@ class LoanRestructure(AccountsController):
 	def validate_branch_limit(self):
 		if self.branch:
 			precision = cint(frappe.db.get_default("currency_precision")) or 2
-			# Get Latest Limit Log
-			limit_details = frappe.db.get_all(
-				"Loan Restructure Limit Log",
-				{
-					"branch": self.branch,
-					"company": self.company,
-				},
-				["available_limit", "delinquent_available_limit"],
-				order_by="date desc",
-				limit=1,
+			# Lock the branch limit counters while submitting, so that concurrent restructures
+			# are validated one after the other against up to date limits
+			limit_details = get_branch_limit_counters(
+				self.company, self.branch, for_update=self.docstatus == 1
 			)
 
 			available_limit = 0
 			delinquent_available_limit = 0
 
 			if limit_details:
-				available_limit = limit_details[0].get("available_limit")
-				delinquent_available_limit = limit_details[0].get("delinquent_available_limit")
+				available_limit = limit_details.get("available_limit")
+				delinquent_available_limit = limit_details.get("delinquent_available_limit")
 
 			if available_limit and flt(self.pending_principal_amount, precision) > flt(
 				available_limit, precision
@@ -737,3 +695,84 @@ def create_loan_repayment(
 	repayment.loan_restructure = restructure_name
 	repayment.save()
 	repayment.submit()
+
+
+def get_branch_limit_counters(company, branch, for_update=False):
+	"""Latest Loan Restructure Limit Log of the branch, which holds its live limit counters
+
+	Logs are created by the monthly Process Loan Restructure Limit. A branch without one gets its
+	first log, computed from current figures, when its counters are first used.
+	"""
+	limit_log = get_latest_limit_log(company, branch, for_update=for_update)
+	if limit_log:
+		return limit_log
+
+	make_first_limit_log(company, branch)
+	return get_latest_limit_log(company, branch, for_update=for_update)
+
+
+def update_branch_limit_counters(company, branch, changes):
+	"""Apply `changes` ({field: delta}) to the live limit counters of the branch in place"""
+	limit_log = get_latest_limit_log(company, branch, for_update=True)
+	if not limit_log:
+		# restructures submitted before the branch had a limit log: its first log is computed
+		# from the restructures as saved, including this one
+		make_first_limit_log(company, branch)
+		return
+
+	limit_log_table = frappe.qb.DocType("Loan Restructure Limit Log")
+	query = frappe.qb.update(limit_log_table).where(limit_log_table.name == limit_log.name)
+
+	for field, delta in changes.items():
+		query = query.set(limit_log_table[field], IfNull(limit_log_table[field], 0) + flt(delta))
+
+	query.run()
+
+
+def get_latest_limit_log(company, branch, for_update=False):
+	limit_log = frappe.db.get_all(
+		"Loan Restructure Limit Log",
+		{"branch": branch, "company": company},
+		[
+			"name",
+			"available_limit",
+			"in_process_limit",
+			"utilized_limit",
+			"delinquent_available_limit",
+			"delinquent_in_process_limit",
+			"delinquent_utilized_limit",
+		],
+		order_by="date desc",
+		limit=1,
+		for_update=for_update,
+	)
+
+	return limit_log[0] if limit_log else None
+
+
+def make_first_limit_log(company, branch):
+	"""Insert the first limit log of a branch, computed from current figures
+
+	The log is named after the company and branch and inserted ignoring duplicates, so that
+	concurrent first uses create it only once.
+	"""
+	from lending.loan_management.doctype.process_loan_restructure_limit.process_loan_restructure_limit import (
+		get_restructure_limits,
+	)
+
+	limits = get_restructure_limits(branch=branch, company=company).get((company, branch))
+	if not limits:
+		return
+
+	limit_log = frappe.get_doc(
+		{
+			"doctype": "Loan Restructure Limit Log",
+			"company": company,
+			"branch": branch,
+			"date": getdate(),
+			**limits,
+		}
+	)
+	limit_log.name = "{0}-{1}".format(branch, company)
+
+	bulk_insert_docs([limit_log], ignore_duplicates=True)
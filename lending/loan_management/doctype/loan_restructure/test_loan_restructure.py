@@ -1,9 +1,109 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from lending.loan_management.doctype.loan_restructure.loan_restructure import (
+	get_branch_limit_counters,
+	make_first_limit_log,
+)
+
+COUNTER_FIELDS = [
+	"available_limit",
+	"in_process_limit",
+	"utilized_limit",
+	"delinquent_available_limit",
+	"delinquent_in_process_limit",
+	"delinquent_utilized_limit",
+]
 
 
 class TestLoanRestructure(FrappeTestCase):
-	pass
+	def setUp(self):
+		# a new branch each time, so that it has no limit log yet
+		self.branch = (
+			frappe.get_doc(
+				{"doctype": "Branch", "branch": "_Test Branch " + frappe.generate_hash(length=6)}
+			)
+			.insert(ignore_permissions=True)
+			.name
+		)
+
+	def test_first_limit_log_is_created_once(self):
+		filters = {"company": "_Test Company", "branch": self.branch}
+		self.assertFalse(frappe.db.exists("Loan Restructure Limit Log", filters))
+
+		counters = get_branch_limit_counters("_Test Company", self.branch)
+		self.assertTrue(counters.name)
+
+		make_first_limit_log("_Test Company", self.branch)
+		self.assertEqual(
+			get_branch_limit_counters("_Test Company", self.branch, for_update=True).name, counters.name
+		)
+		self.assertEqual(frappe.db.count("Loan Restructure Limit Log", filters), 1)
+
+	def test_branch_limit_counters(self):
+		initial = get_counters(self.branch)
+
+		restructure = frappe.get_doc(
+			{
+				"doctype": "Loan Restructure",
+				"company": "_Test Company",
+				"branch": self.branch,
+				"pending_principal_amount": 1000,
+				"pre_restructure_dpd": 10,
+			}
+		)
+
+		def assert_counter_changes(**changes):
+			counters = get_counters(self.branch)
+			for field in COUNTER_FIELDS:
+				self.assertEqual(counters[field], flt(initial[field] + changes.get(field, 0), 2), field)
+
+		# initiate: available -> in process
+		restructure.status = "Initiated"
+		restructure.update_branch_limit()
+		assert_counter_changes(
+			available_limit=-1000,
+			in_process_limit=1000,
+			delinquent_available_limit=-1000,
+			delinquent_in_process_limit=1000,
+		)
+
+		# approve: in process -> utilized
+		restructure.status = "Approved"
+		restructure.update_branch_limit()
+		assert_counter_changes(
+			available_limit=-1000,
+			utilized_limit=1000,
+			delinquent_available_limit=-1000,
+			delinquent_utilized_limit=1000,
+		)
+
+		# cancel: utilized -> available
+		restructure.update_branch_limit(cancel=1)
+		assert_counter_changes()
+
+		# initiate and reject: in process -> available
+		restructure.status = "Initiated"
+		restructure.update_branch_limit()
+
+		restructure.status = "Rejected"
+		restructure.update_branch_limit(cancel=1)
+		assert_counter_changes()
+
+		# only delinquent restructures use the delinquent limit
+		restructure.pre_restructure_dpd = 0
+		restructure.status = "Initiated"
+		restructure.update_branch_limit()
+		assert_counter_changes(available_limit=-1000, in_process_limit=1000)
+
+		restructure.update_branch_limit(cancel=1)
+		assert_counter_changes()
+
+
+def get_counters(branch):
+	counters = get_branch_limit_counters("_Test Company", branch)
+	return {field: flt(counters.get(field), 2) for field in COUNTER_FIELDS}
@@ -7,6 +7,9 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils import cint, now_datetime
 
+from lending.loan_management.doctype.loan_security_position.loan_security_position import (
+	update_loan_security_position,
+)
 from lending.loan_management.doctype.loan_security_price.loan_security_price import (
 	get_loan_security_price,
 )
@@ -25,15 +28,29 @@ class LoanSecurityPledge(Document):
 		if self.loan:
 			self.db_set("status", "Pledged")
 			self.db_set("pledge_time", now_datetime())
+			self.update_loan_security_position()
 			update_shortfall_status(self.loan, self.total_security_value)
 			update_loan(self.loan, self.maximum_loan_value)
 
 	def on_cancel(self):
 		if self.loan:
+			if self.status == "Pledged":
+				self.update_loan_security_position(cancel=1)
+
 			self.db_set("status", "Cancelled")
 			self.db_set("pledge_time", None)
 			update_loan(self.loan, self.maximum_loan_value, cancel=1)
 
+	def update_loan_security_position(self, cancel=0):
+		update_loan_security_position(
+			self.loan,
+			self.applicant_type,
+			self.applicant,
+			self.company,
+			self.securities,
+			cancel=cancel,
+		)
+
 	def validate_duplicate_securities(self):
 		security_list = []
 		for security in self.securities:
@@ -109,3 +126,7 @@ def update_loan(loan, maximum_value_against_pledge, cancel=0):
 			WHERE name=%s""",
 			(maximum_loan_value + maximum_value_against_pledge, loan),
 		)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Security Pledge", ["loan", "status"])
@@ -0,0 +1,116 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, now_datetime
+
+
+class LoanSecurityPosition(Document):
+	pass
+
+
+def update_loan_security_position(
+	loan, applicant_type, applicant, company, securities, cancel=0, unpledge=0
+):
+	"""Add pledged or subtract unpledged quantities to the positions of a loan
+
+	Positions are locked while they are updated so that concurrent pledges and unpledges
+	against the same loan are applied one after the other.
+	"""
+	sign = -1 if cancel != unpledge else 1
+	position = frappe.qb.DocType("Loan Security Position")
+
+	for security in securities:
+		qty = sign * flt(security.qty)
+
+		existing_position = frappe.db.get_value(
+			"Loan Security Position",
+			{"loan": loan, "loan_security": security.loan_security},
+			"name",
+			for_update=True,
+		)
+
+		if existing_position:
+			frappe.qb.update(position).set(position.qty, position.qty + qty).set(
+				position.modified, now_datetime()
+			).where(position.name == existing_position).run()
+		else:
+			frappe.get_doc(
+				{
+					"doctype": "Loan Security Position",
+					"loan": loan,
+					"applicant_type": applicant_type,
+					"applicant": applicant,
+					"company": company,
+					"loan_security": security.loan_security,
+					"loan_security_type": security.loan_security_type,
+					"qty": qty,
+				}
+			).insert(ignore_permissions=True)
+
+	clear_loan_security_exposure_cache()
+
+
+def delete_loan_security_positions(loan):
+	frappe.db.delete("Loan Security Position", {"loan": loan})
+	clear_loan_security_exposure_cache()
+
+
+def get_loan_security_exposure(company=None):
+	"""Pledged quantity, value and applicant count per security, highest value first
+
+	The snapshot is cached per company. It is dropped whenever positions or latest prices
+	change and rebuilt hourly by the scheduler.
+	"""
+	exposure = frappe.cache.hget("loan_security_exposure", company or "")
+	if exposure is None:
+		exposure = build_loan_security_exposure(company)
+		frappe.cache.hset("loan_security_exposure", company or "", exposure)
+
+	return exposure
+
+
+def build_loan_security_exposure(company=None):
+	conditions = "WHERE company = %(company)s" if company else ""
+
+	return frappe.db.sql(
+		"""
+		SELECT p.loan_security, SUM(p.qty) as qty,
+			SUM(CASE WHEN p.qty != 0 THEN 1 ELSE 0 END) as applicant_count,
+			SUM(p.qty) * IFNULL(MAX(ls.latest_price), 0) as value
+		FROM (
+			SELECT applicant, loan_security, SUM(qty) as qty
+			FROM `tabLoan Security Position`
+			{conditions}
+			GROUP BY applicant, loan_security
+		) p
+		LEFT JOIN `tabLoan Security` ls ON ls.name = p.loan_security
+		GROUP BY p.loan_security
+		ORDER BY value DESC
+	""".format(
+			conditions=conditions
+		),
+		{"company": company},
+		as_dict=1,
+	)
+
+
+def refresh_loan_security_exposure():
+	frappe.cache.delete_value("loan_security_exposure")
+
+	for company in [None] + frappe.get_all("Company", pluck="name"):
+		get_loan_security_exposure(company)
+
+
+def clear_loan_security_exposure_cache():
+	frappe.db.after_commit.add(lambda: frappe.cache.delete_value("loan_security_exposure"))
+
+
+def on_doctype_update():
+	frappe.db.add_unique(
+		"Loan Security Position", ["loan", "loan_security"], constraint_name="unique_loan_security"
+	)
+	frappe.db.add_index("Loan Security Position", ["loan_security"])
+	frappe.db.add_index("Loan Security Position", ["applicant", "loan_security"])
@@ -0,0 +1,92 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, nowdate
+
+from erpnext.selling.doctype.customer.test_customer import get_customer_dict
+
+from lending.loan_management.doctype.loan.loan import unpledge_security
+from lending.loan_management.doctype.loan.test_loan import (
+	create_demand_loan,
+	create_loan_accounts,
+	create_loan_application,
+	create_loan_product,
+	create_loan_security,
+	create_loan_security_pledge,
+	create_loan_security_price,
+	create_loan_security_type,
+	set_loan_settings_in_company,
+)
+from lending.loan_management.doctype.loan_application.loan_application import create_pledge
+from lending.loan_management.doctype.loan_security_unpledge.loan_security_unpledge import (
+	get_pledged_security_qty,
+)
+
+
+class TestLoanSecurityPosition(FrappeTestCase):
+	def setUp(self):
+		set_loan_settings_in_company()
+		create_loan_accounts()
+
+		create_loan_product(
+			"Demand Loan",
+			"Demand Loan",
+			2000000,
+			13.5,
+			25,
+			0,
+			5,
+			"Cash",
+			"Disbursement Account - _TC",
+			"Payment Account - _TC",
+			"Loan Account - _TC",
+			"Interest Income Account - _TC",
+			"Penalty Income Account - _TC",
+		)
+
+		create_loan_security_type()
+		create_loan_security()
+
+		create_loan_security_price(
+			"Test Security 1", 500, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+		create_loan_security_price(
+			"Test Security 2", 250, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+
+		if not frappe.db.exists("Customer", "_Test Loan Customer"):
+			frappe.get_doc(get_customer_dict("_Test Loan Customer")).insert(ignore_permissions=True)
+
+		self.applicant = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+	def test_positions_on_pledge_and_unpledge(self):
+		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
+		loan_application = create_loan_application(
+			"_Test Company", self.applicant, "Demand Loan", pledge
+		)
+		create_pledge(loan_application)
+
+		loan = create_demand_loan(
+			self.applicant, "Demand Loan", loan_application, posting_date="2019-10-01"
+		)
+		loan.submit()
+
+		self.assertEqual(get_pledged_security_qty(loan.name), {"Test Security 1": 4000})
+
+		pledge = create_loan_security_pledge(
+			self.applicant, [{"loan_security": "Test Security 2", "qty": 2000.00}], loan=loan.name
+		)
+		self.assertEqual(get_pledged_security_qty(loan.name)["Test Security 2"], 2000)
+
+		pledge.cancel()
+		self.assertEqual(get_pledged_security_qty(loan.name)["Test Security 2"], 0)
+
+		unpledge_request = unpledge_security(
+			loan=loan.name, security_map={"Test Security 1": 1000}, save=1, submit=1, approve=1
+		)
+		self.assertEqual(get_pledged_security_qty(loan.name)["Test Security 1"], 3000)
+
+		unpledge_request.cancel()
+		self.assertEqual(get_pledged_security_qty(loan.name)["Test Security 1"], 4000)
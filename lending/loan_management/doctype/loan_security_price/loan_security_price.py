@@ -2,16 +2,35 @@
 # For license information, please see license.txt
 
 
+import csv
+import io
+import json
+import math
+
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import get_datetime
+from frappe.utils import cint, flt, get_datetime
+
+from lending.loan_management.doctype.loan_security_position.loan_security_position import (
+	clear_loan_security_exposure_cache,
+)
+from lending.loan_management.utils import bulk_insert_docs, get_series_names
 
 
 class LoanSecurityPrice(Document):
 	def validate(self):
 		self.validate_dates()
 
+	def on_update(self):
+		update_latest_price(self.loan_security)
+
+	def after_insert(self):
+		self.check_for_shortfall()
+
+	def on_trash(self):
+		update_latest_price(self.loan_security, exclude=self.name)
+
 	def validate_dates(self):
 
 		if self.valid_from > self.valid_upto:
@@ -33,23 +52,298 @@ class LoanSecurityPrice(Document):
 		if existing_loan_security:
 			frappe.throw(_("Loan Security Price overlapping with {0}").format(existing_loan_security[0][0]))
 
+	def check_for_shortfall(self):
+		if not (get_datetime(self.valid_from) <= get_datetime() <= get_datetime(self.valid_upto)):
+			return
+
+		if not frappe.db.get_value(
+			"Loan Security Type", self.loan_security_type, "check_shortfall_on_price_update"
+		):
+			return
+
+		frappe.enqueue(
+			"lending.loan_management.doctype.loan_security_shortfall.loan_security_shortfall.check_for_ltv_shortfall",
+			loan_security=self.loan_security,
+			queue="short",
+			job_id="check_ltv_shortfall_" + self.loan_security,
+			deduplicate=True,
+			enqueue_after_commit=True,
+		)
+
 
 @frappe.whitelist()
 def get_loan_security_price(loan_security, valid_time=None):
-	if not valid_time:
-		valid_time = get_datetime()
+	loan_security_price = get_loan_security_prices([loan_security], valid_time).get(loan_security)
+
+	if not loan_security_price:
+		frappe.throw(_("No valid Loan Security Price found for {0}").format(frappe.bold(loan_security)))
+	else:
+		return loan_security_price
+
+
+def get_loan_security_prices(loan_securities=None, valid_time=None):
+	"""Price of each loan security valid at `valid_time` (now by default)
+
+	Current prices are read from the latest price kept on Loan Security, securities whose
+	latest price is not valid at that time are looked up in the price history.
+	"""
+	valid_time = get_datetime(valid_time)
+	prices = {}
+	pending_securities = loan_securities
+
+	if not loan_securities or len(loan_securities) > 1:
+		filters = {"name": ("in", loan_securities)} if loan_securities else {}
+		pending_securities = []
 
-	loan_security_price = frappe.db.get_value(
+		for d in frappe.get_all(
+			"Loan Security",
+			fields=["name", "latest_price", "latest_price_valid_from", "latest_price_valid_upto"],
+			filters=filters,
+		):
+			if d.latest_price_valid_from and get_datetime(
+				d.latest_price_valid_from
+			) <= valid_time <= get_datetime(d.latest_price_valid_upto):
+				prices[d.name] = d.latest_price
+			else:
+				pending_securities.append(d.name)
+
+	if pending_securities:
+		prices.update(get_loan_security_prices_as_of(valid_time, pending_securities))
+
+	return prices
+
+
+def get_loan_security_prices_as_of(valid_time, loan_securities):
+	"""Point in time price lookup
+
+	Price windows of a security do not overlap, so the window starting last before
+	`valid_time` is the only candidate. It is found with an index seek on
+	(loan_security, valid_from) per security instead of a scan of the price history.
+	"""
+	return frappe._dict(
+		frappe.db.sql(
+			"""
+			SELECT lsp.loan_security, lsp.loan_security_price
+			FROM `tabLoan Security` ls, `tabLoan Security Price` lsp
+			WHERE ls.name in %(loan_securities)s
+			AND lsp.name = (
+				SELECT p.name FROM `tabLoan Security Price` p
+				WHERE p.loan_security = ls.name AND p.valid_from <= %(valid_time)s
+				ORDER BY p.valid_from DESC
+				LIMIT 1
+			)
+			AND lsp.valid_upto >= %(valid_time)s
+		""",
+			{"loan_securities": tuple(loan_securities), "valid_time": valid_time},
+		)
+	)
+
+
+def update_latest_price(loan_security, exclude=None):
+	"""Keep the price with the latest validity start on the Loan Security"""
+	filters = {"loan_security": loan_security}
+	if exclude:
+		filters["name"] = ("!=", exclude)
+
+	latest_price = frappe.get_all(
 		"Loan Security Price",
+		fields=["loan_security_price", "valid_from", "valid_upto"],
+		filters=filters,
+		order_by="valid_from desc",
+		limit=1,
+	)
+	latest_price = latest_price[0] if latest_price else frappe._dict()
+
+	frappe.db.set_value(
+		"Loan Security",
+		loan_security,
 		{
-			"loan_security": loan_security,
-			"valid_from": ("<=", valid_time),
-			"valid_upto": (">=", valid_time),
+			"latest_price": latest_price.loan_security_price,
+			"latest_price_valid_from": latest_price.valid_from,
+			"latest_price_valid_upto": latest_price.valid_upto,
 		},
-		"loan_security_price",
+		update_modified=False,
 	)
+	clear_loan_security_exposure_cache()
 
-	if not loan_security_price:
-		frappe.throw(_("No valid Loan Security Price found for {0}").format(frappe.bold(loan_security)))
-	else:
-		return loan_security_price
+
+@frappe.whitelist()
+def bulk_insert_loan_security_prices(prices, check_shortfall=0):
+	"""Insert a batch of Loan Security Prices at once
+
+	`prices` is a list (or its JSON) of rows with loan_security, loan_security_price, valid_from
+	and valid_upto, or CSV text with those columns as header. The batch is validated as a whole
+	and nothing is inserted if any row is invalid. If `check_shortfall` is set, a single Loan
+	Security Shortfall run is queued once the prices are committed.
+	"""
+	frappe.has_permission("Loan Security Price", "create", throw=True)
+
+	prices = parse_loan_security_prices(prices)
+	if not prices:
+		return {"inserted": 0}
+
+	security_details = {
+		d.name: d
+		for d in frappe.get_all(
+			"Loan Security",
+			fields=[
+				"name",
+				"loan_security_name",
+				"loan_security_type",
+				"unit_of_measure",
+				"latest_price_valid_from",
+			],
+			filters={"name": ("in", list({d.loan_security for d in prices}))},
+		)
+	}
+
+	validate_loan_security_prices(prices, security_details)
+
+	docs = []
+	autoname = frappe.get_meta("Loan Security Price").autoname
+	for price, name in zip(prices, get_series_names(autoname, len(prices))):
+		security = security_details[price.loan_security]
+		doc = frappe.get_doc(
+			{
+				"doctype": "Loan Security Price",
+				"loan_security": price.loan_security,
+				"loan_security_name": security.loan_security_name,
+				"loan_security_type": security.loan_security_type,
+				"uom": security.unit_of_measure,
+				"loan_security_price": flt(price.loan_security_price),
+				"valid_from": price.valid_from,
+				"valid_upto": price.valid_upto,
+			}
+		)
+		doc.name = name
+		docs.append(doc)
+
+	bulk_insert_docs(docs)
+	update_latest_prices(prices, security_details)
+
+	if cint(check_shortfall):
+		frappe.enqueue(
+			"lending.loan_management.doctype.process_loan_security_shortfall.process_loan_security_shortfall.create_process_loan_security_shortfall",
+			queue="long",
+			enqueue_after_commit=True,
+		)
+
+	return {"inserted": len(docs)}
+
+
+def parse_loan_security_prices(prices):
+	if isinstance(prices, str):
+		if prices.lstrip().startswith("["):
+			prices = json.loads(prices)
+		else:
+			prices = list(csv.DictReader(io.StringIO(prices.strip())))
+
+	return [
+		frappe._dict(
+			loan_security=(d.get("loan_security") or "").strip(),
+			loan_security_price=parse_price(d.get("loan_security_price")),
+			valid_from=get_datetime(d.get("valid_from")) if d.get("valid_from") else None,
+			valid_upto=get_datetime(d.get("valid_upto")) if d.get("valid_upto") else None,
+		)
+		for d in prices
+	]
+
+
+def parse_price(value):
+	"""The price as a float, or None if it is missing or not a finite number"""
+	try:
+		value = float(value)
+	except (TypeError, ValueError):
+		return None
+
+	return value if math.isfinite(value) else None
+
+
+def validate_loan_security_prices(prices, security_details):
+	"""Validate a batch against itself and against existing prices with a single query"""
+	errors = []
+	prices_by_security = {}
+
+	for idx, price in enumerate(prices, 1):
+		if price.loan_security not in security_details:
+			errors.append(_("Row {0}: Loan Security {1} does not exist").format(idx, price.loan_security))
+		elif price.loan_security_price is None or price.loan_security_price <= 0:
+			errors.append(
+				_("Row {0}: Loan Security Price should be a number greater than zero").format(idx)
+			)
+		elif not (price.valid_from and price.valid_upto):
+			errors.append(_("Row {0}: Valid From and Valid Upto are mandatory").format(idx))
+		elif price.valid_from > price.valid_upto:
+			errors.append(_("Row {0}: Valid From Time must be lesser than Valid Upto Time.").format(idx))
+		else:
+			prices_by_security.setdefault(price.loan_security, []).append((idx, price))
+
+	if prices_by_security:
+		valid_prices = [d for windows in prices_by_security.values() for idx, d in windows]
+		loan_security_price = frappe.qb.DocType("Loan Security Price")
+		existing_prices = (
+			frappe.qb.from_(loan_security_price)
+			.select(
+				loan_security_price.name,
+				loan_security_price.loan_security,
+				loan_security_price.valid_from,
+				loan_security_price.valid_upto,
+			)
+			.where(
+				(loan_security_price.loan_security.isin(list(prices_by_security)))
+				& (loan_security_price.valid_upto >= min(d.valid_from for d in valid_prices))
+				& (loan_security_price.valid_from <= max(d.valid_upto for d in valid_prices))
+			)
+			.run(as_dict=1)
+		)
+
+		for d in existing_prices:
+			prices_by_security[d.loan_security].append((d.name, d))
+
+	for windows in prices_by_security.values():
+		windows.sort(key=lambda d: d[1].valid_from)
+
+		for (previous_ref, previous), (ref, current) in zip(windows, windows[1:]):
+			if get_datetime(current.valid_from) <= get_datetime(previous.valid_upto):
+				errors.append(
+					_("Loan Security Price for {0} overlapping between {1} and {2}").format(
+						frappe.bold(current.loan_security),
+						get_price_reference(previous_ref),
+						get_price_reference(ref),
+					)
+				)
+
+	if errors:
+		frappe.throw("<br>".join(errors), title=_("Invalid Loan Security Prices"))
+
+
+def get_price_reference(ref):
+	return _("row {0}").format(ref) if isinstance(ref, int) else ref
+
+
+def update_latest_prices(prices, security_details):
+	latest_prices = {}
+	for price in prices:
+		if (
+			price.loan_security not in latest_prices
+			or price.valid_from > latest_prices[price.loan_security].valid_from
+		):
+			latest_prices[price.loan_security] = price
+
+	updates = {}
+	for security, price in latest_prices.items():
+		current_valid_from = security_details[security].latest_price_valid_from
+		if not current_valid_from or price.valid_from > get_datetime(current_valid_from):
+			updates[security] = {
+				"latest_price": flt(price.loan_security_price),
+				"latest_price_valid_from": price.valid_from,
+				"latest_price_valid_upto": price.valid_upto,
+			}
+
+	if updates:
+		frappe.db.bulk_update("Loan Security", updates, update_modified=False)
+		clear_loan_security_exposure_cache()
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Security Price", ["loan_security", "valid_from", "valid_upto"])
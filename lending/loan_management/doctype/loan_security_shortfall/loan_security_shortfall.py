@@ -6,9 +6,10 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt, get_datetime
 
-from lending.loan_management.doctype.loan_security_unpledge.loan_security_unpledge import (
-	get_pledged_security_qty,
+from lending.loan_management.doctype.loan_security_price.loan_security_price import (
+	get_loan_security_prices,
 )
+from lending.loan_management.utils import bulk_insert_docs, get_series_names
 
 
 class LoanSecurityShortfall(Document):
@@ -60,23 +61,31 @@ def add_security(loan):
 	return loan_security_pledge.as_dict()
 
 
-def check_for_ltv_shortfall(process_loan_security_shortfall):
+def check_for_ltv_shortfall(process_loan_security_shortfall=None, loan_security=None):
+	"""Create, update or close shortfalls of disbursed secured loans
 
+	If `loan_security` is passed only the loans currently pledging it are checked.
+	"""
 	update_time = get_datetime()
+	filters = {"status": ("in", ["Disbursed", "Partially Disbursed"]), "is_secured_loan": 1}
+	shortfall_filters = {"status": "Pending"}
+	pledged_loans = None
 
-	loan_security_price_map = frappe._dict(
-		frappe.get_all(
-			"Loan Security Price",
-			fields=["loan_security", "loan_security_price"],
-			filters={"valid_from": ("<=", update_time), "valid_upto": (">=", update_time)},
-			as_list=1,
-		)
-	)
+	if loan_security:
+		pledged_loans = get_loans_pledging_security(loan_security)
+		if not pledged_loans:
+			return
+
+		filters["name"] = shortfall_filters["loan"] = ("in", pledged_loans)
+
+	loan_security_price_map = get_loan_security_prices(valid_time=update_time)
 
 	loans = frappe.get_all(
 		"Loan",
 		fields=[
 			"name",
+			"applicant_type",
+			"applicant",
 			"loan_amount",
 			"total_principal_paid",
 			"total_payment",
@@ -84,16 +93,24 @@ def check_for_ltv_shortfall(process_loan_security_shortfall):
 			"disbursed_amount",
 			"status",
 		],
-		filters={"status": ("in", ["Disbursed", "Partially Disbursed"]), "is_secured_loan": 1},
+		filters=filters,
 	)
 
 	loan_shortfall_map = frappe._dict(
 		frappe.get_all(
-			"Loan Security Shortfall", fields=["loan", "name"], filters={"status": "Pending"}, as_list=1
+			"Loan Security Shortfall",
+			fields=["loan", "name"],
+			filters=shortfall_filters,
+			as_list=1,
 		)
 	)
 
-	loan_security_map = {}
+	pledged_security_map = get_pledged_security_qty_for_loans(pledged_loans)
+	ltv_ratio_map = get_ltv_ratio_map()
+
+	new_shortfalls = []
+	updated_shortfalls = {}
+	completed_shortfalls = []
 
 	for loan in loans:
 		if loan.status == "Disbursed":
@@ -105,32 +122,117 @@ def check_for_ltv_shortfall(process_loan_security_shortfall):
 				flt(loan.disbursed_amount) - flt(loan.total_interest_payable) - flt(loan.total_principal_paid)
 			)
 
-		pledged_securities = get_pledged_security_qty(loan.name)
 		ltv_ratio = 0.0
 		security_value = 0.0
 
-		for security, qty in pledged_securities.items():
+		for security, qty in pledged_security_map.get(loan.name, {}).items():
 			if not ltv_ratio:
-				ltv_ratio = get_ltv_ratio(security)
+				ltv_ratio = flt(ltv_ratio_map.get(security))
 			security_value += flt(loan_security_price_map.get(security)) * flt(qty)
 
 		current_ratio = (outstanding_amount / security_value) * 100 if security_value else 0
+		shortfall_amount = outstanding_amount - ((security_value * ltv_ratio) / 100)
 
 		if current_ratio > ltv_ratio:
-			shortfall_amount = outstanding_amount - ((security_value * ltv_ratio) / 100)
-			create_loan_security_shortfall(
-				loan.name,
-				outstanding_amount,
-				security_value,
-				shortfall_amount,
-				current_ratio,
-				process_loan_security_shortfall,
-			)
-		elif loan_shortfall_map.get(loan.name):
-			shortfall_amount = outstanding_amount - ((security_value * ltv_ratio) / 100)
-			if shortfall_amount <= 0:
-				shortfall = loan_shortfall_map.get(loan.name)
-				update_pending_shortfall(shortfall)
+			shortfall_details = {
+				"shortfall_time": update_time,
+				"loan_amount": outstanding_amount,
+				"security_value": security_value,
+				"shortfall_amount": shortfall_amount,
+				"shortfall_percentage": current_ratio,
+				"process_loan_security_shortfall": process_loan_security_shortfall,
+			}
+
+			if loan_shortfall_map.get(loan.name):
+				updated_shortfalls[loan_shortfall_map[loan.name]] = shortfall_details
+			else:
+				new_shortfalls.append(
+					frappe.get_doc(
+						{
+							"doctype": "Loan Security Shortfall",
+							"loan": loan.name,
+							"applicant_type": loan.applicant_type,
+							"applicant": loan.applicant,
+							"status": "Pending",
+							**shortfall_details,
+						}
+					)
+				)
+		elif loan_shortfall_map.get(loan.name) and shortfall_amount <= 0:
+			completed_shortfalls.append(loan_shortfall_map[loan.name])
+
+	insert_loan_security_shortfalls(new_shortfalls)
+
+	if updated_shortfalls:
+		frappe.db.bulk_update("Loan Security Shortfall", updated_shortfalls)
+
+	if completed_shortfalls:
+		update_pending_shortfall(completed_shortfalls)
+
+
+def get_pledged_security_qty_for_loans(loans=None, loan_security=None):
+	"""Net pledged quantity per security for disbursed secured loans
+
+	Returns a map of loan to {loan security: qty}, optionally limited to `loans` or to a
+	single `loan_security`.
+	"""
+	position = frappe.qb.DocType("Loan Security Position")
+	loan = frappe.qb.DocType("Loan")
+	pledged_security_map = {}
+
+	query = (
+		frappe.qb.from_(position)
+		.inner_join(loan)
+		.on(loan.name == position.loan)
+		.select(position.loan, position.loan_security, position.qty)
+		.where((loan.is_secured_loan == 1) & (loan.status.isin(["Disbursed", "Partially Disbursed"])))
+		.orderby(position.loan)
+		.orderby(position.loan_security)
+	)
+
+	if loans:
+		query = query.where(position.loan.isin(loans))
+
+	if loan_security:
+		query = query.where(position.loan_security == loan_security)
+
+	for loan_name, security, qty in query.run():
+		pledged_security_map.setdefault(loan_name, {})[security] = qty
+
+	return pledged_security_map
+
+
+def get_loans_pledging_security(loan_security):
+	"""Loans which currently hold a positive pledged quantity of `loan_security`"""
+	return [
+		loan
+		for loan, securities in get_pledged_security_qty_for_loans(loan_security=loan_security).items()
+		if flt(securities.get(loan_security)) > 0
+	]
+
+
+def get_ltv_ratio_map():
+	loan_security = frappe.qb.DocType("Loan Security")
+	loan_security_type = frappe.qb.DocType("Loan Security Type")
+
+	return frappe._dict(
+		frappe.qb.from_(loan_security)
+		.inner_join(loan_security_type)
+		.on(loan_security.loan_security_type == loan_security_type.name)
+		.select(loan_security.name, loan_security_type.loan_to_value_ratio)
+		.run()
+	)
+
+
+def insert_loan_security_shortfalls(shortfalls):
+	if not shortfalls:
+		return
+
+	autoname = frappe.get_meta("Loan Security Shortfall").autoname
+	for shortfall, name in zip(shortfalls, get_series_names(autoname, len(shortfalls))):
+		shortfall.name = name
+
+	bulk_insert_docs(shortfalls)
 
 
 def create_loan_security_shortfall(
@@ -167,9 +269,13 @@ def get_ltv_ratio(loan_security):
 
 
 def update_pending_shortfall(shortfall):
-	# Get all pending loan security shortfall
-	frappe.db.set_value(
-		"Loan Security Shortfall",
-		shortfall,
-		{"status": "Completed", "shortfall_amount": 0, "shortfall_percentage": 0},
-	)
+	# Mark pending loan security shortfalls as completed
+	if isinstance(shortfall, str):
+		shortfall = [shortfall]
+
+	loan_security_shortfall = frappe.qb.DocType("Loan Security Shortfall")
+	frappe.qb.update(loan_security_shortfall).set(loan_security_shortfall.status, "Completed").set(
+		loan_security_shortfall.shortfall_amount, 0
+	).set(loan_security_shortfall.shortfall_percentage, 0).where(
+		loan_security_shortfall.name.isin(shortfall)
+	).run()
@@ -7,6 +7,13 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils import flt, get_datetime, getdate
 
+from lending.loan_management.doctype.loan_security_position.loan_security_position import (
+	update_loan_security_position,
+)
+from lending.loan_management.doctype.loan_security_price.loan_security_price import (
+	get_loan_security_prices,
+)
+
 
 class LoanSecurityUnpledge(Document):
 	def validate(self):
@@ -14,6 +21,9 @@ class LoanSecurityUnpledge(Document):
 		self.validate_unpledge_qty()
 
 	def on_cancel(self):
+		if self.status == "Approved":
+			self.update_loan_security_position(cancel=1)
+
 		self.update_loan_status(cancel=1)
 		self.db_set("status", "Requested")
 
@@ -43,14 +53,9 @@ class LoanSecurityUnpledge(Document):
 			frappe.get_all("Loan Security Type", fields=["name", "loan_to_value_ratio"], as_list=1)
 		)
 
-		loan_security_price_map = frappe._dict(
-			frappe.get_all(
-				"Loan Security Price",
-				fields=["loan_security", "loan_security_price"],
-				filters={"valid_from": ("<=", get_datetime()), "valid_upto": (">=", get_datetime())},
-				as_list=1,
-			)
-		)
+		# the value left after unpledge needs the price of every security still pledged
+		loan_securities = list({*pledge_qty_map, *(d.loan_security for d in self.securities)})
+		loan_security_price_map = get_loan_security_prices(loan_securities) if loan_securities else {}
 
 		loan_details = frappe.get_value(
 			"Loan",
@@ -120,9 +125,21 @@ class LoanSecurityUnpledge(Document):
 
 	def approve(self):
 		if self.status == "Approved" and not self.unpledge_time:
+			self.update_loan_security_position()
 			self.update_loan_status()
 			self.db_set("unpledge_time", get_datetime())
 
+	def update_loan_security_position(self, cancel=0):
+		update_loan_security_position(
+			self.loan,
+			self.applicant_type,
+			self.applicant,
+			self.company,
+			self.securities,
+			cancel=cancel,
+			unpledge=1,
+		)
+
 	def update_loan_status(self, cancel=0):
 		if cancel:
 			loan_status = frappe.get_value("Loan", self.loan, "status")
@@ -141,39 +158,15 @@ class LoanSecurityUnpledge(Document):
 
 @frappe.whitelist()
 def get_pledged_security_qty(loan):
-
-	current_pledges = {}
-
-	unpledges = frappe._dict(
-		frappe.db.sql(
-			"""
-		SELECT u.loan_security, sum(u.qty) as qty
-		FROM `tabLoan Security Unpledge` up, `tabUnpledge` u
-		WHERE up.loan = %s
-		AND u.parent = up.name
-		AND up.status = 'Approved'
-		GROUP BY u.loan_security
-	""",
-			(loan),
-		)
-	)
-
-	pledges = frappe._dict(
-		frappe.db.sql(
-			"""
-		SELECT p.loan_security, sum(p.qty) as qty
-		FROM `tabLoan Security Pledge` lp, `tabPledge`p
-		WHERE lp.loan = %s
-		AND p.parent = lp.name
-		AND lp.status = 'Pledged'
-		GROUP BY p.loan_security
-	""",
-			(loan),
+	return frappe._dict(
+		frappe.get_all(
+			"Loan Security Position",
+			fields=["loan_security", "qty"],
+			filters={"loan": loan},
+			as_list=1,
 		)
 	)
 
-	for security, qty in pledges.items():
-		current_pledges.setdefault(security, qty)
-		current_pledges[security] -= unpledges.get(security, 0.0)
 
-	return current_pledges
+def on_doctype_update():
+	frappe.db.add_index("Loan Security Unpledge", ["loan", "status"])
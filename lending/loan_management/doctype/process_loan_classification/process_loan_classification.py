@@ -2,9 +2,14 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
 from frappe.model.document import Document
 from frappe.utils import getdate
 
+from lending.loan_management.doctype.loan_balance_snapshot.loan_balance_snapshot import (
+	make_loan_balance_snapshots,
+)
+
 
 class ProcessLoanClassification(Document):
 	def on_submit(self):
@@ -15,11 +20,12 @@ class ProcessLoanClassification(Document):
 			loan_product=self.loan_product,
 			loan_name=self.loan,
 			process_loan_classification=self.name,
+			loan_names=self.flags.loans,
 		)
 
 
 def create_process_loan_classification(
-	posting_date=None, loan_product=None, loan=None, payment_reference=None
+	posting_date=None, loan_product=None, loan=None, payment_reference=None, loans=None
 ):
 	posting_date = posting_date or getdate()
 
@@ -39,4 +45,86 @@ def create_process_loan_classification(
 		previous_process[0].name if previous_process else None
 	)
 	process_loan_classification.payment_reference = payment_reference
+	# restrict a run to a batch of loans, like the ones paid in a bulk repayment import
+	process_loan_classification.flags.loans = loans
 	process_loan_classification.submit()
+
+
+def process_daily_loan_classification():
+	"""Classify all loans as on today and then snapshot their balances
+
+	The snapshots record the days past due and classification set by this run, so both are made
+	in one job instead of two scheduled jobs that may run in any order.
+	"""
+	create_process_loan_classification()
+	make_loan_balance_snapshots()
+
+
+def mark_loans_for_classification(loans, posting_date):
+	"""Queue loans to be classified by `process_pending_loan_classifications`
+
+	A loan marked several times before the queue is processed is classified once, as on the
+	latest of the posting dates.
+	"""
+	frappe.db.sql(
+		"""
+		UPDATE `tabLoan`
+		SET pending_classification_date = GREATEST(COALESCE(pending_classification_date, %(date)s), %(date)s)
+		WHERE name IN %(loans)s""",
+		{"loans": tuple(loans), "date": getdate(posting_date)},
+	)
+
+
+def process_pending_loan_classifications(batch_size=1000):
+	"""Classify the loans queued by repayments, with one run per posting date and batch
+
+	Each batch locks its marked loans, skipping loans locked by an overlapping run, and clears the
+	marks in the same transaction as its run. So a loan marked again while a batch is being
+	processed waits on the row lock and is picked up by the next run. A failing batch is rolled
+	back and logged, and keeps its marks for the next run without holding up the other batches.
+	"""
+	loan = frappe.qb.DocType("Loan")
+	pending_loans = (
+		frappe.qb.from_(loan)
+		.select(loan.name, loan.pending_classification_date)
+		.where(loan.pending_classification_date.isnotnull())
+		.orderby(loan.pending_classification_date)
+		.orderby(loan.name)
+		.run(as_dict=1)
+	)
+
+	loans_by_date = {}
+	for d in pending_loans:
+		loans_by_date.setdefault(d.pending_classification_date, []).append(d.name)
+
+	for posting_date, loans in loans_by_date.items():
+		for i in range(0, len(loans), batch_size):
+			batch = loans[i : i + batch_size]
+			frappe.db.savepoint("pending_loan_classification")
+
+			try:
+				# only the loans still marked for this date and not taken by another run
+				batch = (
+					frappe.qb.from_(loan)
+					.select(loan.name)
+					.where(loan.name.isin(batch) & (loan.pending_classification_date == posting_date))
+					.for_update(skip_locked=True)
+				).run(pluck=True)
+
+				if not batch:
+					continue
+
+				(
+					frappe.qb.update(loan)
+					.set(loan.pending_classification_date, None)
+					.where(loan.name.isin(batch))
+				).run()
+
+				create_process_loan_classification(posting_date=posting_date, loans=batch)
+			except Exception:
+				frappe.db.rollback(save_point="pending_loan_classification")
+				frappe.log_error(
+					title=_("Loan Classification failed for loans marked on {0}").format(posting_date)
+				)
+
+			frappe.db.commit()  # nosemgrep
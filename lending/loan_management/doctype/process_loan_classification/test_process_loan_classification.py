@@ -1,9 +1,165 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, getdate, nowdate
+
+from erpnext.selling.doctype.customer.test_customer import get_customer_dict
+
+from lending.loan_management.doctype.loan.test_loan import (
+	create_loan_accounts,
+	create_loan_product,
+	create_loan_scenario_for_penalty,
+	create_loan_security,
+	create_loan_security_price,
+	create_loan_security_type,
+	create_repayment_entry,
+	set_loan_settings_in_company,
+)
+from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
+	create_process_loan_classification,
+	mark_loans_for_classification,
+	process_pending_loan_classifications,
+)
 
 
 class TestProcessLoanClassification(FrappeTestCase):
-	pass
+	def setUp(self):
+		set_loan_settings_in_company()
+		set_classify_loans_immediately(0)
+		create_loan_accounts()
+
+		create_loan_product(
+			"Demand Loan",
+			"Demand Loan",
+			2000000,
+			13.5,
+			25,
+			0,
+			5,
+			"Cash",
+			"Disbursement Account - _TC",
+			"Payment Account - _TC",
+			"Loan Account - _TC",
+			"Interest Income Account - _TC",
+			"Penalty Income Account - _TC",
+		)
+
+		create_loan_security_type()
+		create_loan_security()
+
+		create_loan_security_price(
+			"Test Security 1", 500, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+
+		if not frappe.db.exists("Customer", "_Test Loan Customer"):
+			frappe.get_doc(get_customer_dict("_Test Loan Customer")).insert(ignore_permissions=True)
+
+		self.applicant2 = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+	def tearDown(self):
+		set_classify_loans_immediately(0)
+
+	def test_repayment_marks_loan_for_classification(self):
+		# repays part of the interest on 2019-11-04
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		self.assertEqual(
+			getdate(frappe.db.get_value("Loan", loan.name, "pending_classification_date")),
+			getdate("2019-11-04"),
+		)
+		self.assertFalse(frappe.db.exists("Process Loan Classification", {"loan": loan.name}))
+
+	def test_pending_classifications_are_coalesced(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		create_repayment_entry(loan.name, self.applicant2, "2019-11-10", 1000).submit()
+		mark_loans_for_classification([loan.name], "2019-11-06")
+
+		self.assertEqual(
+			getdate(frappe.db.get_value("Loan", loan.name, "pending_classification_date")),
+			getdate("2019-11-10"),
+		)
+
+		process_pending_loan_classifications()
+
+		self.assertIsNone(frappe.db.get_value("Loan", loan.name, "pending_classification_date"))
+
+		dpd_logs = frappe.get_all(
+			"Days Past Due Log",
+			filters={"loan": loan.name},
+			fields=["posting_date", "days_past_due", "process_loan_classification"],
+		)
+		self.assertEqual(len(dpd_logs), 1)
+		self.assertEqual(getdate(dpd_logs[0].posting_date), getdate("2019-11-10"))
+		self.assertTrue(dpd_logs[0].process_loan_classification)
+
+		# half of the October interest is still unpaid
+		self.assertTrue(dpd_logs[0].days_past_due > 0)
+		self.assertEqual(
+			frappe.db.get_value("Loan", loan.name, "days_past_due"), dpd_logs[0].days_past_due
+		)
+
+	def test_failing_batch_does_not_block_the_queue(self):
+		failing_loan, amounts = create_loan_scenario_for_penalty(self)
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		# the failing loan is marked earlier, so its batch runs first
+		frappe.db.set_value("Loan", failing_loan.name, "pending_classification_date", "2019-11-03")
+
+		def classify(**kwargs):
+			if failing_loan.name in kwargs["loans"]:
+				frappe.throw("Classification failed")
+
+			return create_process_loan_classification(**kwargs)
+
+		with patch(
+			"lending.loan_management.doctype.process_loan_classification.process_loan_classification.create_process_loan_classification",
+			side_effect=classify,
+		):
+			process_pending_loan_classifications(batch_size=1)
+
+		self.assertEqual(
+			getdate(frappe.db.get_value("Loan", failing_loan.name, "pending_classification_date")),
+			getdate("2019-11-03"),
+		)
+		self.assertFalse(frappe.db.exists("Days Past Due Log", {"loan": failing_loan.name}))
+
+		self.assertIsNone(frappe.db.get_value("Loan", loan.name, "pending_classification_date"))
+		self.assertTrue(frappe.db.exists("Days Past Due Log", {"loan": loan.name}))
+
+		frappe.db.set_value("Loan", failing_loan.name, "pending_classification_date", None)
+
+	def test_classify_immediately_on_repayment(self):
+		set_classify_loans_immediately(1)
+
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		self.assertIsNone(frappe.db.get_value("Loan", loan.name, "pending_classification_date"))
+		self.assertTrue(frappe.db.exists("Process Loan Classification", {"loan": loan.name}))
+
+	def test_classify_immediately_flag_on_repayment(self):
+		loan, amounts = create_loan_scenario_for_penalty(self)
+
+		repayment = create_repayment_entry(loan.name, self.applicant2, "2019-11-10", 1000)
+		repayment.flags.classify_immediately = True
+		repayment.submit()
+
+		self.assertTrue(
+			frappe.db.exists(
+				"Process Loan Classification", {"loan": loan.name, "payment_reference": repayment.name}
+			)
+		)
+		self.assertEqual(
+			getdate(frappe.db.get_value("Loan", loan.name, "pending_classification_date")),
+			getdate("2019-11-04"),
+		)
+
+
+def set_classify_loans_immediately(value):
+	company = frappe.get_doc("Company", "_Test Company")
+	company.classify_loans_immediately_on_repayment = value
+	company.save()
@@ -2,18 +2,39 @@
 # For license information, please see license.txt
 
 
+import json
+import math
+import zlib
+
 import frappe
+from frappe import _
 from frappe.model.document import Document
-from frappe.utils import nowdate
+from frappe.utils import cint, nowdate
 
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+	calculate_accrual_amount_for_demand_loans,
+	get_demand_loans,
+	get_pending_amounts_for_loans,
+	get_term_loans,
 	make_accrual_interest_entry_for_demand_loans,
 	make_accrual_interest_entry_for_term_loans,
 )
 
 
 class ProcessLoanInterestAccrual(Document):
+	def validate(self):
+		if self.run_in_shards and self.loan:
+			frappe.throw(_("Sharding is only supported when accruing interest for multiple loans"))
+
+	def before_submit(self):
+		if self.run_in_shards:
+			self.make_shards()
+
 	def on_submit(self):
+		if self.run_in_shards:
+			self.enqueue_shards()
+			return
+
 		open_loans = []
 
 		if self.loan:
@@ -37,8 +58,190 @@ class ProcessLoanInterestAccrual(Document):
 				term_loan=self.loan,
 				loan_product=self.loan_product,
 				accrual_type=self.accrual_type,
+				bulk=self.bulk_accrual,
 			)
 
+	def make_shards(self):
+		self.set("shards", [])
+
+		if self.process_type != "Term Loans":
+			self.add_shards("Demand Loans", get_demand_loans(loan_product=self.loan_product))
+
+		if self.process_type != "Demand Loans":
+			term_loans = get_term_loans(self.posting_date, loan_product=self.loan_product)
+			self.add_shards("Term Loans", list({d.name: d for d in term_loans}.values()))
+
+		self.status = "Queued" if self.shards else "Completed"
+
+	def add_shards(self, process_type, loans):
+		loans_per_shard = cint(self.loans_per_shard) or 1000
+		shard_wise_loans = {}
+
+		if self.shard_by == "Loan Name Hash":
+			no_of_shards = math.ceil(len(loans) / loans_per_shard)
+			for loan in loans:
+				shard_key = "Bucket {0}".format(zlib.crc32(loan.name.encode()) % no_of_shards)
+				shard_wise_loans.setdefault(shard_key, []).append(loan.name)
+		else:
+			fieldname = "company" if self.shard_by == "Company" else "loan_product"
+			for loan in loans:
+				shard_wise_loans.setdefault(loan.get(fieldname), []).append(loan.name)
+
+		for shard_key, shard_loans in shard_wise_loans.items():
+			for i in range(0, len(shard_loans), loans_per_shard):
+				chunk = shard_loans[i : i + loans_per_shard]
+				self.append(
+					"shards",
+					{
+						"shard_key": shard_key,
+						"process_type": process_type,
+						"status": "Queued",
+						"loan_count": len(chunk),
+						"loans": json.dumps(chunk),
+					},
+				)
+
+	def enqueue_shards(self):
+		for shard in self.shards:
+			frappe.enqueue(
+				process_loan_interest_accrual_shard,
+				queue="long",
+				timeout=3600,
+				enqueue_after_commit=True,
+				process_loan_interest_accrual=self.name,
+				shard=shard.name,
+			)
+
+
+def process_loan_interest_accrual_shard(process_loan_interest_accrual, shard):
+	"""Accrue interest for one shard of a process, isolating failures per loan"""
+	try:
+		loans, failed_loans = accrue_interest_for_shard(process_loan_interest_accrual, shard)
+	except Exception:
+		# the shard crashed outside the per loan savepoints, so none of its loans are accrued
+		frappe.db.rollback()
+		frappe.log_error(
+			title=_("Loan Interest Accrual failed for shard {0}").format(shard),
+			reference_doctype="Process Loan Interest Accrual",
+			reference_name=process_loan_interest_accrual,
+		)
+		loans = failed_loans = json.loads(
+			frappe.db.get_value("Process Loan Interest Accrual Shard", shard, "loans") or "[]"
+		)
+
+	# commit the accruals first, so that the status is updated in a fresh transaction
+	# which reads the statuses committed by the other shards
+	frappe.db.commit()  # nosemgrep
+	update_shard_status(process_loan_interest_accrual, shard, len(loans), failed_loans)
+	frappe.db.commit()  # nosemgrep
+
+
+def accrue_interest_for_shard(process_loan_interest_accrual, shard):
+	process = frappe.get_doc("Process Loan Interest Accrual", process_loan_interest_accrual)
+	shard_doc = process.getone("shards", {"name": shard})
+	loans = json.loads(shard_doc.loans)
+	failed_loans = []
+
+	if shard_doc.process_type == "Demand Loans":
+		demand_loans = get_demand_loans(loans=loans)
+		pending_amounts = get_pending_amounts_for_loans(demand_loans, process.posting_date)
+
+		for loan in demand_loans:
+			if not accrue_in_savepoint(
+				loan.name,
+				calculate_accrual_amount_for_demand_loans,
+				loan,
+				process.posting_date,
+				process.name,
+				process.accrual_type,
+				pending_amounts.get(loan.name),
+			):
+				failed_loans.append(loan.name)
+	else:
+		term_loans = get_term_loans(process.posting_date, loans=loans)
+
+		# accrue the whole shard at once in bulk mode and only go loan by loan if that fails
+		if not process.bulk_accrual or not accrue_in_savepoint(
+			None, accrue_term_loans, process, term_loans
+		):
+			loan_wise_entries = {}
+			for entry in term_loans:
+				loan_wise_entries.setdefault(entry.name, []).append(entry)
+
+			for loan, entries in loan_wise_entries.items():
+				if not accrue_in_savepoint(loan, accrue_term_loans, process, entries):
+					failed_loans.append(loan)
+
+	return loans, failed_loans
+
+
+def accrue_term_loans(process, term_loans):
+	make_accrual_interest_entry_for_term_loans(
+		process.posting_date,
+		process.name,
+		accrual_type=process.accrual_type,
+		bulk=process.bulk_accrual,
+		term_loans=term_loans,
+	)
+
+
+def accrue_in_savepoint(loan, method, *args):
+	"""Run an accrual method and roll back only its own writes if it fails"""
+	savepoint = "loan_interest_accrual_shard"
+	frappe.db.savepoint(savepoint)
+
+	try:
+		method(*args)
+	except Exception:
+		frappe.db.rollback(save_point=savepoint)
+
+		if loan:
+			frappe.log_error(
+				title=_("Loan Interest Accrual failed for {0}").format(loan),
+				reference_doctype="Loan",
+				reference_name=loan,
+			)
+
+		return False
+
+	return True
+
+
+def update_shard_status(process_loan_interest_accrual, shard, loan_count, failed_loans):
+	# lock the parent before the shard row, so that shards finishing together wait on the
+	# same row in the same order and only the last one to finish closes the process
+	frappe.db.get_value(
+		"Process Loan Interest Accrual", process_loan_interest_accrual, "name", for_update=True
+	)
+
+	frappe.db.set_value(
+		"Process Loan Interest Accrual Shard",
+		shard,
+		{
+			"status": "Failed" if failed_loans else "Completed",
+			"processed_loans": loan_count - len(failed_loans),
+			"failed_loans": len(failed_loans),
+			"failed_loan_list": "\n".join(failed_loans),
+		},
+	)
+
+	shard_status = frappe.db.sql(
+		"""
+		SELECT status, count(*) FROM `tabProcess Loan Interest Accrual Shard`
+		WHERE parent = %s GROUP BY status
+	""",
+		(process_loan_interest_accrual,),
+	)
+	shard_status = dict(shard_status)
+
+	if not shard_status.get("Queued"):
+		frappe.db.set_value(
+			"Process Loan Interest Accrual",
+			process_loan_interest_accrual,
+			"status",
+			"Completed With Errors" if shard_status.get("Failed") else "Completed",
+		)
+
 
 def process_loan_interest_accrual_for_demand_loans(
 	posting_date=None, loan_product=None, loan=None, accrual_type="Regular"
@@ -55,7 +258,9 @@ def process_loan_interest_accrual_for_demand_loans(
 	return loan_process.name
 
 
-def process_loan_interest_accrual_for_term_loans(posting_date=None, loan_product=None, loan=None):
+def process_loan_interest_accrual_for_term_loans(
+	posting_date=None, loan_product=None, loan=None, bulk_accrual=0
+):
 
 	if not term_loan_accrual_pending(posting_date or nowdate(), loan=loan):
 		return
@@ -65,6 +270,7 @@ def process_loan_interest_accrual_for_term_loans(posting_date=None, loan_product
 	loan_process.loan_product = loan_product
 	loan_process.process_type = "Term Loans"
 	loan_process.loan = loan
+	loan_process.bulk_accrual = bulk_accrual
 
 	loan_process.submit()
 
@@ -1,9 +1,109 @@
 # Copyright (c) 2019, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
 import unittest
 
+import frappe
+from frappe.utils import add_to_date, get_datetime, nowdate
+
+from erpnext.selling.doctype.customer.test_customer import get_customer_dict
+
+from lending.loan_management.doctype.loan.test_loan import (
+	create_demand_loan,
+	create_loan_accounts,
+	create_loan_application,
+	create_loan_product,
+	create_loan_security,
+	create_loan_security_price,
+	create_loan_security_type,
+	make_loan_disbursement_entry,
+	set_loan_settings_in_company,
+)
+from lending.loan_management.doctype.loan_application.loan_application import create_pledge
+from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
+	process_loan_interest_accrual_shard,
+)
+
 
 class TestProcessLoanInterestAccrual(unittest.TestCase):
-	pass
+	def setUp(self):
+		set_loan_settings_in_company()
+		create_loan_accounts()
+
+		create_loan_product(
+			"Sharded Demand Loan",
+			"Sharded Demand Loan",
+			2000000,
+			13.5,
+			25,
+			0,
+			5,
+			"Cash",
+			"Disbursement Account - _TC",
+			"Payment Account - _TC",
+			"Loan Account - _TC",
+			"Interest Income Account - _TC",
+			"Penalty Income Account - _TC",
+		)
+
+		create_loan_security_type()
+		create_loan_security()
+
+		create_loan_security_price(
+			"Test Security 1", 500, "Nos", get_datetime(), get_datetime(add_to_date(nowdate(), hours=24))
+		)
+
+		if not frappe.db.exists("Customer", "_Test Loan Customer"):
+			frappe.get_doc(get_customer_dict("_Test Loan Customer")).insert(ignore_permissions=True)
+
+		self.applicant = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+	def test_sharded_interest_accrual(self):
+		loans = []
+		for i in range(2):
+			pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
+			loan_application = create_loan_application(
+				"_Test Company", self.applicant, "Sharded Demand Loan", pledge
+			)
+			create_pledge(loan_application)
+
+			loan = create_demand_loan(
+				self.applicant, "Sharded Demand Loan", loan_application, posting_date="2019-10-01"
+			)
+			loan.submit()
+
+			make_loan_disbursement_entry(loan.name, loan.loan_amount, disbursement_date="2019-10-01")
+			loans.append(loan.name)
+
+		process = frappe.new_doc("Process Loan Interest Accrual")
+		process.update(
+			{
+				"posting_date": "2019-10-30",
+				"loan_product": "Sharded Demand Loan",
+				"process_type": "Demand Loans",
+				"run_in_shards": 1,
+				"shard_by": "Loan Product",
+				"loans_per_shard": 1,
+			}
+		)
+		process.submit()
+
+		self.assertEqual(len(process.shards), 2)
+		self.assertEqual(process.status, "Queued")
+
+		process_loan_interest_accrual_shard(process.name, process.shards[0].name)
+		process.load_from_db()
+		self.assertEqual(process.status, "Queued")
+
+		process_loan_interest_accrual_shard(process.name, process.shards[1].name)
+		process.load_from_db()
+		self.assertEqual(process.status, "Completed")
+		self.assertEqual([d.status for d in process.shards], ["Completed", "Completed"])
+		self.assertEqual(sum(d.processed_loans for d in process.shards), 2)
+
+		accrued_loans = frappe.get_all(
+			"Loan Interest Accrual",
+			filters={"process_loan_interest_accrual": process.name, "docstatus": 1},
+			pluck="loan",
+		)
+		self.assertEqual(sorted(accrued_loans), sorted(loans))
@@ -1,10 +1,15 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+from pypika.terms import Case
+
 import frappe
 from frappe.model.document import Document
+from frappe.query_builder.functions import IfNull, Sum
 from frappe.utils import flt, getdate
 
+from lending.loan_management.utils import bulk_insert_docs
+
 
 class ProcessLoanRestructureLimit(Document):
 	def on_submit(self):
@@ -15,156 +20,173 @@ def calculate_monthly_restructure_limit(branch=None, posting_date=None):
 	if not posting_date:
 		posting_date = getdate()
 
-	if branch:
-		branches = [branch]
-	else:
-		branches = frappe.db.get_all("Branch", pluck="name")
-
-	for company in frappe.get_all("Company", pluck="name"):
-		for branch in branches:
-			limit_details = frappe.db.get_value(
-				"Branch", branch, ["loan_restructure_limit", "delinquent_limit"], as_dict=1
+	existing_logs = get_existing_limit_logs(posting_date, branch)
+
+	new_logs = []
+	updated_logs = {}
+
+	for (company, branch), limit_details in get_restructure_limits(branch).items():
+		if existing_logs.get((company, branch)):
+			updated_logs[existing_logs[(company, branch)]] = limit_details
+		else:
+			new_logs.append(
+				frappe.get_doc(
+					{
+						"doctype": "Loan Restructure Limit Log",
+						"company": company,
+						"branch": branch,
+						"date": posting_date,
+						**limit_details,
+					}
+				)
 			)
 
-			if not limit_details.loan_restructure_limit:
-				loan_restructure_limit = frappe.db.get_value("Company", company, "loan_restructure_limit")
-			else:
-				loan_restructure_limit = limit_details.loan_restructure_limit
-
-			if not limit_details.delinquent_limit:
-				delinquent_limit = frappe.db.get_value("Company", company, "delinquent_limit")
-			else:
-				delinquent_limit = limit_details.delinquent_limit
-
-			outstanding_pos = get_outstanding_pos(branch, company)
-			delinquent_pos = get_outstanding_pos(branch, company, delinquent=1)
+	if updated_logs:
+		frappe.db.bulk_update("Loan Restructure Limit Log", updated_logs)
+
+	bulk_insert_docs(new_logs)
+
+
+def get_restructure_limits(branch=None, company=None):
+	"""Restructure limits per company and branch, computed from current figures"""
+	branch_filters = {"name": branch} if branch else {}
+	company_filters = {"name": company} if company else {}
+	branch_limits = {
+		d.name: d
+		for d in frappe.get_all(
+			"Branch", fields=["name", "loan_restructure_limit", "delinquent_limit"], filters=branch_filters
+		)
+	}
+	company_limits = {
+		d.name: d
+		for d in frappe.get_all(
+			"Company",
+			fields=["name", "loan_restructure_limit", "delinquent_limit"],
+			filters=company_filters,
+		)
+	}
+
+	outstanding_pos = get_outstanding_pos(branch)
+	restructured_amounts = get_restructured_amounts(branch)
+
+	limits = {}
+	for company, company_limit in company_limits.items():
+		for branch, branch_limit in branch_limits.items():
+			loan_restructure_limit = (
+				branch_limit.loan_restructure_limit or company_limit.loan_restructure_limit
+			)
+			delinquent_limit = branch_limit.delinquent_limit or company_limit.delinquent_limit
 
-			utilized_limit = get_utilized_limit(branch, company)
-			delinquent_utilized_limit = get_utilized_limit(branch, company, delinquent=1)
+			pos = outstanding_pos.get((company, branch), {})
+			restructured = restructured_amounts.get((company, branch), {})
 
-			in_process_amount = get_in_process_limit(branch, company)
-			delinquent_in_process_limit = get_in_process_limit(branch, company, delinquent=1)
+			principal_outstanding = flt(pos.get("outstanding_pos"))
+			delinquent_pos = flt(pos.get("delinquent_pos"))
+			utilized_limit = flt(restructured.get("utilized_limit"))
+			delinquent_utilized_limit = flt(restructured.get("delinquent_utilized_limit"))
+			in_process_limit = flt(restructured.get("in_process_limit"))
+			delinquent_in_process_limit = flt(restructured.get("delinquent_in_process_limit"))
 
-			limit_amount = outstanding_pos * flt(loan_restructure_limit) / 100
+			limit_amount = principal_outstanding * flt(loan_restructure_limit) / 100
 			delinquent_limit_amount = delinquent_pos * flt(delinquent_limit) / 100
 
-			limit_details = frappe._dict(
-				{
-					"principal_outstanding": outstanding_pos,
-					"limit_percent": loan_restructure_limit,
-					"limit_amount": limit_amount,
-					"utilized_limit": utilized_limit,
-					"in_process_limit": in_process_amount,
-					"available_limit": limit_amount - utilized_limit - in_process_amount,
-				}
-			)
+			limits[(company, branch)] = {
+				"principal_outstanding": principal_outstanding,
+				"limit_percent": loan_restructure_limit,
+				"limit_amount": limit_amount,
+				"utilized_limit": utilized_limit,
+				"in_process_limit": in_process_limit,
+				"available_limit": limit_amount - utilized_limit - in_process_limit,
+				"delinquent_principal_outstanding": delinquent_pos,
+				"delinquent_utilized_limit": delinquent_utilized_limit,
+				"delinquent_limit_percent": delinquent_limit,
+				"delinquent_in_process_limit": delinquent_in_process_limit,
+				"delinquent_limit_amount": delinquent_limit_amount,
+				"delinquent_available_limit": delinquent_limit_amount
+				- delinquent_utilized_limit
+				- delinquent_in_process_limit
+				if delinquent_pos > 0
+				else 0,
+			}
 
-			delinquent_limit_details = frappe._dict(
-				{
-					"delinquent_principal_outstanding": delinquent_pos,
-					"delinquent_utilized_limit": delinquent_utilized_limit,
-					"delinquent_limit_percent": delinquent_limit,
-					"delinquent_in_process_limit": delinquent_in_process_limit,
-					"delinquent_limit_amount": delinquent_limit_amount,
-					"delinquent_available_limit": delinquent_limit_amount
-					- delinquent_utilized_limit
-					- delinquent_in_process_limit
-					if delinquent_pos > 0
-					else 0,
-				}
-			)
+	return limits
 
-			update_or_create_limit_log(
-				company, branch, posting_date, limit_details, delinquent_limit_details
-			)
 
+def get_existing_limit_logs(posting_date, branch=None):
+	"""Latest limit log on or after the posting date for every company and branch"""
+	filters = {"date": (">=", posting_date)}
+	if branch:
+		filters["branch"] = branch
 
-def update_or_create_limit_log(
-	company, branch, posting_date, limit_details, delinquent_limit_details
-):
-	existing_log = frappe.db.get_all(
+	existing_logs = {}
+	for d in frappe.get_all(
 		"Loan Restructure Limit Log",
-		{"company": company, "branch": branch, "date": (">=", posting_date)},
-		["name"],
-		order_by="date desc",
-		limit=1,
+		fields=["name", "company", "branch"],
+		filters=filters,
+		order_by="date asc",
+	):
+		existing_logs[(d.company, d.branch)] = d.name
+
+	return existing_logs
+
+
+def get_outstanding_pos(branch=None):
+	"""Principal outstanding of disbursed loans per company and branch, overall and delinquent"""
+	loan = frappe.qb.DocType("Loan")
+	pos = (
+		IfNull(loan.total_payment, 0)
+		- IfNull(loan.total_principal_paid, 0)
+		- IfNull(loan.total_interest_payable, 0)
 	)
 
-	if existing_log:
-		doc = frappe.get_doc("Loan Restructure Limit Log", existing_log[0].name)
-		doc.update(limit_details)
-		doc.update(delinquent_limit_details)
-		doc.save()
-	else:
-		frappe.get_doc(
-			{
-				"doctype": "Loan Restructure Limit Log",
-				"company": company,
-				"branch": branch,
-				"date": posting_date,
-				"principal_outstanding": limit_details.principal_outstanding,
-				"limit_percent": limit_details.limit_percent,
-				"limit_amount": limit_details.limit_amount,
-				"utilized_limit": limit_details.utilized_limit,
-				"in_process_limit": limit_details.in_process_amount,
-				"available_limit": flt(limit_details.limit_amount)
-				- flt(limit_details.utilized_limit)
-				- flt(limit_details.in_process_amount),
-				"delinquent_principal_outstanding": delinquent_limit_details.delinquent_principal_outstanding,
-				"delinquent_utilized_limit": delinquent_limit_details.delinquent_utilized_limit,
-				"delinquent_limit_percent": delinquent_limit_details.delinquent_limit_percent,
-				"delinquent_in_process_limit": delinquent_limit_details.delinquent_in_process_limit,
-				"delinquent_limit_amount": delinquent_limit_details.delinquent_limit_amount,
-				"delinquent_available_limit": flt(delinquent_limit_details.delinquent_limit_amount)
-				- flt(delinquent_limit_details.delinquent_utilized_limit)
-				- flt(delinquent_limit_details.delinquent_in_process_limit),
-			}
-		).insert()
-
-
-def get_outstanding_pos(branch, company, delinquent=0):
-	filters = {"branch": branch, "docstatus": 1, "status": "Disbursed", "company": company}
-
-	if delinquent:
-		filters.update({"days_past_due": (">=", 1)})
-
-	pos = frappe.db.get_value(
-		"Loan",
-		filters,
-		[
-			"sum(total_payment) as total_payment",
-			"sum(total_principal_paid) as total_principal_paid",
-			"sum(total_interest_payable) as total_interest_payable",
-		],
-		as_dict=1,
+	query = (
+		frappe.qb.from_(loan)
+		.select(
+			loan.company,
+			loan.branch,
+			Sum(pos).as_("outstanding_pos"),
+			Sum(Case().when(loan.days_past_due >= 1, pos).else_(0)).as_("delinquent_pos"),
+		)
+		.where((loan.docstatus == 1) & (loan.status == "Disbursed"))
+		.groupby(loan.company, loan.branch)
 	)
 
-	return flt(pos.total_payment) - flt(pos.total_principal_paid) - flt(pos.total_interest_payable)
-
-
-def get_utilized_limit(branch, company, delinquent=0):
-	filters = {"branch": branch, "docstatus": 1, "company": company, "status": "Approved"}
-
-	if delinquent:
-		filters.update({"pre_restructure_dpd": (">=", 1)})
-
-	utilized_limit = frappe.db.get_value(
-		"Loan Restructure",
-		filters,
-		["sum(pending_principal_amount)"],
+	if branch:
+		query = query.where(loan.branch == branch)
+
+	return {(d.company, d.branch): d for d in query.run(as_dict=1)}
+
+
+def get_restructured_amounts(branch=None):
+	"""Approved (utilized) and initiated (in process) restructures per company and branch"""
+	loan_restructure = frappe.qb.DocType("Loan Restructure")
+	amount = IfNull(loan_restructure.pending_principal_amount, 0)
+	is_delinquent = loan_restructure.pre_restructure_dpd >= 1
+
+	def get_amount(status, delinquent=False):
+		condition = loan_restructure.status == status
+		if delinquent:
+			condition = condition & is_delinquent
+
+		return Sum(Case().when(condition, amount).else_(0))
+
+	query = (
+		frappe.qb.from_(loan_restructure)
+		.select(
+			loan_restructure.company,
+			loan_restructure.branch,
+			get_amount("Approved").as_("utilized_limit"),
+			get_amount("Approved", delinquent=True).as_("delinquent_utilized_limit"),
+			get_amount("Initiated").as_("in_process_limit"),
+			get_amount("Initiated", delinquent=True).as_("delinquent_in_process_limit"),
+		)
+		.where(
+			(loan_restructure.docstatus == 1) & (loan_restructure.status.isin(["Approved", "Initiated"]))
+		)
+		.groupby(loan_restructure.company, loan_restructure.branch)
 	)
 
-	return flt(utilized_limit)
-
-
-def get_in_process_limit(branch, company, delinquent=0):
-	filters = {"branch": branch, "docstatus": 1, "company": company, "status": "Initiated"}
-
-	if delinquent:
-		filters.update({"pre_restructure_dpd": (">=", 1)})
-
-	in_process_limit = frappe.db.get_value(
-		"Loan Restructure", filters, ["sum(pending_principal_amount)"]
-	)
+	if branch:
+		query = query.where(loan_restructure.branch == branch)
 
-	return flt(in_process_limit)
+	return {(d.company, d.branch): d for d in query.run(as_dict=1)}
@@ -2,9 +2,13 @@
 # For license information, please see license.txt
 
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class RepaymentSchedule(Document):
 	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Repayment Schedule", ["is_accrued", "payment_date"])
@@ -135,22 +135,6 @@ def get_data(filters):
 
 def get_loan_security_details():
 	security_detail_map = {}
-	loan_security_price_map = {}
-	lsp_validity_map = {}
-
-	loan_security_prices = frappe.db.sql(
-		"""
-		SELECT loan_security, loan_security_price, valid_upto
-		FROM `tabLoan Security Price` t1
-		WHERE valid_from >= (SELECT MAX(valid_from) FROM `tabLoan Security Price` t2
-		WHERE t1.loan_security = t2.loan_security)
-	""",
-		as_dict=1,
-	)
-
-	for security in loan_security_prices:
-		loan_security_price_map.setdefault(security.loan_security, security.loan_security_price)
-		lsp_validity_map.setdefault(security.loan_security, security.valid_upto)
 
 	loan_security_details = frappe.get_all(
 		"Loan Security",
@@ -161,17 +145,13 @@ def get_loan_security_details():
 			"haircut",
 			"loan_security_type",
 			"disabled",
+			"latest_price",
+			"latest_price_valid_upto as valid_upto",
 		],
 	)
 
 	for security in loan_security_details:
-		security.update(
-			{
-				"latest_price": flt(loan_security_price_map.get(security.loan_security)),
-				"valid_upto": lsp_validity_map.get(security.loan_security),
-			}
-		)
-
+		security.latest_price = flt(security.latest_price)
 		security_detail_map.setdefault(security.loan_security, security)
 
 	return security_detail_map
@@ -181,43 +161,16 @@ def get_applicant_wise_total_loan_security_qty(filters, loan_security_details):
 	current_pledges = {}
 	total_value_map = {}
 	applicant_type_map = {}
-	applicant_wise_unpledges = {}
-	conditions = ""
+	query_filters = {}
 
 	if filters.get("company"):
-		conditions = "AND company = %(company)s"
-
-	unpledges = frappe.db.sql(
-		"""
-		SELECT up.applicant, u.loan_security, sum(u.qty) as qty
-		FROM `tabLoan Security Unpledge` up, `tabUnpledge` u
-		WHERE u.parent = up.name
-		AND up.status = 'Approved'
-		{conditions}
-		GROUP BY up.applicant, u.loan_security
-	""".format(
-			conditions=conditions
-		),
-		filters,
-		as_dict=1,
-	)
+		query_filters["company"] = filters.get("company")
 
-	for unpledge in unpledges:
-		applicant_wise_unpledges.setdefault((unpledge.applicant, unpledge.loan_security), unpledge.qty)
-
-	pledges = frappe.db.sql(
-		"""
-		SELECT lp.applicant_type, lp.applicant, p.loan_security, sum(p.qty) as qty
-		FROM `tabLoan Security Pledge` lp, `tabPledge`p
-		WHERE p.parent = lp.name
-		AND lp.status = 'Pledged'
-		{conditions}
-		GROUP BY lp.applicant, p.loan_security
-	""".format(
-			conditions=conditions
-		),
-		filters,
-		as_dict=1,
+	pledges = frappe.get_all(
+		"Loan Security Position",
+		fields=["applicant_type", "applicant", "loan_security", "sum(qty) as qty"],
+		filters=query_filters,
+		group_by="applicant, loan_security",
 	)
 
 	for security in pledges:
@@ -225,10 +178,6 @@ def get_applicant_wise_total_loan_security_qty(filters, loan_security_details):
 		total_value_map.setdefault(security.applicant, 0.0)
 		applicant_type_map.setdefault(security.applicant, security.applicant_type)
 
-		current_pledges[(security.applicant, security.loan_security)] -= applicant_wise_unpledges.get(
-			(security.applicant, security.loan_security), 0.0
-		)
-
 		total_value_map[security.applicant] += current_pledges.get(
 			(security.applicant, security.loan_security)
 		) * loan_security_details.get(security.loan_security, {}).get("latest_price", 0)
@@ -0,0 +1,36 @@
+// Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+// For license information, please see license.txt
+/* eslint-disable */
+
+frappe.query_reports["Loan Cash Flow Projection"] = {
+	"filters": [
+		{
+			"fieldname": "company",
+			"label": __("Company"),
+			"fieldtype": "Link",
+			"options": "Company",
+			"default": frappe.defaults.get_user_default("Company"),
+			"reqd": 1
+		},
+		{
+			"fieldname": "from_date",
+			"label": __("From Date"),
+			"fieldtype": "Date",
+			"default": frappe.datetime.get_today(),
+			"reqd": 1
+		},
+		{
+			"fieldname": "to_date",
+			"label": __("To Date"),
+			"fieldtype": "Date",
+			"default": frappe.datetime.add_days(frappe.datetime.add_months(frappe.datetime.get_today(), 12), -1),
+			"reqd": 1
+		},
+		{
+			"fieldname": "loan_product",
+			"label": __("Loan Product"),
+			"fieldtype": "Link",
+			"options": "Loan Product"
+		}
+	]
+};
@@ -0,0 +1,248 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+
+import frappe
+from frappe import _
+from frappe.utils import (
+	add_days,
+	add_months,
+	cint,
+	date_diff,
+	flt,
+	formatdate,
+	get_last_day,
+	getdate,
+)
+
+from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+	get_per_day_interest,
+)
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	get_pending_principal_amount,
+)
+
+
+def execute(filters=None):
+	filters = frappe._dict(filters or {})
+
+	columns = get_columns()
+	data = get_cash_flow_projection(
+		filters.company, filters.from_date, filters.to_date, filters.loan_product
+	)
+
+	return columns, data
+
+
+def get_columns():
+	return [
+		{"label": _("Period"), "fieldname": "period", "fieldtype": "Data", "width": 100},
+		{"label": _("From Date"), "fieldname": "from_date", "fieldtype": "Date", "width": 100},
+		{"label": _("To Date"), "fieldname": "to_date", "fieldtype": "Date", "width": 100},
+		{
+			"label": _("Scheduled Principal"),
+			"fieldname": "principal_amount",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 150,
+		},
+		{
+			"label": _("Scheduled Interest"),
+			"fieldname": "interest_amount",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 150,
+		},
+		{
+			"label": _("Projected Demand Loan Interest"),
+			"fieldname": "projected_interest_amount",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 150,
+		},
+		{
+			"label": _("Total Inflow"),
+			"fieldname": "total_amount",
+			"fieldtype": "Currency",
+			"options": "currency",
+			"width": 150,
+		},
+		{
+			"label": _("Currency"),
+			"fieldname": "currency",
+			"fieldtype": "Link",
+			"options": "Currency",
+			"hidden": 1,
+		},
+	]
+
+
+@frappe.whitelist()
+def get_cash_flow_projection(company, from_date=None, to_date=None, loan_product=None):
+	"""Expected principal and interest inflows of a company's loan book, by month
+
+	Term loans contribute the rows of their active repayment schedules falling in each month.
+	Demand loans have no schedule, so their interest is projected on the pending principal
+	as of today at the loan's rate, with the company's interest day count convention.
+	"""
+	frappe.has_permission("Loan", "read", throw=True)
+
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	from_date = getdate(from_date)
+	to_date = getdate(to_date) if to_date else add_days(add_months(from_date, 12), -1)
+	currency = frappe.get_cached_value("Company", company, "default_currency")
+
+	periods = get_periods(from_date, to_date)
+	period_map = {(d.from_date.year, d.from_date.month): d for d in periods}
+
+	for year, month, principal_amount, interest_amount in get_scheduled_amounts(
+		company, from_date, to_date, loan_product
+	):
+		period_map[(year, month)].principal_amount = flt(principal_amount, precision)
+		period_map[(year, month)].interest_amount = flt(interest_amount, precision)
+
+	set_projected_demand_loan_interest(periods, company, loan_product)
+
+	for d in periods:
+		d.projected_interest_amount = flt(d.projected_interest_amount, precision)
+		d.total_amount = flt(
+			d.principal_amount + d.interest_amount + d.projected_interest_amount, precision
+		)
+		d.currency = currency
+
+	return periods
+
+
+def get_periods(from_date, to_date):
+	periods = []
+	start_date = from_date
+
+	while start_date <= to_date:
+		end_date = min(get_last_day(start_date), to_date)
+		periods.append(
+			frappe._dict(
+				{
+					"period": formatdate(start_date, "MMM YYYY"),
+					"from_date": start_date,
+					"to_date": end_date,
+					"principal_amount": 0.0,
+					"interest_amount": 0.0,
+					"projected_interest_amount": 0.0,
+				}
+			)
+		)
+		start_date = add_days(end_date, 1)
+
+	return periods
+
+
+def get_scheduled_amounts(company, from_date, to_date, loan_product=None):
+	"""Principal and interest of the active schedules of disbursed loans, summed per month"""
+	conditions = ""
+	if loan_product:
+		conditions = "AND loan.loan_product = %(loan_product)s"
+
+	return frappe.db.sql(
+		f"""
+		SELECT YEAR(rs.payment_date), MONTH(rs.payment_date), SUM(rs.principal_amount),
+			SUM(rs.interest_amount)
+		FROM `tabRepayment Schedule` rs
+		INNER JOIN `tabLoan Repayment Schedule` lrs ON lrs.name = rs.parent
+		INNER JOIN `tabLoan` loan ON loan.name = lrs.loan
+		WHERE rs.parenttype = 'Loan Repayment Schedule'
+		AND rs.docstatus = 1
+		AND lrs.status = 'Active'
+		AND loan.docstatus = 1
+		AND loan.status IN ('Disbursed', 'Partially Disbursed')
+		AND loan.company = %(company)s
+		AND rs.payment_date BETWEEN %(from_date)s AND %(to_date)s
+		{conditions}
+		GROUP BY YEAR(rs.payment_date), MONTH(rs.payment_date)
+	""",  # nosec
+		{"company": company, "from_date": from_date, "to_date": to_date, "loan_product": loan_product},
+	)
+
+
+def set_projected_demand_loan_interest(periods, company, loan_product=None):
+	# interest is linear in the principal, so the book is projected once per rate of interest
+	pending_principal_by_rate = get_demand_loan_principal_by_rate(company, loan_product)
+
+	if not pending_principal_by_rate:
+		return
+
+	interest_day_count_convention = frappe.get_cached_value(
+		"Company", company, "interest_day_count_convention"
+	)
+
+	for d in periods:
+		no_of_days = date_diff(d.to_date, d.from_date) + 1
+
+		if interest_day_count_convention in ("30/365", "30/360"):
+			# a whole month counts as 30 days
+			is_whole_month = d.from_date.day == 1 and d.to_date == get_last_day(d.from_date)
+			no_of_days = 30 if is_whole_month else min(no_of_days, 30)
+
+		for rate_of_interest, pending_principal_amount in pending_principal_by_rate.items():
+			d.projected_interest_amount += no_of_days * get_per_day_interest(
+				pending_principal_amount,
+				rate_of_interest,
+				company,
+				d.from_date,
+				interest_day_count_convention,
+			)
+
+
+def get_demand_loan_principal_by_rate(company, loan_product=None, chunk_size=10000):
+	"""Pending principal of the open demand loans of a company, summed per rate of interest
+
+	Loans are read in chunks of `chunk_size` by name, so the book is never loaded at once.
+	"""
+	filters = {
+		"company": company,
+		"docstatus": 1,
+		"is_term_loan": 0,
+		"status": ("in", ["Disbursed", "Partially Disbursed"]),
+	}
+
+	if loan_product:
+		filters["loan_product"] = loan_product
+
+	pending_principal_by_rate = {}
+	last_loan = ""
+
+	while True:
+		loans = frappe.get_all(
+			"Loan",
+			filters={**filters, "name": (">", last_loan)},
+			fields=[
+				"name",
+				"status",
+				"rate_of_interest",
+				"loan_amount",
+				"disbursed_amount",
+				"total_payment",
+				"debit_adjustment_amount",
+				"credit_adjustment_amount",
+				"total_principal_paid",
+				"total_interest_payable",
+				"written_off_amount",
+				"refund_amount",
+			],
+			order_by="name",
+			limit=chunk_size,
+		)
+
+		for loan in loans:
+			pending_principal_amount = get_pending_principal_amount(loan)
+			if pending_principal_amount > 0 and flt(loan.rate_of_interest):
+				rate_of_interest = flt(loan.rate_of_interest)
+				pending_principal_by_rate[rate_of_interest] = (
+					pending_principal_by_rate.get(rate_of_interest, 0) + pending_principal_amount
+				)
+
+		if len(loans) < chunk_size:
+			break
+
+		last_loan = loans[-1].name
+
+	return pending_principal_by_rate
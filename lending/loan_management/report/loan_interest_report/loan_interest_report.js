@@ -46,5 +46,15 @@ frappe.query_reports["Loan Interest Report"] = {
 			"label": __("From Date"),
 			"fieldtype": "Date",
 		},
-	]
+	],
+	onload: function(report) {
+		report.page.add_inner_button(__("Export CSV"), function() {
+			frappe.call({
+				method: "lending.loan_management.report.loan_interest_report.loan_interest_report.export_to_csv",
+				args: {
+					filters: report.get_values()
+				}
+			});
+		});
+	}
 };
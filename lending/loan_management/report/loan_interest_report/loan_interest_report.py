@@ -2,9 +2,12 @@
 # For license information, please see license.txt
 
 
+import csv
+import json
+
 import frappe
 from frappe import _
-from frappe.utils import add_days, flt, getdate
+from frappe.utils import flt
 
 import erpnext
 
@@ -145,6 +148,20 @@ def get_columns():
 
 
 def get_active_loan_details(filters):
+	data = []
+	for page in get_loan_detail_pages(filters):
+		data.extend(page)
+
+	return data
+
+
+def get_loan_detail_pages(filters, page_length=1000):
+	"""Yield report rows one page of loans at a time
+
+	Accruals, repayments and pledges are aggregated in SQL for the loans of the current page
+	only, so memory use is bounded by the page size and not by the size of the loan book.
+	"""
+	filters = frappe._dict(filters or {})
 	filter_obj = {
 		"status": ("!=", "Closed"),
 		"docstatus": 1,
@@ -155,73 +172,167 @@ def get_active_loan_details(filters):
 	if filters.get("applicant"):
 		filter_obj.update({"applicant": filters.get("applicant")})
 
-	loan_details = frappe.get_all(
-		"Loan",
-		fields=[
-			"name as loan",
-			"applicant_type",
-			"applicant as applicant_name",
-			"loan_product",
-			"disbursed_amount",
-			"rate_of_interest",
-			"total_payment",
-			"total_principal_paid",
-			"total_interest_payable",
-			"written_off_amount",
-			"status",
-		],
-		filters=filter_obj,
-	)
-
-	loan_list = [d.loan for d in loan_details]
-
-	current_pledges = get_loan_wise_pledges(filters)
-	loan_wise_security_value = get_loan_wise_security_value(filters, current_pledges)
-
-	sanctioned_amount_map = get_sanctioned_amount_map()
+	loan_security_details = get_loan_security_details()
 	penal_interest_rate_map = get_penal_interest_rate_map()
-	payments = get_payments(loan_list, filters)
-	accrual_map = get_interest_accruals(loan_list, filters)
 	currency = erpnext.get_company_currency(filters.get("company"))
-
-	for loan in loan_details:
-		total_payment = loan.total_payment if loan.status == "Disbursed" else loan.disbursed_amount
-
-		loan.update(
-			{
-				"sanctioned_amount": flt(sanctioned_amount_map.get(loan.applicant_name)),
-				"principal_outstanding": flt(total_payment)
-				- flt(loan.total_principal_paid)
-				- flt(loan.total_interest_payable)
-				- flt(loan.written_off_amount),
-				"total_repayment": flt(payments.get(loan.loan)),
-				"accrued_interest": flt(accrual_map.get(loan.loan, {}).get("accrued_interest")),
-				"accrued_principal": flt(accrual_map.get(loan.loan, {}).get("accrued_principal")),
-				"interest_outstanding": flt(accrual_map.get(loan.loan, {}).get("interest_outstanding")),
-				"penalty": flt(accrual_map.get(loan.loan, {}).get("penalty")),
-				"penalty_interest": penal_interest_rate_map.get(loan.loan_product),
-				"undue_interest": flt(accrual_map.get(loan.loan, {}).get("undue_interest")),
-				"loan_to_value": 0.0,
-				"currency": currency,
-			}
+	last_loan = None
+
+	while True:
+		page_filters = dict(filter_obj)
+		if last_loan:
+			page_filters["name"] = (">", last_loan)
+
+		loan_details = frappe.get_all(
+			"Loan",
+			fields=[
+				"name as loan",
+				"applicant_type",
+				"applicant as applicant_name",
+				"loan_product",
+				"disbursed_amount",
+				"rate_of_interest",
+				"total_payment",
+				"total_principal_paid",
+				"total_interest_payable",
+				"written_off_amount",
+				"status",
+			],
+			filters=page_filters,
+			order_by="name",
+			limit_page_length=page_length,
 		)
 
-		loan["total_outstanding"] = (
-			loan["principal_outstanding"] + loan["interest_outstanding"] + loan["penalty"]
+		if not loan_details:
+			break
+
+		last_loan = loan_details[-1].loan
+		loan_list = [d.loan for d in loan_details]
+
+		current_pledges = get_loan_wise_pledges(filters, loan_list)
+		loan_wise_security_value = get_loan_wise_security_value(
+			filters, current_pledges, loan_security_details
 		)
 
-		if loan_wise_security_value.get(loan.loan):
-			loan["loan_to_value"] = flt(
-				(loan["principal_outstanding"] * 100) / loan_wise_security_value.get(loan.loan)
+		sanctioned_amount_map = get_sanctioned_amount_map(list({d.applicant_name for d in loan_details}))
+		payments = get_payments(loan_list, filters)
+		accrual_map = get_interest_accruals(loan_list, filters)
+
+		for loan in loan_details:
+			set_loan_amounts(
+				loan,
+				sanctioned_amount_map,
+				payments,
+				accrual_map,
+				penal_interest_rate_map,
+				loan_wise_security_value,
+				currency,
 			)
 
-	return loan_details
+		yield loan_details
+
+		if len(loan_details) < page_length:
+			break
+
+
+def set_loan_amounts(
+	loan,
+	sanctioned_amount_map,
+	payments,
+	accrual_map,
+	penal_interest_rate_map,
+	loan_wise_security_value,
+	currency,
+):
+	total_payment = loan.total_payment if loan.status == "Disbursed" else loan.disbursed_amount
+
+	loan.update(
+		{
+			"sanctioned_amount": flt(sanctioned_amount_map.get(loan.applicant_name)),
+			"principal_outstanding": flt(total_payment)
+			- flt(loan.total_principal_paid)
+			- flt(loan.total_interest_payable)
+			- flt(loan.written_off_amount),
+			"total_repayment": flt(payments.get(loan.loan)),
+			"accrued_interest": flt(accrual_map.get(loan.loan, {}).get("accrued_interest")),
+			"accrued_principal": flt(accrual_map.get(loan.loan, {}).get("accrued_principal")),
+			"interest_outstanding": flt(accrual_map.get(loan.loan, {}).get("interest_outstanding")),
+			"penalty": flt(accrual_map.get(loan.loan, {}).get("penalty")),
+			"penalty_interest": penal_interest_rate_map.get(loan.loan_product),
+			"undue_interest": flt(accrual_map.get(loan.loan, {}).get("undue_interest")),
+			"loan_to_value": 0.0,
+			"currency": currency,
+		}
+	)
+
+	loan["total_outstanding"] = (
+		loan["principal_outstanding"] + loan["interest_outstanding"] + loan["penalty"]
+	)
+
+	if loan_wise_security_value.get(loan.loan):
+		loan["loan_to_value"] = flt(
+			(loan["principal_outstanding"] * 100) / loan_wise_security_value.get(loan.loan)
+		)
+
+
+@frappe.whitelist()
+def export_to_csv(filters):
+	"""Write the report to a private CSV file in the background and notify the user once done"""
+	frappe.has_permission("Loan Interest Accrual", "report", throw=True)
+
+	if isinstance(filters, str):
+		filters = json.loads(filters)
+
+	frappe.enqueue(
+		write_report_csv,
+		queue="long",
+		timeout=3600,
+		filters=filters,
+		user=frappe.session.user,
+	)
+
+	frappe.msgprint(_("The report will be available in your files once it is generated"), alert=True)
+
+
+def write_report_csv(filters, user):
+	columns = get_columns()
+	file_name = "loan-interest-report-{0}.csv".format(frappe.generate_hash(length=8))
+	file_path = frappe.get_site_path("private", "files", file_name)
+
+	with open(file_path, "w", newline="") as f:
+		writer = csv.writer(f)
+		writer.writerow([column["label"] for column in columns])
+
+		for page in get_loan_detail_pages(filters):
+			writer.writerows([[row.get(column["fieldname"]) for column in columns] for row in page])
+
+	file_doc = frappe.get_doc(
+		{
+			"doctype": "File",
+			"file_name": file_name,
+			"file_url": "/private/files/" + file_name,
+			"is_private": 1,
+			"owner": user,
+		}
+	).insert(ignore_permissions=True)
+
+	frappe.publish_realtime(
+		"msgprint",
+		_("Loan Interest Report is ready: {0}").format(
+			'<a href="{0}">{1}</a>'.format(file_doc.file_url, file_name)
+		),
+		user=user,
+	)
 
 
-def get_sanctioned_amount_map():
+def get_sanctioned_amount_map(applicants=None):
+	filters = {"applicant": ("in", applicants)} if applicants else {}
+
 	return frappe._dict(
 		frappe.get_all(
-			"Sanctioned Loan Amount", fields=["applicant", "sanctioned_amount_limit"], as_list=1
+			"Sanctioned Loan Amount",
+			fields=["applicant", "sanctioned_amount_limit"],
+			filters=filters,
+			as_list=1,
 		)
 	)
 
@@ -247,66 +358,56 @@ def get_payments(loans, filters):
 
 
 def get_interest_accruals(loans, filters):
-	accrual_map = {}
-	query_filters = {"loan": ("in", loans)}
+	"""Accrued, outstanding and undue interest per loan, aggregated in SQL
+
+	Accruals posted up to the last regular accrual of a loan are due, later ones are undue.
+	The penalty is the one booked with the last regular accrual.
+	"""
+	if not loans:
+		return {}
 
+	conditions = ""
 	if filters.get("from_date"):
-		query_filters.update({"posting_date": (">=", filters.get("from_date"))})
+		conditions += " AND posting_date >= %(from_date)s"
 
 	if filters.get("to_date"):
-		query_filters.update({"posting_date": ("<=", filters.get("to_date"))})
+		conditions += " AND posting_date <= %(to_date)s"
 
-	interest_accruals = frappe.get_all(
-		"Loan Interest Accrual",
-		fields=[
-			"loan",
-			"interest_amount",
-			"posting_date",
-			"penalty_amount",
-			"paid_interest_amount",
-			"accrual_type",
-			"payable_principal_amount",
-		],
-		filters=query_filters,
-		order_by="posting_date desc",
+	accruals = frappe.db.sql(
+		"""
+		SELECT lia.loan,
+			SUM(lia.interest_amount) as accrued_interest,
+			SUM(lia.payable_principal_amount) as accrued_principal,
+			SUM(CASE WHEN lia.posting_date <= r.last_accrual_date
+				THEN lia.interest_amount - lia.paid_interest_amount ELSE 0 END) as interest_outstanding,
+			SUM(CASE WHEN r.last_accrual_date IS NULL OR lia.posting_date > r.last_accrual_date
+				THEN lia.interest_amount - lia.paid_interest_amount ELSE 0 END) as undue_interest,
+			MAX(CASE WHEN lia.posting_date = r.last_accrual_date
+				THEN lia.penalty_amount END) as penalty
+		FROM `tabLoan Interest Accrual` lia
+		LEFT JOIN (
+			SELECT loan, MAX(posting_date) as last_accrual_date
+			FROM `tabLoan Interest Accrual`
+			WHERE loan in %(loans)s
+			AND accrual_type = 'Regular'
+			{conditions}
+			GROUP BY loan
+		) r ON r.loan = lia.loan
+		WHERE lia.loan in %(loans)s
+		{lia_conditions}
+		GROUP BY lia.loan
+	""".format(
+			conditions=conditions, lia_conditions=conditions.replace("posting_date", "lia.posting_date")
+		),
+		{
+			"loans": tuple(loans),
+			"from_date": filters.get("from_date"),
+			"to_date": filters.get("to_date"),
+		},
+		as_dict=1,
 	)
 
-	for entry in interest_accruals:
-		accrual_map.setdefault(
-			entry.loan,
-			{
-				"accrued_interest": 0.0,
-				"accrued_principal": 0.0,
-				"undue_interest": 0.0,
-				"interest_outstanding": 0.0,
-				"last_accrual_date": "",
-				"due_date": "",
-			},
-		)
-
-		if entry.accrual_type == "Regular":
-			if not accrual_map[entry.loan]["due_date"]:
-				accrual_map[entry.loan]["due_date"] = add_days(entry.posting_date, 1)
-			if not accrual_map[entry.loan]["last_accrual_date"]:
-				accrual_map[entry.loan]["last_accrual_date"] = entry.posting_date
-
-		due_date = accrual_map[entry.loan]["due_date"]
-		last_accrual_date = accrual_map[entry.loan]["last_accrual_date"]
-
-		if due_date and getdate(entry.posting_date) < getdate(due_date):
-			accrual_map[entry.loan]["interest_outstanding"] += (
-				entry.interest_amount - entry.paid_interest_amount
-			)
-		else:
-			accrual_map[entry.loan]["undue_interest"] += entry.interest_amount - entry.paid_interest_amount
-
-		accrual_map[entry.loan]["accrued_interest"] += entry.interest_amount
-		accrual_map[entry.loan]["accrued_principal"] += entry.payable_principal_amount
-
-		if last_accrual_date and getdate(entry.posting_date) == last_accrual_date:
-			accrual_map[entry.loan]["penalty"] = entry.penalty_amount
-
-	return accrual_map
+	return {d.loan: d for d in accruals}
 
 
 def get_penal_interest_rate_map():
@@ -315,59 +416,29 @@ def get_penal_interest_rate_map():
 	)
 
 
-def get_loan_wise_pledges(filters):
-	loan_wise_unpledges = {}
-	current_pledges = {}
-
-	conditions = ""
+def get_loan_wise_pledges(filters, loans=None):
+	query_filters = {}
 
 	if filters.get("company"):
-		conditions = "AND company = %(company)s"
-
-	unpledges = frappe.db.sql(
-		"""
-		SELECT up.loan, u.loan_security, sum(u.qty) as qty
-		FROM `tabLoan Security Unpledge` up, `tabUnpledge` u
-		WHERE u.parent = up.name
-		AND up.status = 'Approved'
-		{conditions}
-		GROUP BY up.loan, u.loan_security
-	""".format(
-			conditions=conditions
-		),
-		filters,
-		as_dict=1,
-	)
+		query_filters["company"] = filters.get("company")
 
-	for unpledge in unpledges:
-		loan_wise_unpledges.setdefault((unpledge.loan, unpledge.loan_security), unpledge.qty)
+	if loans:
+		query_filters["loan"] = ("in", loans)
 
-	pledges = frappe.db.sql(
-		"""
-		SELECT lp.loan, p.loan_security, sum(p.qty) as qty
-		FROM `tabLoan Security Pledge` lp, `tabPledge`p
-		WHERE p.parent = lp.name
-		AND lp.status = 'Pledged'
-		{conditions}
-		GROUP BY lp.loan, p.loan_security
-	""".format(
-			conditions=conditions
-		),
-		filters,
-		as_dict=1,
-	)
-
-	for security in pledges:
-		current_pledges.setdefault((security.loan, security.loan_security), security.qty)
-		current_pledges[(security.loan, security.loan_security)] -= loan_wise_unpledges.get(
-			(security.loan, security.loan_security), 0.0
+	return {
+		(d.loan, d.loan_security): d.qty
+		for d in frappe.get_all(
+			"Loan Security Position",
+			fields=["loan", "loan_security", "qty"],
+			filters=query_filters,
 		)
+	}
 
-	return current_pledges
 
+def get_loan_wise_security_value(filters, current_pledges, loan_security_details=None):
+	if loan_security_details is None:
+		loan_security_details = get_loan_security_details()
 
-def get_loan_wise_security_value(filters, current_pledges):
-	loan_security_details = get_loan_security_details()
 	loan_wise_security_value = {}
 
 	for key in current_pledges:
@@ -7,8 +7,10 @@ from frappe.utils import flt
 
 import erpnext
 
+from lending.loan_management.doctype.loan_security_position.loan_security_position import (
+	get_loan_security_exposure,
+)
 from lending.loan_management.report.applicant_wise_loan_security_exposure.applicant_wise_loan_security_exposure import (
-	get_applicant_wise_total_loan_security_qty,
 	get_loan_security_details,
 )
 
@@ -129,19 +131,13 @@ def get_data(filters):
 
 
 def get_company_wise_loan_security_details(filters, loan_security_details):
-	pledge_values, total_value_map, applicant_type_map = get_applicant_wise_total_loan_security_qty(
-		filters, loan_security_details
-	)
-
 	total_portfolio_value = 0
 	security_wise_map = {}
-	for key, qty in pledge_values.items():
-		security_wise_map.setdefault(key[1], {"qty": 0.0, "applicant_count": 0.0})
-
-		security_wise_map[key[1]]["qty"] += qty
-		if qty:
-			security_wise_map[key[1]]["applicant_count"] += 1
 
-		total_portfolio_value += flt(qty * loan_security_details.get(key[1], {}).get("latest_price", 0))
+	for d in get_loan_security_exposure(filters.get("company")):
+		security_wise_map[d.loan_security] = {"qty": d.qty, "applicant_count": d.applicant_count}
+		total_portfolio_value += flt(
+			d.qty * loan_security_details.get(d.loan_security, {}).get("latest_price", 0)
+		)
 
 	return security_wise_map, total_portfolio_value
@@ -1,15 +1,29 @@
 from pypika import CustomFunction
+from pypika.terms import Case
 
 import frappe
+from frappe.model.naming import parse_naming_series
 from frappe.query_builder.custom import ConstantColumn
-from frappe.query_builder.functions import Sum
-from frappe.utils import flt, getdate
+from frappe.query_builder.functions import Count, Sum
+from frappe.utils import cint, flt, get_datetime, getdate, now_datetime
 
 
 def get_payment_entries_for_bank_clearance(
-	from_date, to_date, account, bank_account, include_reconciled_entries, include_pos_transactions
+	from_date,
+	to_date,
+	account,
+	bank_account,
+	include_reconciled_entries,
+	include_pos_transactions,
+	page_length=None,
+	after=None,
 ):
-	entries = []
+	"""Loan disbursements and repayments for the Bank Clearance tool
+
+	Everything in the range is returned unless `page_length` is set, see `get_keyset_page` for
+	paging through the entries.
+	"""
+	queries = []
 
 	loan_disbursement = frappe.qb.DocType("Loan Disbursement")
 
@@ -30,14 +44,14 @@ def get_payment_entries_for_bank_clearance(
 		.where(loan_disbursement.disbursement_date >= from_date)
 		.where(loan_disbursement.disbursement_date <= to_date)
 		.where(loan_disbursement.disbursement_account.isin([bank_account, account]))
-		.orderby(loan_disbursement.disbursement_date)
-		.orderby(loan_disbursement.name, order=frappe.qb.desc)
 	)
 
 	if not include_reconciled_entries:
 		query = query.where(loan_disbursement.clearance_date.isnull())
 
-	loan_disbursements = query.run(as_dict=1)
+	queries.append(
+		("Loan Disbursement", query, loan_disbursement.disbursement_date, loan_disbursement.name)
+	)
 
 	loan_repayment = frappe.qb.DocType("Loan Repayment")
 
@@ -66,17 +80,152 @@ def get_payment_entries_for_bank_clearance(
 	if frappe.db.has_column("Loan Repayment", "repay_from_salary"):
 		query = query.where((loan_repayment.repay_from_salary == 0))
 
-	query = query.orderby(loan_repayment.posting_date).orderby(
-		loan_repayment.name, order=frappe.qb.desc
-	)
+	queries.append(("Loan Repayment", query, loan_repayment.posting_date, loan_repayment.name))
 
-	loan_repayments = query.run(as_dict=True)
+	if page_length:
+		return get_keyset_page(queries, page_length, after)
 
-	entries = list(loan_disbursements) + list(loan_repayments)
+	entries = []
+	for doctype, query, posting_date, name in queries:
+		entries.extend(query.orderby(posting_date).orderby(name, order=frappe.qb.desc).run(as_dict=1))
 
 	return entries
 
 
+@frappe.whitelist()
+def get_loan_entries_for_bank_clearance(
+	account,
+	from_date,
+	to_date,
+	bank_account=None,
+	include_reconciled_entries=0,
+	page_length=500,
+	after=None,
+):
+	"""One page of the loan vouchers of the Bank Clearance tool
+
+	Returns the entries and the cursor to pass as `after` for the next page, None on the last one.
+	"""
+	for doctype in ("Loan Disbursement", "Loan Repayment"):
+		frappe.has_permission(doctype, "read", throw=True)
+
+	page_length = cint(page_length) or 500
+	entries = get_payment_entries_for_bank_clearance(
+		from_date,
+		to_date,
+		account,
+		bank_account,
+		cint(include_reconciled_entries),
+		0,
+		page_length=page_length,
+		after=after,
+	)
+
+	return {
+		"entries": entries,
+		"after": get_keyset_cursor(entries[-1]) if len(entries) == page_length else None,
+	}
+
+
+@frappe.whitelist()
+def get_loan_totals_for_bank_clearance(account, from_date, to_date, bank_account=None):
+	"""Count and amounts of the loan vouchers of a Bank Clearance range, cleared and uncleared,
+	aggregated in SQL for each doctype"""
+	totals = {}
+	for doctype in ("Loan Disbursement", "Loan Repayment"):
+		frappe.has_permission(doctype, "read", throw=True)
+
+		loan_doc = frappe.qb.DocType(doctype)
+
+		if doctype == "Loan Disbursement":
+			amount = loan_doc.disbursed_amount
+			posting_date = loan_doc.disbursement_date
+			bank_account_field = loan_doc.disbursement_account
+		else:
+			amount = loan_doc.amount_paid
+			posting_date = loan_doc.posting_date
+			bank_account_field = loan_doc.payment_account
+
+		cleared = Case().when(loan_doc.clearance_date.isnotnull(), 1).else_(0)
+
+		query = (
+			frappe.qb.from_(loan_doc)
+			.select(
+				Count(loan_doc.name).as_("count"),
+				Sum(cleared).as_("cleared_count"),
+				Sum(amount).as_("amount"),
+				Sum(amount * cleared).as_("cleared_amount"),
+			)
+			.where(loan_doc.docstatus == 1)
+			.where(posting_date >= from_date)
+			.where(posting_date <= to_date)
+			.where(bank_account_field.isin([bank_account, account]))
+		)
+
+		if doctype == "Loan Repayment" and frappe.db.has_column("Loan Repayment", "repay_from_salary"):
+			query = query.where((loan_doc.repay_from_salary == 0))
+
+		row = query.run(as_dict=1)[0]
+		totals[doctype] = frappe._dict(
+			{
+				"count": cint(row.count),
+				"cleared_count": cint(row.cleared_count),
+				"uncleared_count": cint(row.count) - cint(row.cleared_count),
+				"amount": flt(row.amount),
+				"cleared_amount": flt(row.cleared_amount),
+				"uncleared_amount": flt(row.amount) - flt(row.cleared_amount),
+			}
+		)
+
+	return totals
+
+
+def get_keyset_page(queries, page_length, after=None):
+	"""Next `page_length` rows of `queries` in (posting date, payment document, payment entry) order
+
+	`queries` are (doctype, query, posting date field, name field) tuples whose rows have
+	`payment_document` and `payment_entry` columns, `after` is the cursor of the last row of the
+	previous page. Each query reads at most `page_length` rows past the cursor through the
+	posting date index, so no page materializes the rest of the range.
+	"""
+	if isinstance(after, str):
+		after = frappe.parse_json(after)
+
+	if after:
+		after_datetime, after_doctype, after_name = after
+		after_datetime = get_datetime(after_datetime)
+
+	rows = []
+	for doctype, query, posting_date, name in queries:
+		if after:
+			if frappe.get_meta(doctype).get_field(posting_date.name).fieldtype == "Date":
+				# dates sort as midnight, so they only tie with a cursor at midnight
+				after_date = getdate(after_datetime)
+				is_tied = get_datetime(after_date) == after_datetime
+			else:
+				after_date, is_tied = after_datetime, True
+
+			after_date = str(after_date)
+
+			condition = posting_date > after_date
+			if is_tied and doctype > after_doctype:
+				condition |= posting_date == after_date
+			elif is_tied and doctype == after_doctype:
+				condition |= (posting_date == after_date) & (name > after_name)
+
+			query = query.where(condition)
+
+		rows.extend(query.orderby(posting_date).orderby(name).limit(page_length).run(as_dict=1))
+
+	rows.sort(key=lambda d: (get_datetime(d.posting_date), d.payment_document, d.payment_entry))
+
+	return rows[:page_length]
+
+
+def get_keyset_cursor(row):
+	return [str(get_datetime(row.posting_date)), row.payment_document, row.payment_entry]
+
+
 def get_matching_queries(
 	bank_account,
 	company,
@@ -183,6 +332,172 @@ def get_lr_matching_query(bank_account, exact_match, transaction):
 	return query
 
 
+@frappe.whitelist()
+def get_matching_loan_vouchers(
+	bank_account, from_date, to_date, exact_match=0, document_types=None
+):
+	"""Match all unreconciled Bank Transactions of a Bank Account in a date window at once
+
+	Batch counterpart of `get_matching_queries`: candidate loan disbursements and repayments are
+	loaded once for the whole statement and ranked against each transaction in memory, the same
+	way as the matching queries. Returns a map of Bank Transaction to its matches, best first.
+	"""
+	frappe.has_permission("Bank Transaction", "read", throw=True)
+
+	document_types = frappe.parse_json(document_types) or ["loan_disbursement", "loan_repayment"]
+	account = frappe.db.get_value("Bank Account", bank_account, "account")
+
+	transactions = frappe.get_all(
+		"Bank Transaction",
+		filters={
+			"bank_account": bank_account,
+			"docstatus": 1,
+			"unallocated_amount": (">", 0),
+			"date": ("between", [from_date, to_date]),
+		},
+		fields=[
+			"name",
+			"deposit",
+			"withdrawal",
+			"unallocated_amount",
+			"reference_number",
+			"party_type",
+			"party",
+		],
+	)
+
+	if not transactions:
+		return {}
+
+	index = get_loan_vouchers_for_matching(account, document_types)
+
+	return {d.name: match_loan_vouchers(d, index, cint(exact_match)) for d in transactions}
+
+
+def get_loan_vouchers_for_matching(bank_account, document_types):
+	"""Unreconciled loan vouchers of `bank_account` (the GL account), indexed by amount,
+	reference number and party for `match_loan_vouchers`
+
+	Like the matching queries, vouchers of any posting date are loaded, as a cheque or transfer
+	can clear well after it was posted.
+	"""
+	vouchers = []
+
+	if "loan_disbursement" in document_types:
+		loan_disbursement = frappe.qb.DocType("Loan Disbursement")
+
+		query = (
+			frappe.qb.from_(loan_disbursement)
+			.select(
+				ConstantColumn("Loan Disbursement").as_("doctype"),
+				loan_disbursement.name,
+				(loan_disbursement.disbursed_amount).as_("paid_amount"),
+				(loan_disbursement.reference_number).as_("reference_no"),
+				loan_disbursement.reference_date,
+				(loan_disbursement.applicant_type).as_("party_type"),
+				(loan_disbursement.applicant).as_("party"),
+				(loan_disbursement.disbursement_date).as_("posting_date"),
+			)
+			.where(loan_disbursement.docstatus == 1)
+			.where(loan_disbursement.clearance_date.isnull())
+			.where(loan_disbursement.disbursement_account == bank_account)
+			.where(loan_disbursement.disbursed_amount > 0.0)
+		)
+
+		vouchers.extend(query.run(as_dict=1))
+
+	if "loan_repayment" in document_types:
+		loan_repayment = frappe.qb.DocType("Loan Repayment")
+
+		query = (
+			frappe.qb.from_(loan_repayment)
+			.select(
+				ConstantColumn("Loan Repayment").as_("doctype"),
+				loan_repayment.name,
+				(loan_repayment.amount_paid).as_("paid_amount"),
+				(loan_repayment.reference_number).as_("reference_no"),
+				loan_repayment.reference_date,
+				(loan_repayment.applicant_type).as_("party_type"),
+				(loan_repayment.applicant).as_("party"),
+				loan_repayment.posting_date,
+			)
+			.where(loan_repayment.docstatus == 1)
+			.where(loan_repayment.clearance_date.isnull())
+			.where(loan_repayment.payment_account == bank_account)
+			.where(loan_repayment.amount_paid > 0.0)
+		)
+
+		if frappe.db.has_column("Loan Repayment", "repay_from_salary"):
+			query = query.where((loan_repayment.repay_from_salary == 0))
+
+		vouchers.extend(query.run(as_dict=1))
+
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	index = {"amount": {}, "reference_no": {}, "party": {}}
+
+	for voucher in vouchers:
+		index["amount"].setdefault((voucher.doctype, flt(voucher.paid_amount, precision)), []).append(
+			voucher
+		)
+
+		if voucher.reference_no:
+			index["reference_no"].setdefault((voucher.doctype, voucher.reference_no), []).append(voucher)
+
+		if voucher.party:
+			index["party"].setdefault((voucher.doctype, voucher.party_type, voucher.party), []).append(
+				voucher
+			)
+
+	return index
+
+
+def match_loan_vouchers(transaction, index, exact_match=False):
+	"""Rank the indexed vouchers for a Bank Transaction like `get_ld_matching_query` and
+	`get_lr_matching_query`: one point each for a matching reference number and party
+
+	Unless `exact_match` is set, vouchers of any amount match on reference number or party, but
+	vouchers sharing neither the amount, reference number nor party are not returned.
+	"""
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	doctypes = []
+
+	if flt(transaction.withdrawal) > 0.0:
+		doctypes.append("Loan Disbursement")
+
+	if flt(transaction.deposit) > 0.0:
+		doctypes.append("Loan Repayment")
+
+	matches = {}
+	for doctype in doctypes:
+		candidates = index["amount"].get((doctype, flt(transaction.unallocated_amount, precision)), [])
+
+		if not exact_match:
+			candidates = (
+				candidates
+				+ index["reference_no"].get((doctype, transaction.reference_number), [])
+				+ index["party"].get((doctype, transaction.party_type, transaction.party), [])
+			)
+
+		for voucher in candidates:
+			if (doctype, voucher.name) in matches:
+				continue
+
+			rank = 1
+			if transaction.reference_number and voucher.reference_no == transaction.reference_number:
+				rank += 1
+
+			if (
+				transaction.party
+				and voucher.party_type == transaction.party_type
+				and voucher.party == transaction.party
+			):
+				rank += 1
+
+			matches[(doctype, voucher.name)] = frappe._dict(voucher, rank=rank)
+
+	return sorted(matches.values(), key=lambda d: d.rank, reverse=True)
+
+
 def get_entries_for_bank_clearance_summary(filters):
 	entries = []
 
@@ -247,19 +562,20 @@ def get_entries_for_bank_clearance_summary(filters):
 	return entries
 
 
-def get_entries_for_bank_reconciliation_statement(filters):
-	loan_entries = []
+def get_entries_for_bank_reconciliation_statement(filters, page_length=None, after=None):
+	"""Uncleared loan vouchers as on the report date, a page at a time if `page_length` is set"""
+	queries = []
 	for doctype in ["Loan Disbursement", "Loan Repayment"]:
 		loan_doc = frappe.qb.DocType(doctype)
 		ifnull = CustomFunction("IFNULL", ["value", "default"])
 
 		if doctype == "Loan Disbursement":
 			amount_field = (loan_doc.disbursed_amount).as_("credit")
-			posting_date = (loan_doc.disbursement_date).as_("posting_date")
+			posting_date = loan_doc.disbursement_date
 			account = loan_doc.disbursement_account
 		else:
 			amount_field = (loan_doc.amount_paid).as_("debit")
-			posting_date = (loan_doc.posting_date).as_("posting_date")
+			posting_date = loan_doc.posting_date
 			account = loan_doc.payment_account
 
 		query = (
@@ -270,7 +586,7 @@ def get_entries_for_bank_reconciliation_statement(filters):
 				(loan_doc.reference_number).as_("reference_no"),
 				(loan_doc.reference_date).as_("ref_date"),
 				amount_field,
-				posting_date,
+				posting_date.as_("posting_date"),
 			)
 			.where(loan_doc.docstatus == 1)
 			.where(account == filters.get("account"))
@@ -281,10 +597,16 @@ def get_entries_for_bank_reconciliation_statement(filters):
 		if doctype == "Loan Repayment" and frappe.db.has_column("Loan Repayment", "repay_from_salary"):
 			query = query.where((loan_doc.repay_from_salary == 0))
 
-		entries = query.run(as_dict=1)
-		loan_entries.extend(entries)
+		queries.append((doctype, query, posting_date, loan_doc.name))
 
-	return list(loan_entries)
+	if page_length:
+		return get_keyset_page(queries, page_length, after)
+
+	loan_entries = []
+	for doctype, query, posting_date, name in queries:
+		loan_entries.extend(query.run(as_dict=1))
+
+	return loan_entries
 
 
 def get_amounts_not_reflected_in_system_for_bank_reconciliation_statement(filters):
@@ -318,3 +640,145 @@ def get_amounts_not_reflected_in_system_for_bank_reconciliation_statement(filter
 		total_amount += flt(amount)
 
 	return total_amount
+
+
+def get_series_names(series, count):
+	"""Reserve `count` consecutive names from an old style naming series like `LM-LIA-.#####`
+
+	The series counter is locked and advanced once for the whole batch instead of once per document.
+	Date parts in the prefix (like `.YYYY.`) are resolved the same way as in `make_autoname`.
+	"""
+	prefix, hashes = series.rsplit(".", 1)
+	prefix = parse_naming_series(prefix)
+	digits = len(hashes)
+
+	series_table = frappe.qb.DocType("Series")
+	current = (
+		frappe.qb.from_(series_table)
+		.select(series_table.current)
+		.where(series_table.name == prefix)
+		.for_update()
+		.run()
+	)
+
+	if current and current[0][0] is not None:
+		start = cint(current[0][0])
+		frappe.db.sql(
+			"UPDATE `tabSeries` SET `current` = `current` + %s WHERE `name` = %s", (count, prefix)
+		)
+	else:
+		start = 0
+		frappe.db.sql("INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)", (prefix, count))
+
+	return [prefix + str(start + i).zfill(digits) for i in range(1, count + 1)]
+
+
+def bulk_insert_docs(docs, chunk_size=10000, ignore_duplicates=False):
+	"""Write already named, in-memory documents (and their child rows) with multi-row inserts
+
+	No controller methods or hooks are run, callers are expected to have validated the documents.
+	With `ignore_duplicates`, rows whose name already exists are skipped.
+	"""
+	if not docs:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	rows_by_doctype = {}
+
+	for doc in docs:
+		for d in [doc] + doc.get_all_children():
+			if not d.name:
+				d.name = frappe.generate_hash(length=10)
+
+			d.owner = d.modified_by = user
+			d.creation = d.modified = now
+			d.docstatus = doc.docstatus
+
+			rows_by_doctype.setdefault(d.doctype, []).append(
+				d.get_valid_dict(convert_dates_to_str=True, ignore_virtual=True)
+			)
+
+	for doctype, rows in rows_by_doctype.items():
+		fields = list(rows[0])
+		frappe.db.bulk_insert(
+			doctype,
+			fields,
+			[[row.get(f) for f in fields] for row in rows],
+			ignore_duplicates=ignore_duplicates,
+			chunk_size=chunk_size,
+		)
+
+
+def get_hot_queries():
+	"""Queries on the accrual, repayment and security hot paths that must be served by an index"""
+	loan = frappe.db.get_value("Loan", {"docstatus": 1}, "name") or ""
+	posting_date = getdate()
+
+	return {
+		"Unpaid Accruals": (
+			"""SELECT name FROM `tabLoan Interest Accrual`
+			WHERE loan = %(loan)s AND due_date <= %(posting_date)s AND docstatus = 1""",
+			{"loan": loan, "posting_date": posting_date},
+		),
+		"Last Accrual Date": (
+			"""SELECT MAX(posting_date) FROM `tabLoan Interest Accrual`
+			WHERE loan = %(loan)s AND docstatus = 1""",
+			{"loan": loan},
+		),
+		"Due Term Loan Schedules": (
+			"""SELECT name FROM `tabRepayment Schedule`
+			WHERE is_accrued = 0 AND payment_date <= %(posting_date)s""",
+			{"posting_date": posting_date},
+		),
+		"Active Repayment Schedule": (
+			"""SELECT name FROM `tabLoan Repayment Schedule`
+			WHERE loan = %(loan)s AND status = 'Active' AND docstatus = 1""",
+			{"loan": loan},
+		),
+		"Penalty Details": (
+			"""SELECT MAX(posting_date) FROM `tabLoan Repayment` WHERE against_loan = %(loan)s""",
+			{"loan": loan},
+		),
+		"Future Repayments": (
+			"""SELECT posting_date FROM `tabLoan Repayment`
+			WHERE against_loan = %(loan)s AND posting_date > %(posting_date)s AND docstatus = 1""",
+			{"loan": loan, "posting_date": posting_date},
+		),
+		"Last Disbursement Date": (
+			"""SELECT MAX(posting_date) FROM `tabLoan Disbursement`
+			WHERE against_loan = %(loan)s AND posting_date < %(posting_date)s AND docstatus = 1""",
+			{"loan": loan, "posting_date": posting_date},
+		),
+		"Pledged Securities": (
+			"""SELECT name FROM `tabLoan Security Pledge` WHERE loan = %(loan)s AND status = 'Pledged'""",
+			{"loan": loan},
+		),
+		"Unpledged Securities": (
+			"""SELECT name FROM `tabLoan Security Unpledge` WHERE loan = %(loan)s AND status = 'Approved'""",
+			{"loan": loan},
+		),
+	}
+
+
+def get_full_table_scans():
+	"""EXPLAIN every hot query and return the ones that would scan a whole table
+
+	Can be run on a site with `bench execute lending.loan_management.utils.get_full_table_scans`
+	"""
+	full_table_scans = []
+
+	for title, (query, values) in get_hot_queries().items():
+		plan = frappe.db.sql("EXPLAIN " + query, values, as_dict=1)
+
+		if frappe.db.db_type == "postgres":
+			scanned_tables = [
+				d.get("QUERY PLAN") for d in plan if "Seq Scan" in (d.get("QUERY PLAN") or "")
+			]
+		else:
+			scanned_tables = [d.table for d in plan if d.type == "ALL"]
+
+		if scanned_tables:
+			full_table_scans.append({"query": title, "tables": scanned_tables})
+
+	return full_table_scans
@@ -0,0 +1,86 @@
+import frappe
+from frappe.utils import cint, flt, getdate
+
+from lending.loan_management.doctype.loan_penalty_accrual.loan_penalty_accrual import (
+	get_loan_penalty_accrual_doc,
+	submit_penalty_accruals_in_bulk,
+)
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	get_accrued_interest_entries_for_loans,
+	get_penalty_amount,
+)
+
+
+def execute():
+	"""Book the penalty pending on open loans as an opening Loan Penalty Accrual
+
+	Until now penalty was worked out on every repayment, for demand loans on top of the penalty
+	left unpaid by the last repayment, so the opening balance is computed the same way.
+	"""
+	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	posting_date = getdate()
+
+	repay_from_salary = (
+		"loan.repay_from_salary" if frappe.db.has_column("Loan", "repay_from_salary") else "0"
+	)
+	loans = frappe.db.sql(
+		f"""
+		SELECT loan.name, loan.company, loan.applicant_type, loan.applicant, loan.loan_product,
+			loan.cost_center, loan.penalty_income_account, loan.is_term_loan,
+			{repay_from_salary} AS repay_from_salary, product.penalty_interest_rate,
+			product.grace_period_in_days
+		FROM `tabLoan` loan
+		INNER JOIN `tabLoan Product` product ON product.name = loan.loan_product
+		WHERE loan.docstatus = 1
+		AND loan.status IN ('Disbursed', 'Partially Disbursed', 'Loan Closure Requested')
+		AND IFNULL(loan.penalty_income_account, '') != ''
+		AND IFNULL(product.penalty_receivable_account, '') != ''
+	""",  # nosec
+		as_dict=1,
+	)
+
+	for i in range(0, len(loans), 1000):
+		batch = loans[i : i + 1000]
+		loan_names = [d.name for d in batch]
+		accrued_interest_entries = get_accrued_interest_entries_for_loans(loan_names, posting_date)
+		penalty_details = get_penalty_details_from_repayments(loan_names)
+
+		accruals = []
+		for loan in batch:
+			computed_penalty_date, pending_penalty_amount = None, 0
+			if not loan.is_term_loan:
+				computed_penalty_date, pending_penalty_amount = penalty_details.get(loan.name, (None, 0))
+
+			penalty_amount = pending_penalty_amount + get_penalty_amount(
+				accrued_interest_entries.get(loan.name, []),
+				loan,
+				loan,
+				computed_penalty_date,
+				posting_date,
+			)
+
+			if flt(penalty_amount, precision) > 0:
+				accruals.append(
+					get_loan_penalty_accrual_doc(loan, posting_date, penalty_amount, accrual_type="Opening")
+				)
+
+		submit_penalty_accruals_in_bulk(accruals)
+
+
+def get_penalty_details_from_repayments(loans):
+	penalty_details = frappe.db.sql(
+		"""
+		SELECT lr.against_loan, MAX(lr.posting_date), SUM(lr.penalty_amount - lr.total_penalty_paid)
+		FROM `tabLoan Repayment` lr
+		INNER JOIN (
+			SELECT against_loan, MAX(posting_date) as posting_date FROM `tabLoan Repayment`
+			WHERE against_loan IN %(loans)s AND docstatus = 1 GROUP BY against_loan
+		) last_repayment ON last_repayment.against_loan = lr.against_loan
+		WHERE lr.posting_date >= last_repayment.posting_date AND lr.docstatus = 1
+		AND lr.against_loan IN %(loans)s
+		GROUP BY lr.against_loan
+	""",
+		{"loans": tuple(loans)},
+	)
+
+	return {d[0]: (d[1], flt(d[2])) for d in penalty_details}
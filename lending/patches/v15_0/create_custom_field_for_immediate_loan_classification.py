@@ -0,0 +1,26 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+	create_custom_fields(
+		{
+			"Company": [
+				{
+					"fieldname": "classify_loans_immediately_on_repayment",
+					"label": "Classify Loans Immediately on Repayment",
+					"fieldtype": "Check",
+					"insert_after": "min_days_bw_disbursement_first_repayment",
+					"description": "By default loans are reclassified in the background a few minutes after a repayment",
+				},
+			]
+		},
+		ignore_validate=True,
+	)
+
+	frappe.db.set_value(
+		"Custom Field",
+		{"name": "Company-loan_column_break"},
+		"insert_after",
+		"classify_loans_immediately_on_repayment",
+	)
@@ -0,0 +1,52 @@
+import frappe
+from frappe.utils import now_datetime
+
+
+def execute():
+	positions = frappe.db.sql(
+		"""
+		SELECT s.loan, l.applicant_type, l.applicant, l.company, s.loan_security,
+			ls.loan_security_type, SUM(s.qty)
+		FROM (
+			SELECT lp.loan, p.loan_security, p.qty, 1 as is_pledge
+			FROM `tabLoan Security Pledge` lp, `tabPledge` p
+			WHERE p.parent = lp.name
+			AND lp.status = 'Pledged'
+			UNION ALL
+			SELECT up.loan, u.loan_security, -1 * u.qty, 0 as is_pledge
+			FROM `tabLoan Security Unpledge` up, `tabUnpledge` u
+			WHERE u.parent = up.name
+			AND up.status = 'Approved'
+		) s, `tabLoan` l, `tabLoan Security` ls
+		WHERE l.name = s.loan
+		AND ls.name = s.loan_security
+		GROUP BY s.loan, s.loan_security, l.applicant_type, l.applicant, l.company, ls.loan_security_type
+		HAVING MAX(s.is_pledge) = 1
+	"""
+	)
+
+	if not positions:
+		return
+
+	now = now_datetime()
+	frappe.db.bulk_insert(
+		"Loan Security Position",
+		[
+			"name",
+			"loan",
+			"applicant_type",
+			"applicant",
+			"company",
+			"loan_security",
+			"loan_security_type",
+			"qty",
+			"owner",
+			"modified_by",
+			"creation",
+			"modified",
+		],
+		[
+			(frappe.generate_hash(length=10), *position, "Administrator", "Administrator", now, now)
+			for position in positions
+		],
+	)
@@ -0,0 +1,25 @@
+import frappe
+
+
+def execute():
+	frappe.db.sql(
+		"""
+		UPDATE `tabLoan` loan
+		INNER JOIN (
+			SELECT loan, MAX(posting_date) AS posting_date FROM `tabLoan Interest Accrual`
+			WHERE docstatus = 1 GROUP BY loan
+		) accrual ON accrual.loan = loan.name
+		SET loan.last_accrual_date = accrual.posting_date
+	"""
+	)
+
+	frappe.db.sql(
+		"""
+		UPDATE `tabLoan` loan
+		INNER JOIN (
+			SELECT against_loan, MAX(posting_date) AS posting_date FROM `tabLoan Disbursement`
+			WHERE docstatus = 1 GROUP BY against_loan
+		) disbursement ON disbursement.against_loan = loan.name
+		SET loan.last_disbursement_date = disbursement.posting_date
+	"""
+	)
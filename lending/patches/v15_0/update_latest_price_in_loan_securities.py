@@ -0,0 +1,17 @@
+import frappe
+
+
+def execute():
+	frappe.db.sql(
+		"""
+		UPDATE `tabLoan Security` ls
+		INNER JOIN `tabLoan Security Price` lsp ON lsp.loan_security = ls.name
+		INNER JOIN (
+			SELECT loan_security, MAX(valid_from) AS valid_from FROM `tabLoan Security Price`
+			GROUP BY loan_security
+		) latest ON latest.loan_security = lsp.loan_security AND latest.valid_from = lsp.valid_from
+		SET ls.latest_price = lsp.loan_security_price,
+			ls.latest_price_valid_from = lsp.valid_from,
+			ls.latest_price_valid_upto = lsp.valid_upto
+	"""
+	)
@@ -6,7 +6,7 @@ lending.common = {
 	setup_filters: function(doctype) {
 		frappe.ui.form.on(doctype, {
 			refresh: function(frm) {
-				if (['Loan Disbursement', 'Loan Repayment', 'Loan Interest Accrual', 'Loan Write Off'].includes(frm.doc.doctype)
+				if (['Loan Disbursement', 'Loan Repayment', 'Loan Interest Accrual', 'Loan Penalty Accrual', 'Loan Write Off'].includes(frm.doc.doctype)
 					&& frm.doc.docstatus > 0) {
 					cur_frm.add_custom_button(__('Accounting Ledger'), function() {
 						frappe.route_options = {